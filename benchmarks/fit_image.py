@@ -0,0 +1,133 @@
+"""Benchmark fitting 50 megapixel images into the upload limit, and the peak memory it takes.
+
+Usage: python benchmarks/fit_image.py [--megapixels 50]
+
+Each case runs fit_image in a fresh worker process, like the gallery-dl workers do, and reports the peak
+resident memory of that process (VmHWM on Linux; ru_maxrss elsewhere, which may include the memory of
+this process when the worker was forked). The synthetic images are smooth gradients with noise,
+which compress about as well as detailed illustrations.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+MEDIA = Path(__file__).parents[1] / "src" / "my_discord_bot" / "cogs"
+
+WORKER = """
+import json, resource, shutil, sys, time
+from pathlib import Path
+
+def max_rss():
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Kilobytes on Linux, bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+sys.path.append(sys.argv[1])
+import _media
+
+source, max_bytes, memory_bytes = Path(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+path = Path(sys.argv[5]) / f"input{source.suffix}"
+shutil.copy(source, path)
+start = time.monotonic()
+output = _media.fit_image(path, max_bytes, memory_bytes)
+print(json.dumps({
+    "seconds": time.monotonic() - start,
+    "size": output.stat().st_size if output else None,
+    "format": output.suffix if output else None,
+    "max_rss": max_rss(),
+}))
+"""
+
+
+def generate(directory: Path, megapixels: float) -> Path:
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    rng = np.random.default_rng(0)
+
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    for row in range(0, height, 512):
+        rows = min(512, height - row)
+        y = np.linspace(row, row + rows, rows, dtype=np.float32)[:, None] / height * 255
+        noise = rng.normal(0, 12, (rows, width, 3)).astype(np.float32)
+        block = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1) + noise
+        image[row : row + rows] = np.clip(block, 0, 255).astype(np.uint8)
+
+    path = directory / "source.jpg"
+    Image.fromarray(image).save(path, "JPEG", quality=95)
+    Image.fromarray(image).save(directory / "source.png", "PNG", compress_level=1)
+    return path
+
+
+def run(
+    source: Path, max_mib: float, memory_mib: int, directory: Path
+) -> dict[str, float]:
+    with tempfile.TemporaryDirectory(dir=directory) as workdir:
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                WORKER,
+                str(MEDIA),
+                str(source),
+                str(int(max_mib * 1024 * 1024)),
+                str(memory_mib * 1024 * 1024),
+                workdir,
+            ],
+            capture_output=True,
+            check=True,
+        )
+    return json.loads(output.stdout.decode().strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=float, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        directory = Path(tempdir)
+        start = time.monotonic()
+        jpeg = generate(directory, args.megapixels)
+        png = jpeg.with_suffix(".png")
+        with Image.open(jpeg) as image:
+            width, height = image.size
+        print(
+            f"{width}x{height} images generated in {time.monotonic() - start:.1f}s: "
+            f"JPEG {jpeg.stat().st_size / 1024 / 1024:.1f} MiB, PNG {png.stat().st_size / 1024 / 1024:.1f} MiB"
+        )
+
+        for source, max_mib, memory_mib in (
+            (jpeg, 8, 1024),
+            (jpeg, 3, 1024),
+            (png, 10, 1024),
+            (jpeg, 8, 512),
+            (jpeg, 8, 200),
+        ):
+            result = run(source, max_mib, memory_mib, directory)
+            outcome = (
+                f"{result['format']} {result['size'] / 1024 / 1024:.2f} MiB"
+                if result["size"] is not None
+                else "too big to process"
+            )
+            print(
+                f"{source.suffix[1:].upper()} to {max_mib} MiB (memory limit {memory_mib} MiB): "
+                f"{outcome} in {result['seconds']:.1f}s, peak RSS {result['max_rss'] / 1024 / 1024:.0f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
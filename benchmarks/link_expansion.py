@@ -0,0 +1,140 @@
+"""Benchmark the on_message listener of Pixiv link expansion, in messages per second.
+
+Usage: python benchmarks/link_expansion.py [--messages 200000] [--guilds 1000]
+
+Every message the bot can see goes through the listener, so its cost is paid by all messages, not only
+by the ones with links. A stream of fake chat messages from many guilds (1% of them with a Pixiv link)
+is fed to the listener with link expansion disabled everywhere, enabled in 10% of the guilds, and enabled
+everywhere (also without the "pixiv.net/" prefilter, and for messages without links only).
+Metadata lookups and replies are instant fakes, so only the listener itself is measured.
+"""
+
+import argparse
+import asyncio
+import random
+import string
+import sys
+import time
+import types
+from pathlib import Path
+
+from discord.ext import commands
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from my_discord_bot.cogs import general
+from my_discord_bot.cogs._pixiv_meta import Artwork
+from my_discord_bot.cogs.general import General
+
+LINK_RATE = 0.01
+
+
+class FakeMetadata:
+    async def fetch(self, artwork_id: int) -> Artwork:
+        return Artwork(
+            artwork_id,
+            "Title",
+            "Author",
+            1,
+            1,
+            False,
+            f"https://i.pximg.net/img-master/img/{artwork_id}_p0_master1200.jpg",
+        )
+
+    def image_url(self, artwork: Artwork, image_number: int) -> str:
+        return f"https://proxy.example/i/{artwork.id}_p{image_number - 1}.jpg"
+
+
+def fake_messages(
+    count: int, guilds: int, replies: list[dict]
+) -> list[types.SimpleNamespace]:
+    rng = random.Random(0)
+    words = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8)))
+        for _ in range(2000)
+    ]
+    authors = [types.SimpleNamespace(bot=rng.random() < 0.05) for _ in range(100)]
+
+    async def reply(**kwargs: object) -> None:
+        replies.append(kwargs)
+
+    messages = []
+    for _ in range(count):
+        content = " ".join(rng.choices(words, k=rng.randint(3, 20)))
+        if rng.random() < LINK_RATE:
+            content += f" https://www.pixiv.net/artworks/{rng.randint(1, 10**8)}"
+        guild_id = rng.randrange(guilds)
+        messages.append(
+            types.SimpleNamespace(
+                guild=types.SimpleNamespace(id=guild_id),
+                # A few channels per guild
+                channel=types.SimpleNamespace(id=guild_id * 10 + rng.randrange(10)),
+                author=rng.choice(authors),
+                content=content,
+                reply=reply,
+            )
+        )
+    return messages
+
+
+async def run(
+    messages: list[types.SimpleNamespace], expand_guilds: set[int], replies: list[dict]
+) -> float:
+    cog = types.SimpleNamespace(
+        expand_guilds=expand_guilds,
+        expand_cooldown=commands.CooldownMapping.from_cooldown(
+            5, 60, commands.BucketType.channel
+        ),
+        pixiv_meta=FakeMetadata(),
+    )
+    cog.artwork_embed = lambda artwork, image_number: General.artwork_embed(
+        cog, artwork, image_number
+    )
+
+    replies.clear()
+    start = time.perf_counter()
+    for message in messages:
+        await General.on_message(cog, message)
+    return len(messages) / (time.perf_counter() - start)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--guilds", type=int, default=1000)
+    args = parser.parse_args()
+
+    replies: list[dict] = []
+    messages = fake_messages(args.messages, args.guilds, replies)
+    print(
+        f"{len(messages)} messages in {args.guilds} guilds, "
+        f"{sum('pixiv.net/' in message.content for message in messages)} with a Pixiv link"
+    )
+
+    all_guilds = set(range(args.guilds))
+    without_links = [
+        message for message in messages if "pixiv.net/" not in message.content
+    ]
+    for name, stream, expand_guilds in (
+        ("Expansion disabled", messages, set()),
+        ("Expansion in 10% of guilds", messages, set(range(0, args.guilds, 10))),
+        ("Expansion in all guilds", messages, all_guilds),
+        ("Expansion in all guilds, messages without links", without_links, all_guilds),
+    ):
+        rate = await run(stream, expand_guilds, replies)
+        print(f"{name}: {rate:,.0f} messages/s, {len(replies)} replies")
+
+    # For comparison: Every message goes through the regex ("" is in every string)
+    prefilter = general.PIXIV_ARTWORK_PREFILTER
+    general.PIXIV_ARTWORK_PREFILTER = ""
+    try:
+        rate = await run(without_links, all_guilds, replies)
+    finally:
+        general.PIXIV_ARTWORK_PREFILTER = prefilter
+    print(
+        f"Expansion in all guilds, messages without links, without the prefilter: {rate:,.0f} messages/s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,248 @@
+"""Benchmark the database work of a YouTube poll cycle over many subscribed channels.
+
+Usage: python benchmarks/poll_cycle.py [--channels 1000] [--guilds 10] [--cycles 3]
+
+A temporary SQLite database (a file, so that commits are synced to disk like in production) is seeded with
+the channels, each subscribed to by one of the guilds. poll_channels then checks all of them, against an
+instant stand-in of the YouTube API where 10% of the channels have a new video. "DB time" is the time spent
+awaiting session.execute() and session.commit().
+
+For comparison, the writes of a cycle (the checks of all channels, and the announcements of the new videos)
+are also timed on their own: in a single bulk transaction like poll_channels does, and with a transaction
+per channel like the poller did before.
+"""
+
+import argparse
+import asyncio
+import datetime as dt
+import sys
+import tempfile
+import time
+import typing as ty
+from pathlib import Path
+from unittest import mock
+
+from sqlalchemy import event, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from my_discord_bot.cogs.subscription import ISO_FORMAT, Subscription
+from my_discord_bot.models import (
+    Announcement,
+    Guild,
+    ModelBase,
+    YoutubeChannel,
+)
+from my_discord_bot.models import Subscription as Sub
+
+NEW_VIDEO_RATE = 0.1
+
+
+class TimedSession(AsyncSession):
+    """Session adding up the time spent in the database, for all its instances."""
+
+    seconds = 0.0
+    commits = 0
+
+    async def execute(self, *args: ty.Any, **kwargs: ty.Any) -> ty.Any:
+        start = time.perf_counter()
+        try:
+            return await super().execute(*args, **kwargs)
+        finally:
+            TimedSession.seconds += time.perf_counter() - start
+
+    async def commit(self) -> None:
+        start = time.perf_counter()
+        try:
+            await super().commit()
+        finally:
+            TimedSession.seconds += time.perf_counter() - start
+            TimedSession.commits += 1
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.seconds = 0.0
+        cls.commits = 0
+
+
+async def seed(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    channels: int,
+    guilds: int,
+    last_checked_at: dt.datetime,
+) -> ty.List[int]:
+    """Return the IDs of the channels."""
+
+    async with sessionmaker() as session:
+        guild_rows = [
+            Guild(guild_id=i, guild_name=f"Guild {i}", bot_channel=i)
+            for i in range(guilds)
+        ]
+        channel_rows = [
+            YoutubeChannel(
+                youtube_channel_id=f"UC{i:022d}",
+                youtube_channel_name=f"Channel {i}",
+                youtube_upload_playlist=f"UU{i:022d}",
+                last_checked_at=last_checked_at,
+            )
+            for i in range(channels)
+        ]
+        session.add_all(
+            Sub(guild=guild_rows[i % guilds], channel=channel)
+            for i, channel in enumerate(channel_rows)
+        )
+        await session.commit()
+        return [channel.id for channel in channel_rows]
+
+
+def fake_youtube(
+    now: dt.datetime,
+) -> ty.Callable[..., ty.Awaitable[ty.Dict[str, ty.Any]]]:
+    """Return a stand-in of YouTubeClient.request_if_modified, serving the first page of upload playlists."""
+
+    async def request_if_modified(
+        resource: str, etag: str | None, **params: str | int
+    ) -> ty.Dict[str, ty.Any]:
+        number = int(str(params["playlistId"])[2:])
+        # Uploads every day; Some channels uploaded an hour ago
+        newest = now - dt.timedelta(
+            hours=1 if number % round(1 / NEW_VIDEO_RATE) == 0 else 25
+        )
+        return {
+            "etag": f"etag-{number}-{newest.timestamp():.0f}",
+            "items": [
+                {
+                    "contentDetails": {
+                        "videoId": f"{number}-{i}",
+                        "videoPublishedAt": (newest - dt.timedelta(days=i)).strftime(
+                            ISO_FORMAT
+                        ),
+                    }
+                }
+                for i in range(5)
+            ],
+        }
+
+    return request_if_modified
+
+
+async def save_checks(
+    sessionmaker: async_sessionmaker[AsyncSession],
+    channel_ids: ty.List[int],
+    guilds: int,
+    now: dt.datetime,
+    per_channel: bool,
+) -> None:
+    """Save the checks of the channels and the announcements of their new videos,
+    in one transaction or a transaction per channel."""
+
+    checks = [
+        {"id": channel_id, "last_checked_at": now, "upload_interval": 86400}
+        for channel_id in channel_ids
+    ]
+    announcements = [
+        [{"video_id": f"{i}-0", "guild_id": i % guilds + 1, "channel_id": channel_id}]
+        if i % round(1 / NEW_VIDEO_RATE) == 0
+        else []
+        for i, channel_id in enumerate(channel_ids)
+    ]
+
+    async with sessionmaker() as session:
+        if not per_channel:
+            await session.execute(update(YoutubeChannel), checks)
+            await session.execute(
+                insert(Announcement).on_conflict_do_nothing(),
+                [row for rows in announcements for row in rows],
+            )
+            await session.commit()
+            return
+
+        for check, rows in zip(checks, announcements):
+            await session.execute(update(YoutubeChannel), [check])
+            if rows:
+                await session.execute(
+                    insert(Announcement).on_conflict_do_nothing(), rows
+                )
+            await session.commit()
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=1000)
+    parser.add_argument("--guilds", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tempdir}/db.sqlite3")
+
+        @event.listens_for(engine.sync_engine, "connect")
+        def set_sqlite_pragma(
+            dbapi_connection: ty.Any, connection_record: ty.Any
+        ) -> None:
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+        async with engine.begin() as connection:
+            await connection.run_sync(ModelBase.metadata.create_all)
+        sessionmaker = async_sessionmaker(
+            engine, class_=TimedSession, expire_on_commit=False
+        )
+
+        now = dt.datetime.now(dt.UTC).replace(tzinfo=None)
+        last_checked_at = now - dt.timedelta(hours=2)
+        channel_ids = await seed(
+            sessionmaker, args.channels, args.guilds, last_checked_at
+        )
+        print(
+            f"{args.channels} channels subscribed to by {args.guilds} guilds, "
+            f"{NEW_VIDEO_RATE:.0%} of them with a new video"
+        )
+
+        bot = mock.Mock()
+        bot.wait_until_ready = asyncio.Event().wait
+        cog = Subscription(bot, sessionmaker)
+        cog.check_subscription.cancel()
+        cog.youtube.request_if_modified = fake_youtube(now)
+
+        async def reset() -> None:
+            # Every cycle finds the same new videos
+            async with engine.begin() as connection:
+                await connection.execute(
+                    update(YoutubeChannel).values(last_checked_at=last_checked_at)
+                )
+                await connection.execute(Announcement.__table__.delete())
+
+        for cycle in range(args.cycles):
+            await reset()
+
+            TimedSession.reset()
+            start = time.perf_counter()
+            await cog.poll_channels(channel_ids, {})
+            total = time.perf_counter() - start
+            print(
+                f"Cycle {cycle + 1}: {total:.3f}s, DB time {TimedSession.seconds:.3f}s "
+                f"({TimedSession.commits} commits)"
+            )
+
+        for name, per_channel in (
+            ("one transaction", False),
+            ("a transaction per channel", True),
+        ):
+            await reset()
+            TimedSession.reset()
+            await save_checks(sessionmaker, channel_ids, args.guilds, now, per_channel)
+            print(
+                f"Writes of a cycle in {name}: DB time {TimedSession.seconds:.3f}s "
+                f"({TimedSession.commits} commits)"
+            )
+
+        await cog.cog_unload()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
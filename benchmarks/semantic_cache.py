@@ -0,0 +1,124 @@
+"""Benchmark semantic cache searches over synthetic embeddings.
+
+Usage: python benchmarks/semantic_cache.py [--entries 100000] [--dims 384 1536]
+
+Synthetic prompts are drawn around topic centers, so that unrelated prompts are still fairly similar
+(as with real embeddings), and each query is a paraphrase (cosine similarity about 0.96) of one stored prompt.
+"Front-loaded" vectors have most of their variance in the leading dimensions, like the embeddings of
+models trained for truncation (e.g. OpenAI text-embedding-3); "Uniform" vectors do not.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "src"))
+
+from my_discord_bot.cogs._semantic_cache import SemanticCache, VectorIndex
+
+QUERIES = 200
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(
+        np.float32
+    )
+
+
+def synthetic(
+    rng: np.random.Generator, entries: int, dim: int, front_loaded: bool
+) -> np.ndarray:
+    scale = (
+        1 / np.sqrt(np.arange(1, dim + 1)) if front_loaded else np.ones(dim)
+    ).astype(np.float32)
+    topics = unit(rng.standard_normal((64, dim), dtype=np.float32) * scale)
+    vectors = topics[rng.integers(0, len(topics), entries)] + 0.8 * unit(
+        rng.standard_normal((entries, dim), dtype=np.float32) * scale
+    )
+    return unit(vectors)
+
+
+def paraphrase(
+    rng: np.random.Generator, vectors: np.ndarray, noise: float
+) -> np.ndarray:
+    return unit(
+        vectors + noise * unit(rng.standard_normal(vectors.shape, dtype=np.float32))
+    )
+
+
+async def loop_lag(cache: SemanticCache, queries: np.ndarray) -> float:
+    """Return the longest event loop stall (in ms) while the queries are looked up."""
+
+    lags = []
+    running = True
+
+    async def probe() -> None:
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(probe())
+    for query in queries:
+        await cache.get(0, query)
+    running = False
+    await task
+    return max(lags) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100_000)
+    parser.add_argument("--dims", type=int, nargs="+", default=[384, 1536])
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    for dim in args.dims:
+        for front_loaded in (True, False):
+            vectors = synthetic(rng, args.entries, dim, front_loaded)
+            index = VectorIndex(dim, args.entries)
+            for vector in vectors:
+                index.add(vector, "")
+
+            targets = rng.integers(0, args.entries, QUERIES)
+            queries = paraphrase(rng, vectors[targets], 0.3)
+            similarity = np.einsum("ij,ij->i", queries, vectors[targets])
+
+            times = []
+            found = 0
+            for query, target in zip(queries, targets):
+                start = time.perf_counter()
+                results = index.search_slots(query)
+                times.append((time.perf_counter() - start) * 1000)
+                found += results[0][1] == target
+
+            # Brute force, as before
+            full = []
+            for query in queries[:20]:
+                start = time.perf_counter()
+                scores = index.vectors[: index.count] @ query
+                int(np.argmax(scores))
+                full.append((time.perf_counter() - start) * 1000)
+
+            with tempfile.TemporaryDirectory() as directory:
+                cache = SemanticCache(None, "", "", 0.95, args.entries, Path(directory))
+                cache.indexes[0] = index
+                lag = asyncio.run(loop_lag(cache, queries[:50]))
+
+            print(
+                f"{args.entries} x {dim}-d, {'front-loaded' if front_loaded else 'uniform'}: "
+                f"search p50 {statistics.median(times):.2f}ms, max {max(times):.2f}ms "
+                f"(brute force {statistics.median(full):.2f}ms); "
+                f"recall {found / QUERIES:.1%} of paraphrases (cosine {similarity.min():.3f}-{similarity.max():.3f}); "
+                f"max event loop stall {lag:.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Split youtube channel from subscription
+
+Revision ID: 5ef132e3a71b
+Revises: be1d1c333449
+Create Date: 2026-10-18 18:59:00.314774
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "5ef132e3a71b"
+down_revision: Union[str, None] = "be1d1c333449"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "youtube_channel",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            sa.Identity(always=True, start=1, increment=1),
+            nullable=False,
+        ),
+        sa.Column("youtube_channel_id", sa.String(length=50), nullable=False),
+        sa.Column("youtube_channel_name", sa.Unicode(length=50), nullable=False),
+        sa.Column("youtube_upload_playlist", sa.String(length=50), nullable=False),
+        sa.Column("last_checked_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_youtube_channel")),
+        sa.UniqueConstraint(
+            "youtube_channel_id", name=op.f("uq_youtube_channel_youtube_channel_id")
+        ),
+    )
+
+    # One row per subscribed channel, checked since the earliest time any guild checked it
+    op.execute(
+        """
+        INSERT INTO youtube_channel
+            (youtube_channel_id, youtube_channel_name, youtube_upload_playlist, last_checked_at)
+        SELECT youtube_channel_id, MAX(youtube_channel_name), MAX(youtube_upload_playlist), MIN(last_checked_at)
+        FROM subscription
+        GROUP BY youtube_channel_id
+        """
+    )
+
+    with op.batch_alter_table("subscription") as batch_op:
+        batch_op.add_column(sa.Column("channel_id", sa.Integer(), nullable=True))
+
+    op.execute(
+        """
+        UPDATE subscription
+        SET channel_id = (
+            SELECT youtube_channel.id FROM youtube_channel
+            WHERE youtube_channel.youtube_channel_id = subscription.youtube_channel_id
+        )
+        """
+    )
+
+    with op.batch_alter_table("subscription") as batch_op:
+        batch_op.alter_column("channel_id", existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_constraint(
+            op.f("uq_subscription_youtube_channel_id"), type_="unique"
+        )
+        batch_op.create_unique_constraint(
+            op.f("uq_subscription_guild_id"), ["guild_id", "channel_id"]
+        )
+        batch_op.create_foreign_key(
+            op.f("fk_subscription_channel_id_youtube_channel"),
+            "youtube_channel",
+            ["channel_id"],
+            ["id"],
+            ondelete="CASCADE",
+        )
+        batch_op.drop_column("last_checked_at")
+        batch_op.drop_column("youtube_channel_name")
+        batch_op.drop_column("youtube_channel_id")
+        batch_op.drop_column("youtube_upload_playlist")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("subscription") as batch_op:
+        batch_op.add_column(
+            sa.Column("youtube_upload_playlist", sa.VARCHAR(length=50), nullable=True)
+        )
+        batch_op.add_column(
+            sa.Column("youtube_channel_id", sa.INTEGER(), nullable=True)
+        )
+        batch_op.add_column(
+            sa.Column("youtube_channel_name", sa.VARCHAR(length=50), nullable=True)
+        )
+        batch_op.add_column(sa.Column("last_checked_at", sa.DATETIME(), nullable=True))
+
+    op.execute(
+        """
+        UPDATE subscription
+        SET (youtube_channel_id, youtube_channel_name, youtube_upload_playlist, last_checked_at) = (
+            SELECT youtube_channel_id, youtube_channel_name, youtube_upload_playlist, last_checked_at
+            FROM youtube_channel
+            WHERE youtube_channel.id = subscription.channel_id
+        )
+        """
+    )
+    # The old schema only allows one subscription per channel
+    op.execute(
+        """
+        DELETE FROM subscription
+        WHERE id NOT IN (SELECT MIN(id) FROM subscription GROUP BY youtube_channel_id)
+        """
+    )
+
+    with op.batch_alter_table("subscription") as batch_op:
+        for column, type_ in (
+            ("youtube_upload_playlist", sa.VARCHAR(length=50)),
+            ("youtube_channel_id", sa.INTEGER()),
+            ("youtube_channel_name", sa.VARCHAR(length=50)),
+            ("last_checked_at", sa.DATETIME()),
+        ):
+            batch_op.alter_column(column, existing_type=type_, nullable=False)
+        batch_op.drop_constraint(
+            op.f("fk_subscription_channel_id_youtube_channel"), type_="foreignkey"
+        )
+        batch_op.drop_constraint(op.f("uq_subscription_guild_id"), type_="unique")
+        batch_op.create_unique_constraint(
+            op.f("uq_subscription_youtube_channel_id"), ["youtube_channel_id"]
+        )
+        batch_op.drop_column("channel_id")
+
+    op.drop_table("youtube_channel")
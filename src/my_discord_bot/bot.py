@@ -38,13 +38,16 @@ class DiscordBot(commands.Bot):
 
         # Use OpenAI API endpoint of OPENAI_BASE_URL is not set
         if not len(os.getenv("OPENAI_BASE_URL", "")):
-            del os.environ["OPENAI_BASE_URL"]
+            os.environ.pop("OPENAI_BASE_URL", None)
 
         # Add all cogs
         for cog in cog_list:
             # Disable specific cogs if specific environment variables are not set
             if cog.__name__ == "AI" and not (
-                len(os.getenv("OPENAI_API_KEY", ""))
+                (
+                    len(os.getenv("OPENAI_API_KEY", ""))
+                    or len(os.getenv("OPENAI_BACKENDS", ""))
+                )
                 and len(os.getenv("OPENAI_MODEL_NAME", ""))
             ):
                 continue
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import typing as ty
+from collections import deque
+
+import openai
+
+# The client imports its API resources when they are first used, which takes about a second;
+# Do it now (while the cog loads) instead of on the event loop during the first request
+import openai.resources
+
+from ._ai_scheduler import percentile
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures before a backend is ejected, and seconds before it is probed again
+FAILURE_THRESHOLD = 3
+EJECT_SECONDS = 30
+# Smoothing factor of the latency estimate
+EWMA_ALPHA = 0.3
+
+T = ty.TypeVar("T")
+# Kinds of requests, whose latencies are measured separately:
+# Time to first token of streamed chats, and durations of whole completions and embeddings
+STREAM = "stream"
+COMPLETE = "complete"
+EMBED = "embed"
+
+
+class NoBackendError(Exception):
+    """Raised when no AI backend is available."""
+
+
+def is_backend_failure(e: BaseException) -> bool:
+    """Return True if the error is the backend's fault (connection error, timeout, 429 or 5xx).
+
+    Other errors (e.g. 400 for a too long context) would fail on any backend.
+    """
+
+    if isinstance(e, (openai.APIConnectionError, TimeoutError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and (
+        e.status_code == 429 or e.status_code >= 500
+    )
+
+
+class Latency:
+    """Exponentially weighted latency of a kind of request, in seconds, with recent samples for percentiles."""
+
+    def __init__(self) -> None:
+        self.average = 0.0
+        self.samples: ty.Deque[float] = deque(maxlen=200)
+
+    def record(self, latency: float) -> None:
+        self.average = (
+            latency
+            if not self.samples
+            else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.average
+        )
+        self.samples.append(latency)
+
+
+class Backend:
+    """An OpenAI-compatible server, with its latency estimate and circuit breaker state."""
+
+    def __init__(
+        self,
+        name: str,
+        client: openai.AsyncOpenAI,
+        weight: float = 1,
+        models: ty.Dict[str, str] | None = None,
+    ) -> None:
+        self.name = name
+        self.client = client
+        self.weight = weight
+        # Requested model name -> model name on this backend
+        self.models = models or {}
+
+        self.latencies = {kind: Latency() for kind in (STREAM, COMPLETE, EMBED)}
+        self.in_flight = 0
+
+        self.failures = 0
+        # When the circuit breaker opened, None if closed
+        self.ejected_at: float | None = None
+        self.probing = False
+
+    def model(self, model_name: str) -> str:
+        return self.models.get(model_name, model_name)
+
+    def available(self, now: float) -> bool:
+        if self.ejected_at is None:
+            return True
+        # Half-open: let a single request through to probe the backend
+        return not self.probing and now - self.ejected_at >= EJECT_SECONDS
+
+    def score(self, kind: str, prior: float) -> float:
+        """Lower is better. `prior` is used as the latency of unmeasured backends."""
+
+        latency = self.latencies[kind]
+        return (
+            (latency.average if latency.samples else prior)
+            * (self.in_flight + 1)
+            / self.weight
+        )
+
+    def acquire(self) -> None:
+        self.in_flight += 1
+        if self.ejected_at is not None:
+            self.probing = True
+
+    def record_success(self, kind: str, latency: float | None) -> None:
+        """Close the circuit breaker. `latency` is None if the backend answered with a client error."""
+
+        if latency is not None:
+            self.latencies[kind].record(latency)
+
+        if self.ejected_at is not None:
+            logger.info(f"AI backend {self.name} is back.")
+        self.failures = 0
+        self.ejected_at = None
+        self.probing = False
+
+    def record_failure(self, e: BaseException) -> None:
+        logger.warning(f"AI backend {self.name} failed: {e!r}")
+        self.failures += 1
+        if self.probing or self.failures >= FAILURE_THRESHOLD:
+            if self.ejected_at is None:
+                logger.error(f"AI backend {self.name} ejected.")
+            self.ejected_at = time.monotonic()
+        self.probing = False
+
+
+class BackendPool:
+    """Route AI requests to the best available backend, and fail over to the others."""
+
+    def __init__(self, backends: ty.List[Backend], hedge: bool = False) -> None:
+        self.backends = backends
+        # Send a second request to another backend if the first is slower than p95
+        self.hedge = hedge
+
+    @classmethod
+    def from_env(cls) -> "BackendPool":
+        """Read OPENAI_BACKENDS (a JSON list of backends), falling back to OPENAI_BASE_URL."""
+
+        hedge = os.getenv("AI_HEDGE_REQUESTS", "false").lower() in ("true", "1")
+
+        if not (config := os.getenv("OPENAI_BACKENDS", "")):
+            # Without other backends to fail over to, let the client retry by itself
+            return cls([Backend("default", openai.AsyncOpenAI())], hedge)
+
+        backends = []
+        for index, backend in enumerate(json.loads(config)):
+            backends.append(
+                Backend(
+                    backend.get("name", backend.get("base_url", str(index))),
+                    openai.AsyncOpenAI(
+                        base_url=backend.get("base_url"),
+                        api_key=backend.get("api_key", os.getenv("OPENAI_API_KEY")),
+                        max_retries=0,
+                    ),
+                    weight=backend.get("weight", 1),
+                    models=backend.get("models"),
+                )
+            )
+        return cls(backends, hedge)
+
+    def pick(self, kind: str, exclude: ty.Collection[Backend] = ()) -> Backend | None:
+        now = time.monotonic()
+        candidates = [
+            backend
+            for backend in self.backends
+            if backend not in exclude and backend.available(now)
+        ]
+        # Be optimistic about unmeasured backends, so that they get tried
+        prior = min(
+            (
+                backend.latencies[kind].average
+                for backend in self.backends
+                if backend.latencies[kind].samples
+            ),
+            default=0.1,
+        )
+        return min(
+            candidates, key=lambda backend: backend.score(kind, prior), default=None
+        )
+
+    async def _attempt(
+        self,
+        backend: Backend,
+        kind: str,
+        request: ty.Callable[[Backend], ty.Awaitable[T]],
+    ) -> T:
+        """Run the request on the backend, and update its statistics.
+
+        The backend must have been acquired already.
+        """
+
+        start = time.monotonic()
+        try:
+            result = await request(backend)
+        except asyncio.CancelledError:
+            backend.probing = False
+            raise
+        except Exception as e:
+            if is_backend_failure(e):
+                backend.record_failure(e)
+            else:
+                # The backend is up, but the request is invalid
+                backend.record_success(kind, None)
+            raise
+        finally:
+            backend.in_flight -= 1
+        backend.record_success(kind, time.monotonic() - start)
+        return result
+
+    async def request(
+        self,
+        kind: str,
+        request: ty.Callable[[Backend], ty.Awaitable[T]],
+        on_discard: ty.Callable[[T], ty.Awaitable[None]] | None = None,
+    ) -> T:
+        """Run the request on the best backend, failing over to the others on backend failures.
+
+        Other errors (see is_backend_failure) are raised as is.
+        With hedging, a second attempt is started on another backend if the first one
+        takes longer than its p95 latency (for this kind of request); The first success wins.
+        `on_discard` is called with the results of losing attempts.
+        """
+
+        tried: ty.Set[Backend] = set()
+        attempts: ty.Dict[asyncio.Task[T], Backend] = {}
+        error: BaseException | None = None
+
+        try:
+            while True:
+                if not attempts:
+                    if (backend := self.pick(kind, tried)) is None:
+                        raise NoBackendError() from error
+                    tried.add(backend)
+                    backend.acquire()
+                    attempts[
+                        asyncio.create_task(self._attempt(backend, kind, request))
+                    ] = backend
+
+                hedge_after = None
+                if self.hedge and len(attempts) == 1:
+                    latency = next(iter(attempts.values())).latencies[kind]
+                    if len(latency.samples) >= 20:
+                        hedge_after = percentile(latency.samples, 0.95)
+
+                done, _ = await asyncio.wait(
+                    attempts, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if (backend := self.pick(kind, tried)) is not None:
+                        logger.debug(f"Hedging AI request to {backend.name}")
+                        tried.add(backend)
+                        backend.acquire()
+                        attempts[
+                            asyncio.create_task(self._attempt(backend, kind, request))
+                        ] = backend
+                    continue
+
+                for task in done:
+                    del attempts[task]
+                    if (error := task.exception()) is None:
+                        return task.result()
+                    if not is_backend_failure(error):
+                        raise error
+        finally:
+            for task in attempts:
+                task.cancel()
+            for result in await asyncio.gather(*attempts, return_exceptions=True):
+                if on_discard is not None and not isinstance(result, BaseException):
+                    await on_discard(result)
+
+    async def stream_chat(
+        self, model_name: str, messages: ty.List[ty.Dict[str, str]]
+    ) -> ty.AsyncIterator[str]:
+        """Stream the text of a chat completion.
+
+        Failover and hedging only happen before the first chunk arrives.
+        """
+
+        async def open_stream(
+            backend: Backend,
+        ) -> ty.Tuple[Backend, openai.AsyncStream, ty.Any]:
+            stream = await backend.client.chat.completions.create(
+                model=backend.model(model_name), messages=messages, stream=True
+            )
+            try:
+                # Latency is measured as the time to the first chunk
+                first = await anext(aiter(stream))
+            except BaseException:
+                await stream.close()
+                raise
+            return backend, stream, first
+
+        async def close_stream(
+            result: ty.Tuple[Backend, openai.AsyncStream, ty.Any],
+        ) -> None:
+            await result[1].close()
+
+        backend, stream, first = await self.request(STREAM, open_stream, close_stream)
+
+        backend.in_flight += 1
+        try:
+            if first.choices and first.choices[0].delta.content:
+                yield first.choices[0].delta.content
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            if is_backend_failure(e):
+                backend.record_failure(e)
+            raise
+        finally:
+            backend.in_flight -= 1
+            await stream.close()
+
+    async def complete(
+        self, model_name: str, messages: ty.List[ty.Dict[str, str]]
+    ) -> str:
+        response = await self.request(
+            COMPLETE,
+            lambda backend: backend.client.chat.completions.create(
+                model=backend.model(model_name), messages=messages
+            ),
+        )
+        return response.choices[0].message.content or ""
+
+    async def embed(self, model_name: str, text: str) -> ty.List[float]:
+        response = await self.request(
+            EMBED,
+            lambda backend: backend.client.embeddings.create(
+                model=backend.model(model_name), input=text
+            ),
+        )
+        return response.data[0].embedding
+
+    def summary(self) -> str:
+        now = time.monotonic()
+        return "\n".join(
+            "Backend {name}: {state}, {in_flight} in flight, {latencies}".format(
+                name=backend.name,
+                state="up"
+                if backend.ejected_at is None
+                else "probing"
+                if backend.available(now) or backend.probing
+                else "ejected",
+                in_flight=backend.in_flight,
+                latencies=", ".join(
+                    f"{kind} latency {latency.average:.2f}s (p95 {percentile(latency.samples, 0.95):.2f}s)"
+                    for kind, latency in backend.latencies.items()
+                    if latency.samples
+                )
+                or "no latency measured",
+            )
+            for backend in self.backends
+        )
@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import logging
+import time
+import typing as ty
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the queue of the scheduler is full."""
+
+
+def percentile(samples: ty.Iterable[float], p: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class FairScheduler:
+    """Limit the number of concurrent AI requests.
+
+    Waiting requests are queued per guild, and guilds are served round-robin,
+    so that a busy guild cannot starve the others.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+
+        self.active = 0
+        self.queued = 0
+        # Waiting requests of each guild; The first guild is served next
+        self.queues: OrderedDict[int, ty.Deque[asyncio.Future[None]]] = OrderedDict()
+
+        # Metrics, in seconds
+        self.wait_times: ty.Deque[float] = deque(maxlen=1000)
+        self.service_times: ty.Deque[float] = deque(maxlen=1000)
+        self.served = 0
+        self.rejected = 0
+
+    def position(self, guild_id: int, future: asyncio.Future[None]) -> int:
+        """Return the (1-based) position of a waiting request in the round-robin order."""
+
+        guilds = list(self.queues)
+        index = self.queues[guild_id].index(future)
+        ahead = index
+        for order, other in enumerate(guilds):
+            if other != guild_id:
+                # Guilds before this one in the current round get one more turn
+                ahead += min(
+                    len(self.queues[other]),
+                    index + (order < guilds.index(guild_id)),
+                )
+        return ahead + 1
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self,
+        guild_id: int,
+        on_queued: ty.Callable[[int], ty.Awaitable[None]] | None = None,
+    ) -> ty.AsyncIterator[None]:
+        """Wait for a free slot, then hold it for the duration of the context.
+
+        `on_queued` is called with the queue position if the request has to wait;
+        Its errors are logged, and the request keeps waiting.
+        Raise QueueFullError immediately if the queue is full.
+        """
+
+        start = time.monotonic()
+
+        if self.active < self.max_concurrency and not self.queued:
+            self.active += 1
+        else:
+            if self.queued >= self.max_queue:
+                self.rejected += 1
+                raise QueueFullError()
+
+            future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+            self.queues.setdefault(guild_id, deque()).append(future)
+            self.queued += 1
+
+            try:
+                if on_queued is not None:
+                    try:
+                        await on_queued(self.position(guild_id, future))
+                    except Exception as e:
+                        logger.warning(f"Failed to report the queue position: {e}")
+                await future
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    # The slot has been handed over to us already
+                    self._release()
+                else:
+                    future.cancel()
+                    self._dequeue(guild_id, future)
+                raise
+
+        service_start = time.monotonic()
+        self.wait_times.append(service_start - start)
+        try:
+            yield
+        finally:
+            self.service_times.append(time.monotonic() - service_start)
+            self.served += 1
+            self._release()
+
+    def _dequeue(self, guild_id: int, future: asyncio.Future[None]) -> None:
+        if (queue := self.queues.get(guild_id)) is not None and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self.queues[guild_id]
+
+    def _release(self) -> None:
+        """Hand the slot over to the next guild in round-robin order, or free it."""
+
+        while self.queues:
+            guild_id, queue = next(iter(self.queues.items()))
+            future = queue.popleft()
+            self.queued -= 1
+
+            if queue:
+                # The guild waits for its next turn at the end of the round
+                self.queues.move_to_end(guild_id)
+            else:
+                del self.queues[guild_id]
+
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.active -= 1
+
+    def summary(self) -> str:
+        return """Scheduler: {active}/{max_concurrency} running, {queued}/{max_queue} queued, {served} served, {rejected} rejected
+Queue wait: p50 {wait_p50:.2f}s, p95 {wait_p95:.2f}s; Service time: p50 {service_p50:.2f}s, p95 {service_p95:.2f}s""".format(
+            active=self.active,
+            max_concurrency=self.max_concurrency,
+            queued=self.queued,
+            max_queue=self.max_queue,
+            served=self.served,
+            rejected=self.rejected,
+            wait_p50=percentile(self.wait_times, 0.5),
+            wait_p95=percentile(self.wait_times, 0.95),
+            service_p50=percentile(self.service_times, 0.5),
+            service_p95=percentile(self.service_times, 0.95),
+        )
@@ -0,0 +1,171 @@
+import logging
+import typing as ty
+from collections import OrderedDict
+
+import discord
+
+from ._conversation import count_tokens
+
+logger = logging.getLogger(__name__)
+
+MAP_PROMPT = "Summarize the following Discord messages in a few sentences. Keep names, facts and decisions."
+REDUCE_PROMPT = "Combine the following summaries of consecutive parts of a Discord conversation into one concise summary."
+
+
+class Chunk(ty.NamedTuple):
+    """Summary of consecutive messages of a channel."""
+
+    first_id: int
+    last_id: int
+    count: int
+    summary: str
+
+
+class ChannelSummarizer:
+    """Summarize the recent messages of channels, map-reduce style.
+
+    Messages are read newest first and summarized in chunks that fit `chunk_tokens`.
+    Chunk summaries are cached by channel, so that later runs only read messages after
+    the last cached one (and before the first one, if more messages are requested).
+    """
+
+    def __init__(
+        self,
+        complete: ty.Callable[[ty.List[ty.Dict[str, str]]], ty.Awaitable[str]],
+        chunk_tokens: int,
+        max_channels: int = 1000,
+        max_chunks: int = 100,
+    ) -> None:
+        self.complete = complete
+        self.chunk_tokens = chunk_tokens
+        self.max_channels = max_channels
+        self.max_chunks = max_chunks
+        # Chunks of each channel, oldest first
+        self.cache: OrderedDict[int, ty.List[Chunk]] = OrderedDict()
+
+    async def summarize(self, channel: discord.abc.Messageable, limit: int) -> str:
+        """Summarize (roughly) the last `limit` messages of the channel."""
+
+        # Kept until this summary succeeds, and shared with concurrent summaries of the channel
+        cached = self.cache.get(channel.id, [])
+
+        # Messages after the cached ones
+        newer, read, reached = await self._read(
+            channel, limit, stop_at=cached[-1].last_id if cached else None
+        )
+        remaining = limit - read
+
+        # Reuse cached chunks only if they directly precede the new messages
+        reused: ty.List[Chunk] = []
+        if reached:
+            for chunk in reversed(cached):
+                if remaining <= 0:
+                    break
+                reused.append(chunk)
+                remaining -= chunk.count
+
+        # Messages before the cached ones
+        older: ty.List[Chunk] = []
+        if reused and remaining > 0:
+            older, _, _ = await self._read(
+                channel, remaining, before=discord.Object(id=reused[-1].first_id)
+            )
+
+        # Newest first -> oldest first
+        chunks = [*reversed(older), *reversed(reused), *reversed(newer)]
+
+        summary = (
+            await self._reduce([chunk.summary for chunk in chunks]) if chunks else ""
+        )
+
+        self.cache[channel.id] = chunks[-self.max_chunks :]
+        self.cache.move_to_end(channel.id)
+        while len(self.cache) > self.max_channels:
+            self.cache.popitem(last=False)
+
+        return summary
+
+    async def _read(
+        self,
+        channel: discord.abc.Messageable,
+        limit: int,
+        stop_at: int | None = None,
+        before: discord.abc.Snowflake | None = None,
+    ) -> ty.Tuple[ty.List[Chunk], int, bool]:
+        """Summarize up to `limit` messages of the channel, newest first, chunk by chunk.
+
+        Stop before the message with ID `stop_at`.
+        Return the chunks (newest first), the number of messages read, and whether `stop_at` is reached.
+        """
+
+        chunks: ty.List[Chunk] = []
+        # Messages of the current chunk, newest first
+        buffer: ty.List[discord.Message] = []
+        tokens = 0
+        read = 0
+        reached = stop_at is None
+
+        # The history is fetched lazily, 100 messages at a time
+        async for message in channel.history(limit=limit, before=before):
+            if stop_at is not None and message.id <= stop_at:
+                reached = True
+                break
+
+            read += 1
+            if not message.clean_content:
+                continue
+
+            buffer.append(message)
+            tokens += count_tokens(message.clean_content)
+            if tokens >= self.chunk_tokens:
+                chunks.append(await self._map(buffer))
+                buffer, tokens = [], 0
+
+        if buffer:
+            chunks.append(await self._map(buffer))
+
+        return chunks, read, reached
+
+    async def _map(self, messages: ty.List[discord.Message]) -> Chunk:
+        transcript = "\n".join(
+            f"{message.author.display_name}: {message.clean_content}"
+            for message in reversed(messages)
+        )
+        summary = await self.complete(
+            [
+                {"role": "system", "content": MAP_PROMPT},
+                {"role": "user", "content": transcript},
+            ]
+        )
+        return Chunk(messages[-1].id, messages[0].id, len(messages), summary)
+
+    async def _reduce(self, summaries: ty.List[str]) -> str:
+        """Combine summaries, in groups that fit `chunk_tokens`, until one is left."""
+
+        while len(summaries) > 1:
+            groups: ty.List[ty.List[str]] = [[]]
+            tokens = 0
+            for summary in summaries:
+                if groups[-1] and tokens + count_tokens(summary) > self.chunk_tokens:
+                    groups.append([])
+                    tokens = 0
+                groups[-1].append(summary)
+                tokens += count_tokens(summary)
+
+            # Each pass must make progress
+            if len(groups) == len(summaries):
+                groups = [summaries[i : i + 2] for i in range(0, len(summaries), 2)]
+
+            summaries = [
+                group[0]
+                if len(group) == 1
+                else await self.complete(
+                    [
+                        {"role": "system", "content": REDUCE_PROMPT},
+                        {"role": "user", "content": "\n\n".join(group)},
+                    ]
+                )
+                for group in groups
+            ]
+
+        return summaries[0]
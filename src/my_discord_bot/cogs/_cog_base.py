@@ -1,6 +1,11 @@
+import functools
+import io
 import logging
 import os
+import time
 import typing as ty
+import urllib.parse
+from pathlib import Path
 
 import discord
 from discord.ext import commands
@@ -8,6 +13,9 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 logger = logging.getLogger(__name__)
 
+# Attachment URLs expiring sooner than this (in seconds) are not reused
+URL_MARGIN = 3600
+
 
 def check_cooldown_factory(
     seconds: float = 10,
@@ -24,12 +32,70 @@ def check_cooldown_factory(
     return check_cooldown
 
 
+def get_attachment_url_expiry(url: str) -> int | None:
+    """Return the expiry time (in Unix time) of a signed Discord attachment URL.
+
+    Return None if the URL is not signed.
+    """
+
+    query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+    try:
+        return int(query["ex"][0], 16)
+    except (KeyError, ValueError):
+        return None
+
+
+def is_attachment_url_reusable(url: str) -> bool:
+    """Return whether a Discord attachment URL can still be linked to for a while."""
+
+    expiry = get_attachment_url_expiry(url)
+    return expiry is not None and expiry - time.time() >= URL_MARGIN
+
+
+class AssetRegistry:
+    """Static images of the bot, read once and kept in memory.
+
+    An image is uploaded along with the first message showing it,
+    then later messages link to its attachment URL instead.
+    """
+
+    def __init__(self, directory: Path) -> None:
+        self.data = {
+            path.name: path.read_bytes()
+            for path in directory.iterdir()
+            if path.is_file()
+        }
+        self.urls: ty.Dict[str, str] = {}
+
+    def attach(self, name: str) -> ty.Tuple[str, ty.List[discord.File]]:
+        """Return the URL of the image for embeds, and the files to send with them (none if the URL can be reused)."""
+
+        if (url := self.urls.get(name)) is not None and is_attachment_url_reusable(url):
+            return url, []
+        return f"attachment://{name}", [
+            discord.File(io.BytesIO(self.data[name]), filename=name)
+        ]
+
+    def remember(self, message: discord.Message) -> None:
+        """Remember the attachment URLs of the images uploaded with the message."""
+
+        for attachment in message.attachments:
+            if attachment.filename in self.data:
+                self.urls[attachment.filename] = attachment.url
+
+
+@functools.cache
+def get_assets() -> AssetRegistry:
+    return AssetRegistry(Path("./assets/images"))
+
+
 class CogBase(commands.Cog):
     def __init__(
         self, bot: commands.Bot, sessionmaker: async_sessionmaker[AsyncSession]
     ) -> None:
         self.bot = bot
         self.sessionmaker = sessionmaker
+        self.assets = get_assets()
 
     def get_max_file_size(
         self,
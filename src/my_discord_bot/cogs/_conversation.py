@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import time
+import typing as ty
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+def count_tokens(text: str) -> int:
+    """Roughly estimate the number of tokens of a message (~4 characters per token, plus overhead)."""
+
+    return len(text) // 4 + 4
+
+
+class Turn(ty.NamedTuple):
+    role: ty.Literal["user", "assistant"]
+    content: str
+    # Computed once when the turn is stored
+    tokens: int
+
+
+class Conversation:
+    """Recent turns of a conversation, trimmed to fit both a turn limit and a token budget.
+
+    Trimmed turns are returned to the caller, which may fold them into `summary`.
+    """
+
+    __slots__ = ("turns", "tokens", "summary", "summary_tokens", "last_active")
+
+    def __init__(self) -> None:
+        self.turns: ty.Deque[Turn] = deque()
+        # Total tokens of `turns`
+        self.tokens = 0
+        self.summary = ""
+        self.summary_tokens = 0
+        self.last_active = time.monotonic()
+
+    def __bool__(self) -> bool:
+        return bool(self.turns or self.summary)
+
+    def add(
+        self, turns: ty.Iterable[Turn], max_turns: int, max_tokens: int
+    ) -> ty.List[Turn]:
+        """Append turns, then trim the oldest ones. Return the trimmed turns."""
+
+        for turn in turns:
+            self.turns.append(turn)
+            self.tokens += turn.tokens
+
+        trimmed: ty.List[Turn] = []
+        while len(self.turns) > 1 and (
+            len(self.turns) > max_turns
+            or self.tokens + self.summary_tokens > max_tokens
+            # Do not start the context with an answer to a trimmed question
+            or (trimmed and self.turns[0].role == "assistant")
+        ):
+            turn = self.turns.popleft()
+            self.tokens -= turn.tokens
+            trimmed.append(turn)
+        return trimmed
+
+    def set_summary(self, summary: str) -> None:
+        self.summary = summary
+        self.summary_tokens = count_tokens(summary)
+
+    def digest(self) -> str:
+        """Hash the summary and the turns, to key cached answers to follow-up prompts.
+
+        Return an empty string if the conversation is empty.
+        """
+
+        if not self:
+            return ""
+        digest = hashlib.sha256(self.summary.encode())
+        for turn in self.turns:
+            digest.update(f"\0{turn.role}\0{turn.content}".encode())
+        return digest.hexdigest()
+
+    def messages(self) -> ty.List[ty.Dict[str, str]]:
+        """Return the conversation in the format of the OpenAI chat completion API."""
+
+        messages = []
+        if self.summary:
+            messages.append(
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{self.summary}",
+                }
+            )
+        messages.extend(
+            {"role": turn.role, "content": turn.content} for turn in self.turns
+        )
+        return messages
+
+
+class ConversationStore:
+    """Conversations by channel (or thread) ID, least recently active first."""
+
+    def __init__(self, max_conversations: int, idle_seconds: float) -> None:
+        self.max_conversations = max_conversations
+        self.idle_seconds = idle_seconds
+        self.conversations: OrderedDict[int, Conversation] = OrderedDict()
+
+    def get(self, channel_id: int) -> Conversation:
+        if (conversation := self.conversations.get(channel_id)) is None:
+            conversation = self.conversations[channel_id] = Conversation()
+            if len(self.conversations) > self.max_conversations:
+                self.conversations.popitem(last=False)
+        else:
+            self.conversations.move_to_end(channel_id)
+            conversation.last_active = time.monotonic()
+        return conversation
+
+    def reset(self, channel_id: int) -> None:
+        self.conversations.pop(channel_id, None)
+
+    def evict_idle(self) -> int:
+        """Forget conversations idle for longer than `idle_seconds`. Return the number forgotten."""
+
+        deadline = time.monotonic() - self.idle_seconds
+        evicted = 0
+        while self.conversations:
+            channel_id, conversation = next(iter(self.conversations.items()))
+            if conversation.last_active > deadline:
+                break
+            del self.conversations[channel_id]
+            evicted += 1
+        return evicted
@@ -0,0 +1,75 @@
+import datetime as dt
+import logging
+import typing as ty
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..models import PlaylistEtag
+
+logger = logging.getLogger(__name__)
+
+
+class EtagCache:
+    """ETags of YouTube playlists, in the `playlist_etag` table.
+
+    A playlist whose ETag has not changed since it was last processed can be skipped.
+    Least recently used entries are evicted when there are more than `max_entries`.
+    """
+
+    def __init__(
+        self, sessionmaker: async_sessionmaker[AsyncSession], max_entries: int
+    ) -> None:
+        self.sessionmaker = sessionmaker
+        self.max_entries = max_entries
+
+        # Playlists skipped because they have not changed, and the others
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, playlist_ids: ty.Iterable[str]) -> ty.Dict[str, str]:
+        """Return the cached ETags of the playlists, by playlist ID."""
+
+        async with self.sessionmaker() as session:
+            return {
+                row.playlist_id: row.etag
+                for row in await session.execute(
+                    select(PlaylistEtag.playlist_id, PlaylistEtag.etag).where(
+                        PlaylistEtag.playlist_id.in_(list(playlist_ids))
+                    )
+                )
+            }
+
+    async def put_many(self, etags: ty.Dict[str, str]) -> None:
+        """Store (or refresh) the ETags of the playlists, in a single transaction."""
+
+        if not etags:
+            return
+
+        now = dt.datetime.now(dt.UTC)
+        statement = insert(PlaylistEtag)
+        async with self.sessionmaker() as session:
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[PlaylistEtag.playlist_id],
+                    set_={
+                        "etag": statement.excluded.etag,
+                        "last_used_at": statement.excluded.last_used_at,
+                    },
+                ),
+                [
+                    {"playlist_id": playlist_id, "etag": etag, "last_used_at": now}
+                    for playlist_id, etag in etags.items()
+                ],
+            )
+            await session.execute(
+                delete(PlaylistEtag).where(
+                    PlaylistEtag.id.not_in(
+                        select(PlaylistEtag.id)
+                        .order_by(PlaylistEtag.last_used_at.desc())
+                        .limit(self.max_entries)
+                    )
+                )
+            )
+            await session.commit()
@@ -0,0 +1,214 @@
+"""Run gallery-dl jobs in worker processes.
+
+This file is also the entrypoint of the workers, so it must not import the rest of the bot.
+"""
+
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import shutil
+import signal
+import sys
+import typing as ty
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# A gallery-dl config option: (path, key, value)
+Option = ty.Tuple[ty.Tuple[str, ...], str, ty.Any]
+
+
+class DownloadTimeoutError(Exception):
+    """Raised when a download job takes too long."""
+
+
+class ConvertOptions(ty.TypedDict):
+    # Format of ugoira animations, "webm" or "gif"
+    animation_format: str
+    # Size limit of converted files, in bytes
+    max_bytes: int
+    # Memory limit of the worker when processing still images, in bytes
+    memory_bytes: int
+
+
+class DownloadResult(ty.NamedTuple):
+    # Exit status of the gallery-dl job, see gallery_dl.exception
+    status: int
+    # Downloaded files, in download order
+    files: ty.List[Path]
+
+
+class DownloadPool:
+    """Run gallery-dl jobs in worker processes, off the event loop.
+
+    Each job runs in its own process, with its own config and output directory,
+    so that concurrent jobs cannot interfere with each other.
+    A job that times out or is cancelled is killed, along with its ffmpeg processes.
+    """
+
+    def __init__(self, directory: Path, max_workers: int, timeout: float) -> None:
+        self.directory = directory
+        # Remove the leftovers of jobs interrupted by a restart
+        shutil.rmtree(directory, ignore_errors=True)
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_workers)
+
+    @contextlib.asynccontextmanager
+    async def download(
+        self,
+        url: str,
+        options: ty.List[Option],
+        convert: ConvertOptions | None = None,
+    ) -> ty.AsyncIterator[DownloadResult]:
+        """Download the URL with the given config options.
+
+        With `convert`, ugoira archives (see the ugoira postprocessor's archive mode)
+        are encoded into animations that fit the size limit, and larger still images are
+        recompressed or downscaled to fit it.
+
+        The downloaded files are deleted when the context exits.
+        Raise DownloadTimeoutError if the job takes longer than the timeout.
+        """
+
+        directory = self.directory / uuid.uuid4().hex
+        directory.mkdir(parents=True)
+        try:
+            async with self.semaphore:
+                result = await self._run(url, options, convert, directory)
+            yield result
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    async def _run(
+        self,
+        url: str,
+        options: ty.List[Option],
+        convert: ConvertOptions | None,
+        directory: Path,
+    ) -> DownloadResult:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            # Do not put this directory first on sys.path, where the cogs could shadow other modules
+            "-P",
+            __file__,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # Put the worker in its own process group, to kill its children with it
+            start_new_session=True,
+        )
+        request = {
+            "url": url,
+            "options": options,
+            "convert": convert,
+            "directory": str(directory),
+        }
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(json.dumps(request).encode()), self.timeout
+            )
+        except TimeoutError:
+            logger.warning(f"Gallery-DL job timed out: {url}")
+            raise DownloadTimeoutError()
+        finally:
+            if process.returncode is None:
+                self._kill(process)
+                await process.wait()
+
+        if stderr:
+            logger.debug(f"Gallery-DL: {stderr.decode(errors='replace').strip()}")
+
+        try:
+            result = json.loads(stdout.decode().strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            logger.error(
+                f"Gallery-DL worker exited with code {process.returncode}: {stderr.decode(errors='replace')[-1000:]}"
+            )
+            return DownloadResult(process.returncode or 1, [])
+
+        return DownloadResult(
+            result["status"], [Path(file) for file in result["files"]]
+        )
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process) -> None:
+        try:
+            if sys.platform == "win32":
+                process.kill()
+            else:
+                os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run_job(
+    url: str,
+    options: ty.List[Option],
+    convert: ConvertOptions | None,
+    directory: str,
+) -> ty.Dict[str, ty.Any]:
+    """Worker side: Run a gallery-dl download job, then convert the downloaded files."""
+
+    from gallery_dl import config, job
+
+    config.clear()
+    config.set((), "base-directory", directory)
+    # stdout is used to return the result
+    config.set(("output",), "mode", "null")
+    for path, key, value in options:
+        config.set(tuple(path), key, value)
+
+    files: ty.List[str] = []
+
+    class DownloadJob(job.DownloadJob):
+        def handle_url(self, url: str, kwdict: ty.Dict[str, ty.Any]) -> None:
+            super().handle_url(url, kwdict)
+            # The path is final after postprocessors have run
+            if self.pathfmt.path and Path(self.pathfmt.path).is_file():
+                files.append(self.pathfmt.path)
+
+    download = DownloadJob(url)
+    status = download.run()
+
+    if convert is None:
+        return {"status": status, "files": files}
+
+    import _media
+
+    converted: ty.List[str] = []
+    for file in map(Path, files):
+        if file.suffix == ".zip":
+            output = _media.encode_ugoira(
+                file, convert["animation_format"], convert["max_bytes"]
+            )
+            file.unlink()
+        elif (
+            file.suffix in (".jpg", ".jpeg", ".png", ".webp")
+            and file.stat().st_size > convert["max_bytes"]
+        ):
+            output = _media.fit_image(
+                file, convert["max_bytes"], convert["memory_bytes"]
+            )
+        else:
+            output = file
+
+        if output is None:
+            # Same as gallery-dl when a file is too big
+            status |= 4
+            continue
+        converted.append(str(output))
+
+    return {"status": status, "files": converted}
+
+
+if __name__ == "__main__":
+    # Make the sibling modules importable, after everything else so that they cannot shadow other modules
+    sys.path.append(str(Path(__file__).parent))
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+
+    request = json.load(sys.stdin)
+    print(json.dumps(run_job(**request)))
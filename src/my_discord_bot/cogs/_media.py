@@ -0,0 +1,499 @@
+"""Media conversion, run in the gallery-dl worker processes.
+
+This file must not import the rest of the bot.
+"""
+
+import contextlib
+import io
+import json
+import logging
+import math
+import struct
+import subprocess
+import tempfile
+import time
+import typing as ty
+import zipfile
+from pathlib import Path
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of encoding passes per animation
+MAX_PASSES = 3
+# Fraction of the size limit to aim for, to leave room for estimation errors and container overhead
+SIZE_MARGIN = 0.92
+# Bits per pixel per frame of VP9: Below the minimum, the resolution is reduced;
+# Above the maximum, the quality gain is not worth the size
+WEBM_MIN_BPP = 0.04
+WEBM_MAX_BPP = 0.25
+# Initial guess of the size of a GIF frame, in bytes per pixel (with a full, bayer dithered palette)
+GIF_BYTES_PER_PIXEL = 0.45
+# GIF palette sizes: (bayer dither scale, size relative to a full palette)
+GIF_PALETTES = {256: (2, 1.0), 128: (3, 0.8), 64: (4, 0.65)}
+MIN_SCALE = 0.2
+
+# Maximum number of encodes per still image
+MAX_IMAGE_PASSES = 4
+# JPEG qualities tried before the resolution is reduced, and their size relative to quality 90 (roughly)
+JPEG_QUALITIES = {90: 1.0, 80: 0.68, 70: 0.53}
+# Quality used once the resolution has to be reduced
+JPEG_SCALED_QUALITY = 80
+
+
+class Animation(ty.NamedTuple):
+    # Frame file names and delays (in milliseconds), in order
+    frames: ty.List[ty.Tuple[str, int]]
+    width: int
+    height: int
+
+    @property
+    def duration(self) -> float:
+        return sum(delay for _, delay in self.frames) / 1000
+
+
+class Pass(ty.NamedTuple):
+    """Encoder settings of a pass."""
+
+    scale: float
+    # Video bitrate (WebM), in bits per second
+    bitrate: int = 0
+    # Palette size and dither strength (GIF)
+    colors: int = 256
+    bayer_scale: int = 2
+
+
+def image_size(data: bytes) -> ty.Tuple[int, int]:
+    """Read the width and height from the header of a JPEG or PNG image."""
+
+    if data.startswith(b"\x89PNG"):
+        return struct.unpack(">II", data[16:24])
+
+    if data.startswith(b"\xff\xd8"):
+        index = 2
+        while index + 9 < len(data):
+            marker, length = struct.unpack(">HH", data[index : index + 4])
+            # Start of frame markers, except DHT, JPG and DAC
+            if 0xFFC0 <= marker <= 0xFFCF and marker not in (0xFFC4, 0xFFC8, 0xFFCC):
+                height, width = struct.unpack(">HH", data[index + 5 : index + 9])
+                return width, height
+            index += 2 + length
+
+    raise ValueError("Unknown image format")
+
+
+def read_ugoira(archive: zipfile.ZipFile) -> Animation:
+    """Read the frame list written by gallery-dl's ugoira postprocessor (in archive mode)."""
+
+    frames = [
+        (frame["file"], frame["delay"])
+        for frame in json.loads(archive.read("animation.json"))
+    ]
+    # The header is within the first few KiB of the file
+    with archive.open(frames[0][0]) as fp:
+        width, height = image_size(fp.read(65536))
+    return Animation(frames, width, height)
+
+
+def first_pass(animation: Animation, extension: str, max_bytes: int) -> Pass:
+    """Estimate the encoder settings that fit the animation into `max_bytes`."""
+
+    target = max_bytes * SIZE_MARGIN
+
+    if extension == "gif":
+        pixels = animation.width * animation.height * len(animation.frames)
+        return gif_pass(math.sqrt(target / (pixels * GIF_BYTES_PER_PIXEL)))
+
+    return webm_pass(animation, int(target * 8 / animation.duration))
+
+
+def next_pass(
+    animation: Animation,
+    previous: Pass,
+    extension: str,
+    estimated_size: float,
+    max_bytes: int,
+) -> Pass:
+    """Correct the settings of the previous pass by how much its output missed the target."""
+
+    # Aim a bit lower than the first time, the estimate was wrong once already
+    ratio = max_bytes * SIZE_MARGIN * 0.95 / estimated_size
+
+    if extension == "gif":
+        # Size is roughly proportional to the number of pixels
+        full_palette_scale = previous.scale * math.sqrt(
+            GIF_PALETTES[previous.colors][1]
+        )
+        return gif_pass(full_palette_scale * math.sqrt(ratio))
+
+    return webm_pass(animation, int(previous.bitrate * ratio))
+
+
+def webm_pass(animation: Animation, bitrate: int) -> Pass:
+    fps = len(animation.frames) / animation.duration
+    pixel_rate = fps * animation.width * animation.height
+    bitrate = min(bitrate, int(pixel_rate * WEBM_MAX_BPP))
+    # Reduce the resolution if the bitrate is too low for it
+    bpp = bitrate / pixel_rate
+    return Pass(max(MIN_SCALE, min(1, math.sqrt(bpp / WEBM_MIN_BPP))), bitrate=bitrate)
+
+
+def gif_pass(scale: float) -> Pass:
+    """Return the GIF settings for the given scale (with a full palette).
+
+    Smaller palettes compress better, so colors are traded before resolution.
+    """
+
+    for colors, (bayer_scale, size_factor) in GIF_PALETTES.items():
+        # The size saved by the smaller palette is spent on resolution
+        adjusted = scale / math.sqrt(size_factor)
+        if adjusted >= 0.5:
+            break
+    return Pass(
+        max(MIN_SCALE, min(1, adjusted)), colors=colors, bayer_scale=bayer_scale
+    )
+
+
+def ffmpeg_args(
+    animation: Animation,
+    concat: Path,
+    extension: str,
+    settings: Pass,
+    output: Path,
+    progress: Path,
+    palette: Path | None = None,
+) -> ty.List[str]:
+    """Build the ffmpeg command of a pass.
+
+    For GIF, `palette` is the palette generated for the pass, or None to generate it.
+    """
+
+    width = max(2, int(animation.width * settings.scale) // 2 * 2)
+    height = max(2, int(animation.height * settings.scale) // 2 * 2)
+    scale = f"scale={width}:{height}:flags=lanczos"
+
+    args = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-progress",
+        str(progress),
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-i",
+        str(concat),
+    ]
+
+    if extension == "gif" and palette is None:
+        return [
+            *args,
+            "-vf",
+            f"{scale},palettegen=max_colors={settings.colors}:stats_mode=diff",
+            "-update",
+            "1",
+            str(output),
+        ]
+
+    if extension == "gif":
+        args += [
+            "-i",
+            str(palette),
+            "-filter_complex",
+            f"[0:v]{scale}[v];[v][1:v]paletteuse=dither=bayer:bayer_scale={settings.bayer_scale}:diff_mode=rectangle",
+            "-loop",
+            "0",
+        ]
+    else:
+        args += [
+            "-vf",
+            scale,
+            "-c:v",
+            "libvpx-vp9",
+            "-pix_fmt",
+            "yuv420p",
+            "-b:v",
+            str(settings.bitrate),
+            "-maxrate",
+            str(int(settings.bitrate * 1.2)),
+            "-bufsize",
+            str(settings.bitrate * 2),
+            "-deadline",
+            "good",
+            "-cpu-used",
+            "4",
+            "-row-mt",
+            "1",
+            # Write the output progressively, so that its size can be watched
+            "-cluster_size_limit",
+            "65536",
+            "-cluster_time_limit",
+            "1000",
+        ]
+
+    # Keep the (variable) frame delays
+    return [*args, "-fps_mode", "passthrough", "-an", str(output)]
+
+
+def run_pass(
+    args: ty.List[str],
+    output: Path,
+    progress: Path,
+    duration: float,
+    max_bytes: float = math.inf,
+) -> float:
+    """Run ffmpeg, and return the size of the output.
+
+    The output is watched while it is written. If it grows beyond `max_bytes`, ffmpeg is stopped
+    and the final size is extrapolated from the encoding progress instead.
+    """
+
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while True:
+            try:
+                process.wait(timeout=0.2)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+            if output.is_file() and (size := output.stat().st_size) > max_bytes:
+                process.kill()
+                process.wait()
+                done = _progress(progress) / duration
+                logger.debug(f"Encoding stopped at {done:.0%}, {size} bytes")
+                return size / done if done > 0.05 else size * 20
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+    if process.returncode:
+        raise RuntimeError(
+            f"ffmpeg failed: {process.stderr.read().decode(errors='replace')[-1000:]}"
+        )
+    return output.stat().st_size
+
+
+def _progress(progress: Path) -> float:
+    """Return the encoded duration (in seconds) from an ffmpeg progress file."""
+
+    seconds = 0.0
+    try:
+        for line in progress.read_text().splitlines():
+            key, _, value = line.partition("=")
+            if key == "out_time_us" and value.strip().isdigit():
+                seconds = int(value) / 1_000_000
+    except OSError:
+        pass
+    return seconds
+
+
+def encode_ugoira(archive: Path, extension: str, max_bytes: int) -> Path | None:
+    """Encode an ugoira archive into a WebM or GIF animation no larger than `max_bytes`.
+
+    Frames are extracted to disk and streamed through ffmpeg.
+    Return None if the animation does not fit after MAX_PASSES passes.
+    """
+
+    output = archive.with_suffix(f".{extension}")
+
+    with tempfile.TemporaryDirectory() as tempdir, zipfile.ZipFile(archive) as zfile:
+        directory = Path(tempdir)
+        animation = read_ugoira(zfile)
+        zfile.extractall(directory, [name for name, _ in animation.frames])
+
+        concat = directory / "ffconcat.txt"
+        lines = ["ffconcat version 1.0"]
+        for name, delay in animation.frames:
+            lines += [f"file '{directory / name}'", f"duration {delay / 1000}"]
+        # The duration of the last frame is only applied if it is followed by another one
+        lines.append(f"file '{directory / animation.frames[-1][0]}'")
+        concat.write_text("\n".join(lines) + "\n")
+
+        progress = directory / "progress.txt"
+        settings = first_pass(animation, extension, max_bytes)
+        for number in range(1, MAX_PASSES + 1):
+            start = time.monotonic()
+
+            palette = None
+            if extension == "gif":
+                palette = directory / f"palette{number}.png"
+                run_pass(
+                    ffmpeg_args(
+                        animation, concat, extension, settings, palette, progress
+                    ),
+                    palette,
+                    progress,
+                    animation.duration,
+                )
+
+            size = run_pass(
+                ffmpeg_args(
+                    animation, concat, extension, settings, output, progress, palette
+                ),
+                output,
+                progress,
+                animation.duration,
+                max_bytes,
+            )
+            logger.info(
+                f"Ugoira pass {number}: {settings}, {size / 1024 / 1024:.2f}/{max_bytes / 1024 / 1024:.2f} MiB in {time.monotonic() - start:.1f}s"
+            )
+            if size <= max_bytes:
+                return output
+            if (
+                corrected := next_pass(animation, settings, extension, size, max_bytes)
+            ) == settings:
+                # Already at the lowest settings
+                break
+            settings = corrected
+
+    output.unlink(missing_ok=True)
+    return None
+
+
+@contextlib.contextmanager
+def memory_limit(max_bytes: int) -> ty.Iterator[None]:
+    """Limit the address space of the process for the duration of the context (POSIX only).
+
+    Allocations beyond the limit raise MemoryError.
+    """
+
+    try:
+        import resource
+    except ImportError:
+        yield
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_bytes = min(max_bytes, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+class ImagePass(ty.NamedTuple):
+    """Encoder settings of a still image pass."""
+
+    scale: float
+    # JPEG quality, or None for PNG
+    quality: int | None
+
+
+def plan_image(
+    bytes_per_pixel: float, pixels: int, quality: int | None, target: float
+) -> ImagePass:
+    """Pick the settings that should fit the image into `target` bytes.
+
+    `bytes_per_pixel` is the (estimated) size at quality 90 for JPEG, or the size for PNG.
+    """
+
+    if quality is None:
+        return ImagePass(min(1, math.sqrt(target / (bytes_per_pixel * pixels))), None)
+
+    # Quality steps first
+    for quality, factor in JPEG_QUALITIES.items():
+        if bytes_per_pixel * factor * pixels <= target:
+            return ImagePass(1, quality)
+
+    # Then resolution steps
+    size = bytes_per_pixel * JPEG_QUALITIES[JPEG_SCALED_QUALITY] * pixels
+    return ImagePass(math.sqrt(target / size), JPEG_SCALED_QUALITY)
+
+
+def encode_image(path: Path, settings: ImagePass) -> bytes:
+    with Image.open(path) as image:
+        width, height = image.size
+        size = (
+            max(1, int(width * settings.scale)),
+            max(1, int(height * settings.scale)),
+        )
+
+        if settings.quality is None:
+            if size != image.size:
+                image = image.resize(size, Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "PNG")
+            return buffer.getvalue()
+
+        # Let the JPEG decoder skip the detail that is going to be scaled away, which saves most of the memory
+        image.draft("RGB", size)
+        # convert() copies the image even if it is RGB already
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=settings.quality, optimize=True)
+        return buffer.getvalue()
+
+
+def fit_image(path: Path, max_bytes: int, memory_bytes: int) -> Path | None:
+    """Recompress or downscale a still image to at most `max_bytes`.
+
+    Images are converted to JPEG, unless they have transparency. JPEG quality steps are tried
+    before resolution steps. Each step is picked from the size of the last encode instead of
+    trying them all. The address space of the process is limited to `memory_bytes` meanwhile.
+    Return None if the image does not fit (or is too big to be processed).
+    """
+
+    target = max_bytes * SIZE_MARGIN
+
+    try:
+        with memory_limit(memory_bytes):
+            with Image.open(path) as image:
+                pixels = image.width * image.height
+                transparent = image.mode in ("RGBA", "LA", "PA") or (
+                    "transparency" in image.info
+                )
+                is_jpeg = image.format == "JPEG"
+
+            quality = None if transparent else 90
+            # Guess from the original, assuming a JPEG original is of quality 90 or above
+            bytes_per_pixel = path.stat().st_size / pixels
+            if not is_jpeg and not transparent:
+                bytes_per_pixel = bytes_per_pixel * 0.5
+
+            settings = plan_image(bytes_per_pixel, pixels, quality, target)
+            best = None
+            for number in range(1, MAX_IMAGE_PASSES + 1):
+                start = time.monotonic()
+                data = encode_image(path, settings)
+                logger.info(
+                    f"Image pass {number}: {settings}, {len(data) / 1024 / 1024:.2f}/{max_bytes / 1024 / 1024:.2f} MiB in {time.monotonic() - start:.1f}s"
+                )
+
+                if len(data) <= max_bytes:
+                    if best is None or len(data) > len(best):
+                        best = data
+                    # Stop unless the estimate was far off and a better looking pass is possible
+                    if len(data) >= target / 2 or settings == ImagePass(1, quality):
+                        break
+
+                # Correct the estimate with the actual size, and aim a bit lower
+                bytes_per_pixel = len(data) / (pixels * settings.scale**2)
+                if settings.quality is not None:
+                    bytes_per_pixel /= JPEG_QUALITIES[settings.quality]
+                previous = settings
+                settings = plan_image(bytes_per_pixel, pixels, quality, target * 0.95)
+                if settings == previous:
+                    break
+
+            if best is not None:
+                output = path.with_suffix(".png" if quality is None else ".jpg")
+                path.unlink()
+                output.write_bytes(best)
+                return output
+
+    except (MemoryError, Image.DecompressionBombError) as e:
+        logger.error(f"Image too big to be processed: {e!r}")
+
+    return None
@@ -0,0 +1,126 @@
+import hashlib
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+from ._cog_base import is_attachment_url_reusable
+
+logger = logging.getLogger(__name__)
+
+
+class CachedFile:
+    __slots__ = ("path", "size", "url")
+
+    def __init__(self, path: Path, size: int, url: str | None = None) -> None:
+        self.path = path
+        self.size = size
+        # Discord attachment URL of the file, once it has been uploaded
+        self.url = url
+
+
+class PixivCache:
+    """Cache of Pixiv downloads on disk, keyed by artwork ID, image number, animation format and size limit.
+
+    Least recently used files are evicted when their total size exceeds `max_bytes`.
+    The Discord attachment URL of a file is remembered after its first upload,
+    so that later requests can link to it instead of uploading the file again.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.entries: OrderedDict[str, CachedFile] = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(
+        artwork_id: int, image_number: int, animation_format: str, max_size: int
+    ) -> str:
+        return hashlib.sha256(
+            f"{artwork_id}\0{image_number}\0{animation_format}\0{max_size}".encode()
+        ).hexdigest()
+
+    def _load(self) -> None:
+        """Index the files cached before the last restart, least recently used first."""
+
+        files = [
+            (path.stat().st_mtime, path)
+            for path in self.directory.iterdir()
+            if path.is_file() and path.suffix != ".url"
+        ]
+        for _, path in sorted(files):
+            url_file = path.with_suffix(".url")
+            entry = CachedFile(
+                path,
+                path.stat().st_size,
+                url_file.read_text().strip() if url_file.is_file() else None,
+            )
+            self.entries[path.stem] = entry
+            self.used += entry.size
+
+        self._evict()
+
+    def get(self, key: str) -> CachedFile | None:
+        if (entry := self.entries.get(key)) is None:
+            self.misses += 1
+            return None
+
+        try:
+            # The modification time keeps the LRU order across restarts
+            os.utime(entry.path)
+        except OSError:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, file: Path) -> CachedFile:
+        """Move the file into the cache."""
+
+        size = file.stat().st_size
+        if size > self.max_bytes:
+            # Too big to be cached, use the file as is
+            return CachedFile(file, size)
+
+        if key in self.entries:
+            self._remove(key)
+
+        path = self.directory / f"{key}{file.suffix}"
+        shutil.move(file, path)
+        self.entries[key] = entry = CachedFile(path, size)
+        self.used += size
+        self._evict()
+        return entry
+
+    def reusable_url(self, entry: CachedFile) -> str | None:
+        """Return the attachment URL of the file, if it can still be linked to."""
+
+        if entry.url is None or not is_attachment_url_reusable(entry.url):
+            return None
+        return entry.url
+
+    def set_url(self, entry: CachedFile, url: str) -> None:
+        entry.url = url
+        if entry.path.parent == self.directory:
+            entry.path.with_suffix(".url").write_text(url)
+
+    def _evict(self) -> None:
+        while self.used > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str) -> None:
+        entry = self.entries.pop(key)
+        self.used -= entry.size
+        entry.path.unlink(missing_ok=True)
+        entry.path.with_suffix(".url").unlink(missing_ok=True)
@@ -0,0 +1,96 @@
+import logging
+import re
+import typing as ty
+import urllib.parse
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Pixiv rejects requests without a browser-like User-Agent and Referer
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:131.0) Gecko/20100101 Firefox/131.0",
+    "Referer": "https://www.pixiv.net/",
+}
+
+# illustType of animations
+UGOIRA = 2
+
+
+class ArtworkNotFoundError(Exception):
+    pass
+
+
+class Artwork(ty.NamedTuple):
+    id: int
+    title: str
+    author: str
+    author_id: int
+    page_count: int
+    is_ugoira: bool
+    # Sample image URL (on i.pximg.net) of the first page, None if it is hidden without login (e.g. R-18)
+    image_url: str | None
+
+
+class PixivMetadata:
+    """Client of the Pixiv AJAX API, used to embed artworks without downloading them.
+
+    Images are linked through `proxy_url`, a mirror of i.pximg.net (which rejects requests from other sites),
+    e.g. https://i.pixiv.re or https://phixiv.net/i.
+    """
+
+    def __init__(self, base_url: str, proxy_url: str, timeout: float) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.proxy_url = proxy_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session: aiohttp.ClientSession | None = None
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    async def fetch(self, artwork_id: int) -> Artwork:
+        """Fetch the metadata of an artwork.
+
+        Raise ArtworkNotFoundError if it does not exist,
+        or aiohttp.ClientError/TimeoutError if Pixiv cannot be reached.
+        """
+
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(headers=HEADERS, timeout=self.timeout)
+
+        async with self.session.get(
+            f"{self.base_url}/ajax/illust/{artwork_id}"
+        ) as response:
+            if response.status in (400, 404):
+                raise ArtworkNotFoundError(artwork_id)
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+
+        if data.get("error") or not data.get("body"):
+            raise ArtworkNotFoundError(artwork_id)
+
+        body = data["body"]
+        return Artwork(
+            id=int(body["illustId"]),
+            title=body["illustTitle"],
+            author=body["userName"],
+            author_id=int(body["userId"]),
+            page_count=int(body["pageCount"]),
+            is_ugoira=body["illustType"] == UGOIRA,
+            image_url=(body.get("urls") or {}).get("regular"),
+        )
+
+    def image_url(self, artwork: Artwork, image_number: int) -> str | None:
+        """Return the proxied sample image URL of a page of the artwork."""
+
+        if artwork.image_url is None:
+            return None
+
+        # Pages only differ by their number, e.g. 12345_p0_master1200.jpg -> 12345_p1_master1200.jpg
+        path = re.sub(
+            rf"/{artwork.id}_p0",
+            f"/{artwork.id}_p{image_number - 1}",
+            urllib.parse.urlsplit(artwork.image_url).path,
+        )
+        return self.proxy_url + path
@@ -0,0 +1,187 @@
+import datetime as dt
+import heapq
+import logging
+import math
+import random
+import statistics
+import typing as ty
+import zoneinfo
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+# The YouTube API quota is reset at midnight Pacific Time
+QUOTA_TIMEZONE = zoneinfo.ZoneInfo("America/Los_Angeles")
+# Share of the daily quota planned for polls; The rest is left for video lookups and /subscribe
+POLL_QUOTA_SHARE = 0.9
+# Poll interval (in seconds) of a channel uploading once a day; Channels uploading n times as often are polled
+# sqrt(n) times as often, which minimizes the average detection delay for a given number of polls
+DAILY_UPLOADER_INTERVAL = 15 * 60
+# A channel is assumed to upload less often once its last upload is this many times older than its usual interval
+SLOWDOWN_FACTOR = 4
+# Poll intervals are randomized by up to this fraction, so that polls do not come in bursts
+JITTER = 0.1
+
+
+def upload_interval(upload_times: ty.Iterable[float]) -> int | None:
+    """Return the median time (in seconds) between consecutive uploads, None if there are fewer than 2 uploads."""
+
+    ordered = sorted(upload_times)
+    if len(ordered) < 2:
+        return None
+    return round(
+        statistics.median(
+            later - earlier for earlier, later in zip(ordered, ordered[1:])
+        )
+    )
+
+
+class PollScheduler:
+    """Decide when each YouTube channel is polled next, with a heap of next poll times.
+
+    A channel is polled more often the more often it uploads (see DAILY_UPLOADER_INTERVAL),
+    within [min_interval, max_interval].
+    All intervals are stretched when polling every channel would exceed the daily quota.
+    Times are in seconds since the epoch.
+    """
+
+    def __init__(
+        self,
+        daily_quota: int,
+        min_interval: float,
+        max_interval: float,
+        default_interval: float,
+    ) -> None:
+        self.daily_quota = daily_quota
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.default_interval = default_interval
+
+        self.heap: ty.List[ty.Tuple[float, int]] = []
+        # Next poll time of each scheduled channel; Heap entries not matching it are stale
+        self.next_polls: ty.Dict[int, float] = {}
+        # Poll interval of each channel (before stretching), and the resulting polls per day
+        self.intervals: ty.Dict[int, float] = {}
+        self.polls_per_day = 0.0
+
+        self.day: dt.date | None = None
+        self.quota_used = 0
+        # Time between the upload and the detection of each new video today
+        self.detection_delays: ty.List[float] = []
+
+    def interval(
+        self,
+        last_upload_at: float | None,
+        upload_interval: int | None,
+        now: float,
+    ) -> float:
+        """Return the poll interval of a channel, given its last upload time and the median time between its uploads."""
+
+        if last_upload_at is None:
+            return self.default_interval
+
+        since_last_upload = now - last_upload_at
+        gap = max(
+            upload_interval if upload_interval is not None else since_last_upload,
+            since_last_upload / SLOWDOWN_FACTOR,
+        )
+        return min(
+            max(DAILY_UPLOADER_INTERVAL * math.sqrt(gap / DAY), self.min_interval),
+            self.max_interval,
+        )
+
+    @property
+    def stretch(self) -> float:
+        """Factor applied to poll intervals to stay within the daily quota."""
+
+        return max(1, self.polls_per_day / (self.daily_quota * POLL_QUOTA_SHARE))
+
+    def schedule(
+        self, channel_id: int, interval: float, last_polled_at: float, now: float
+    ) -> None:
+        """(Re)schedule the next poll of a channel, an interval after it was last polled.
+
+        Channels overdue (e.g. after a restart) are spread over the next `min_interval`.
+        """
+
+        if channel_id in self.intervals:
+            self.polls_per_day -= DAY / self.intervals[channel_id]
+        self.intervals[channel_id] = interval
+        self.polls_per_day += DAY / interval
+
+        next_poll = last_polled_at + interval * self.stretch * random.uniform(
+            1 - JITTER, 1 + JITTER
+        )
+        if next_poll < now:
+            next_poll = now + random.uniform(0, self.min_interval)
+        self._push(channel_id, next_poll)
+
+    def remove(self, channel_id: int) -> None:
+        if (interval := self.intervals.pop(channel_id, None)) is not None:
+            self.polls_per_day -= DAY / interval
+        self.next_polls.pop(channel_id, None)
+
+    def pop_due(self, now: float) -> ty.List[int]:
+        """Return the channels due to be polled. They must be rescheduled (or removed) after they are polled.
+
+        If the daily quota is used up, the polls are postponed until it is reset.
+        """
+
+        self._roll_over(now)
+
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            next_poll, channel_id = heapq.heappop(self.heap)
+            if self.next_polls.get(channel_id) == next_poll:
+                del self.next_polls[channel_id]
+                due.append(channel_id)
+
+        if self.quota_used >= self.daily_quota:
+            reset = dt.datetime.combine(
+                dt.datetime.fromtimestamp(now, QUOTA_TIMEZONE).date()
+                + dt.timedelta(days=1),
+                dt.time(),
+                QUOTA_TIMEZONE,
+            ).timestamp()
+            for channel_id in due:
+                self._push(
+                    channel_id,
+                    reset + random.uniform(0, self.intervals[channel_id]),
+                )
+            return []
+
+        return due
+
+    def spend(self, units: int, now: float) -> None:
+        """Count quota units used by YouTube API requests."""
+
+        self._roll_over(now)
+        self.quota_used += units
+
+    def detected(self, uploaded_at: float, now: float) -> None:
+        """Record the detection delay of a new video."""
+
+        self._roll_over(now)
+        self.detection_delays.append(max(0, now - uploaded_at))
+
+    def report(self) -> str:
+        delays = sorted(self.detection_delays)
+        report = f"YouTube quota used on {self.day}: {self.quota_used}/{self.daily_quota} units ({len(self.intervals)} channels, {self.polls_per_day * self.stretch:.0f} polls per day planned)"
+        if delays:
+            report += f"; Detection delay of {len(delays)} new videos: median {delays[len(delays) // 2]:.0f}s, max {delays[-1]:.0f}s"
+        return report
+
+    def _push(self, channel_id: int, next_poll: float) -> None:
+        self.next_polls[channel_id] = next_poll
+        heapq.heappush(self.heap, (next_poll, channel_id))
+
+    def _roll_over(self, now: float) -> None:
+        day = dt.datetime.fromtimestamp(now, QUOTA_TIMEZONE).date()
+        if day == self.day:
+            return
+
+        if self.day is not None:
+            logger.info(self.report())
+        self.day = day
+        self.quota_used = 0
+        self.detection_delays = []
@@ -0,0 +1,206 @@
+import datetime as dt
+import hashlib
+import logging
+import time
+import typing as ty
+from collections import OrderedDict
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..models import ChatCache
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry(ty.NamedTuple):
+    response: str
+    size: int
+    # Expiry time, in time.monotonic() seconds
+    expires_at: float
+
+
+class ResponseCache:
+    """Two tier cache of AI responses, keyed by the model name, the normalized prompt
+    and the digest of the earlier conversation (if any).
+
+    The first tier is an in-memory LRU. The optional second tier is the `chat_cache` table in SQLite.
+    Both tiers evict entries older than `ttl` seconds, and evict least recently used entries
+    when their total size exceeds their byte limit.
+    """
+
+    def __init__(
+        self,
+        sessionmaker: async_sessionmaker[AsyncSession],
+        ttl: int,
+        memory_bytes: int,
+        db_bytes: int,
+    ) -> None:
+        self.sessionmaker = sessionmaker
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.db_bytes = db_bytes
+
+        self.memory: OrderedDict[str, _Entry] = OrderedDict()
+        self.memory_used = 0
+        # Total size of the SQLite tier, lazily loaded from the database on first write
+        self.db_used: int | None = None
+
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        # Hits (of either tier) on prompts with an earlier conversation
+        self.follow_up_hits = 0
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, context: str = "") -> str:
+        """Hash the model name together with the prompt (case and whitespace insensitive),
+        and the digest of the earlier conversation.
+        """
+
+        normalized = " ".join(prompt.split()).casefold()
+        if context:
+            normalized = f"{context}\0{normalized}"
+        return hashlib.sha256(f"{model_name}\0{normalized}".encode()).hexdigest()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.memory_hits + self.db_hits + self.misses
+        return (self.memory_hits + self.db_hits) / total if total else 0
+
+    async def get(self, model_name: str, prompt: str, context: str = "") -> str | None:
+        """Return the cached response of the prompt, or None if there is none.
+
+        `context` is the digest of the earlier conversation, empty if there is none.
+        """
+
+        key = self.make_key(model_name, prompt, context)
+
+        if (entry := self.memory.get(key)) is not None:
+            if entry.expires_at > time.monotonic():
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                self.follow_up_hits += bool(context)
+                return entry.response
+            self._memory_pop(key)
+
+        if self.db_bytes > 0:
+            now = dt.datetime.now(dt.UTC)
+            async with self.sessionmaker() as session:
+                row = (
+                    await session.execute(
+                        select(ChatCache.response, ChatCache.created_at).where(
+                            ChatCache.cache_key == key,
+                            ChatCache.created_at > now - dt.timedelta(seconds=self.ttl),
+                        )
+                    )
+                ).first()
+
+                if row is not None:
+                    await session.execute(
+                        update(ChatCache)
+                        .where(ChatCache.cache_key == key)
+                        .values(last_used_at=now)
+                    )
+                    await session.commit()
+
+                    # Promote to the memory tier, keeping the original expiry time
+                    age = (now.replace(tzinfo=None) - row.created_at).total_seconds()
+                    self._memory_put(key, row.response, self.ttl - age)
+                    self.db_hits += 1
+                    self.follow_up_hits += bool(context)
+                    return row.response
+
+        self.misses += 1
+        return None
+
+    async def put(
+        self, model_name: str, prompt: str, response: str, context: str = ""
+    ) -> None:
+        """Cache the response of the prompt."""
+
+        key = self.make_key(model_name, prompt, context)
+        self._memory_put(key, response, self.ttl)
+
+        if self.db_bytes > 0:
+            await self._db_put(key, response)
+
+    async def flush(self) -> None:
+        """Remove everything from the cache and reset the statistics."""
+
+        self.memory.clear()
+        self.memory_used = 0
+        self.memory_hits = self.db_hits = self.misses = self.follow_up_hits = 0
+
+        async with self.sessionmaker() as session:
+            await session.execute(delete(ChatCache))
+            await session.commit()
+        self.db_used = 0
+
+    def _memory_put(self, key: str, response: str, ttl: float) -> None:
+        size = len(response.encode())
+        if size > self.memory_bytes or ttl <= 0:
+            return
+
+        self._memory_pop(key)
+        self.memory[key] = _Entry(response, size, time.monotonic() + ttl)
+        self.memory_used += size
+
+        while self.memory_used > self.memory_bytes:
+            self._memory_pop(next(iter(self.memory)))
+
+    def _memory_pop(self, key: str) -> None:
+        if (entry := self.memory.pop(key, None)) is not None:
+            self.memory_used -= entry.size
+
+    async def _db_put(self, key: str, response: str) -> None:
+        size = len(response.encode())
+        if size > self.db_bytes:
+            return
+
+        now = dt.datetime.now(dt.UTC)
+        async with self.sessionmaker() as session:
+            if self.db_used is None:
+                self.db_used = (
+                    await session.execute(
+                        select(func.coalesce(func.sum(ChatCache.size), 0))
+                    )
+                ).scalar_one()
+
+            # Expired entries go first
+            freed = (
+                await session.execute(
+                    delete(ChatCache)
+                    .where(
+                        (ChatCache.created_at <= now - dt.timedelta(seconds=self.ttl))
+                        | (ChatCache.cache_key == key)
+                    )
+                    .returning(ChatCache.size)
+                )
+            ).scalars()
+            self.db_used -= sum(freed)
+
+            # Then the least recently used ones, until the new entry fits
+            if self.db_used + size > self.db_bytes:
+                to_free = self.db_used + size - self.db_bytes
+                stale_ids: ty.List[int] = []
+                result = await session.stream(
+                    select(ChatCache.id, ChatCache.size).order_by(
+                        ChatCache.last_used_at
+                    )
+                )
+                async for row in result:
+                    stale_ids.append(row.id)
+                    to_free -= row.size
+                    self.db_used -= row.size
+                    if to_free <= 0:
+                        break
+                await result.close()
+
+                await session.execute(
+                    delete(ChatCache).where(ChatCache.id.in_(stale_ids))
+                )
+
+            session.add(ChatCache(cache_key=key, response=response, size=size))
+            await session.commit()
+            self.db_used += size
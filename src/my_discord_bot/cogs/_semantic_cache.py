@@ -0,0 +1,272 @@
+import asyncio
+import json
+import logging
+import typing as ty
+from pathlib import Path
+
+import numpy as np
+
+from ._ai_backend import BackendPool
+
+logger = logging.getLogger(__name__)
+
+# Leading dimensions of the vectors scanned to find candidates, and number of candidates re-ranked
+# by their full vectors; Scanning the whole matrix takes tens of milliseconds for 100k 1536-d vectors
+PREFIX_DIM = 64
+CANDIDATES = 512
+
+
+class VectorIndex:
+    """Fixed capacity index of unit vectors stored in one contiguous float32 matrix.
+
+    Searches scan a copy of the first PREFIX_DIM dimensions of the vectors (embedding models usually
+    front-load the most information there), and re-rank the best candidates by their full vectors.
+    Each vector is tagged with the ID of the conversation context it was asked in (0 for none),
+    and only matches vectors of the same context. Once full, the oldest vector is overwritten.
+    """
+
+    def __init__(self, dim: int, max_entries: int) -> None:
+        self.dim = dim
+        self.max_entries = max_entries
+        # Grown by doubling up to max_entries, so that small guilds stay small
+        self.vectors = np.empty((min(64, max_entries), dim), dtype=np.float32)
+        self.prefixes = np.empty(
+            (len(self.vectors), min(PREFIX_DIM, dim)), dtype=np.float32
+        )
+        self.contexts = np.empty(len(self.vectors), dtype=np.uint64)
+        self.responses: ty.List[str] = []
+        self.count = 0
+        # Next slot to be written
+        self.cursor = 0
+        # Number of vectors ever added, which tells searches in other threads that a slot was overwritten
+        self.added = 0
+
+    def add(self, vector: np.ndarray, response: str, context: int = 0) -> None:
+        if self.cursor == len(self.vectors) and len(self.vectors) < self.max_entries:
+            size = min(len(self.vectors) * 2, self.max_entries)
+            vectors = np.empty((size, self.dim), dtype=np.float32)
+            vectors[: self.count] = self.vectors[: self.count]
+            prefixes = np.empty((size, self.prefixes.shape[1]), dtype=np.float32)
+            prefixes[: self.count] = self.prefixes[: self.count]
+            contexts = np.empty(size, dtype=np.uint64)
+            contexts[: self.count] = self.contexts[: self.count]
+            self.vectors, self.prefixes, self.contexts = vectors, prefixes, contexts
+
+        self.vectors[self.cursor] = vector
+        self.prefixes[self.cursor] = vector[: self.prefixes.shape[1]]
+        self.contexts[self.cursor] = context
+        if self.cursor < len(self.responses):
+            self.responses[self.cursor] = response
+        else:
+            self.responses.append(response)
+
+        self.count = max(self.count, self.cursor + 1)
+        self.cursor = (self.cursor + 1) % self.max_entries
+        self.added += 1
+
+    def search_slots(
+        self, vector: np.ndarray, k: int = 1, context: int = 0
+    ) -> ty.List[ty.Tuple[float, int]]:
+        """Return the k most similar entries of the context as (cosine similarity, slot),
+        most similar first.
+
+        Only reads the index, so that it can run in another thread while vectors are added.
+        """
+
+        count = min(self.count, len(self.vectors), len(self.contexts))
+        if count == 0:
+            return []
+
+        vectors = self.vectors[:count]
+        matches = self.contexts[:count] == context
+        if count <= CANDIDATES:
+            candidates = np.flatnonzero(matches)
+        else:
+            prefixes = self.prefixes[:count]
+            prefix_scores = prefixes @ vector[: prefixes.shape[1]]
+            prefix_scores[~matches] = -np.inf
+            candidates = np.argpartition(prefix_scores, -CANDIDATES)[-CANDIDATES:]
+            # Fewer than CANDIDATES entries may be in the context
+            candidates = candidates[matches[candidates]]
+        if len(candidates) == 0:
+            return []
+
+        scores = vectors[candidates] @ vector
+        k = min(k, len(candidates))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(float(scores[i]), int(candidates[i])) for i in top]
+
+    def search(
+        self, vector: np.ndarray, k: int = 1, context: int = 0
+    ) -> ty.List[ty.Tuple[float, str]]:
+        """Return the k most similar entries of the context as (cosine similarity, response),
+        most similar first.
+        """
+
+        return [
+            (score, self.responses[slot])
+            for score, slot in self.search_slots(vector, k, context)
+        ]
+
+    def save(self, path: Path, meta: ty.Dict[str, ty.Any]) -> None:
+        np.save(path.with_suffix(".npy"), self.vectors[: self.count])
+        path.with_suffix(".json").write_text(
+            json.dumps(
+                {
+                    **meta,
+                    "cursor": self.cursor,
+                    "responses": self.responses,
+                    "contexts": self.contexts[: self.count].tolist(),
+                }
+            ),
+            encoding="utf-8",
+        )
+
+    @classmethod
+    def load(
+        cls, path: Path, max_entries: int
+    ) -> ty.Tuple["VectorIndex", ty.Dict[str, ty.Any]]:
+        meta = json.loads(path.with_suffix(".json").read_text(encoding="utf-8"))
+        vectors = np.load(path.with_suffix(".npy"))
+
+        index = cls(vectors.shape[1], max_entries)
+        # Indexes saved before contexts were added only have prompts without context
+        contexts = meta.get("contexts", [0] * len(vectors))
+        # Keep only the newest entries if max_entries has shrunk since the last save
+        order = [(meta["cursor"] + i) % len(vectors) for i in range(len(vectors))][
+            -max_entries:
+        ]
+        for i in order:
+            index.add(vectors[i], meta["responses"][i], contexts[i])
+        return index, meta
+
+
+def normalize(vector: ty.Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    return array / (np.linalg.norm(array) or 1)
+
+
+def context_id(context: str) -> int:
+    """Shorten the (hex) digest of a conversation to a 64-bit ID; 0 if there is no conversation."""
+
+    return int(context[:16], 16) if context else 0
+
+
+class SemanticCache:
+    """Cache of AI responses looked up by the embedding similarity of prompts.
+
+    Each guild has its own VectorIndex. Prompts only match prompts asked after the same conversation
+    (by its digest). Indexes are persisted under `directory`.
+    """
+
+    def __init__(
+        self,
+        backends: BackendPool,
+        model_name: str,
+        embedding_model: str,
+        threshold: float,
+        max_entries: int,
+        directory: Path,
+    ) -> None:
+        self.backends = backends
+        self.model_name = model_name
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.directory = directory
+
+        self.indexes: ty.Dict[int, VectorIndex] = {}
+        # Guilds with changes not yet saved to disk
+        self.dirty: ty.Set[int] = set()
+
+        self.hits = 0
+        self.misses = 0
+        # Hits on prompts with an earlier conversation
+        self.follow_up_hits = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for file in self.directory.glob("*.json"):
+            try:
+                index, meta = VectorIndex.load(file, self.max_entries)
+            except Exception as e:
+                logger.error(f"Failed to load semantic cache {file}: {e}")
+                continue
+
+            # Answers from other models are not reusable
+            if (meta["model_name"], meta["embedding_model"]) == (
+                self.model_name,
+                self.embedding_model,
+            ):
+                self.indexes[int(file.stem)] = index
+
+    @property
+    def meta(self) -> ty.Dict[str, str]:
+        return {"model_name": self.model_name, "embedding_model": self.embedding_model}
+
+    async def embed(self, prompt: str) -> np.ndarray:
+        return normalize(await self.backends.embed(self.embedding_model, prompt))
+
+    async def get(
+        self, guild_id: int, vector: np.ndarray, context: str = ""
+    ) -> str | None:
+        """Return the response of the most similar prompt after the same conversation,
+        if it is similar enough. `context` is the digest of the conversation, empty if there is none.
+
+        The search runs in another thread, so that large indexes do not block the event loop.
+        """
+
+        if (index := self.indexes.get(guild_id)) is not None:
+            added = index.added
+            results = await asyncio.to_thread(
+                index.search_slots, vector, 1, context_id(context)
+            )
+            # The slots written during the search (just before the cursor) now hold other responses
+            overwritten = index.added - added
+            for score, slot in results:
+                if (
+                    score >= self.threshold
+                    and self.indexes.get(guild_id) is index
+                    and (index.cursor - 1 - slot) % index.max_entries >= overwritten
+                ):
+                    self.hits += 1
+                    self.follow_up_hits += bool(context)
+                    return index.responses[slot]
+
+        self.misses += 1
+        return None
+
+    def put(
+        self, guild_id: int, vector: np.ndarray, response: str, context: str = ""
+    ) -> None:
+        if (index := self.indexes.get(guild_id)) is None or index.dim != len(vector):
+            index = self.indexes[guild_id] = VectorIndex(len(vector), self.max_entries)
+
+        index.add(vector, response, context_id(context))
+        self.dirty.add(guild_id)
+
+    async def save(self) -> None:
+        """Write changed indexes to disk."""
+
+        while self.dirty:
+            guild_id = self.dirty.pop()
+            index = self.indexes[guild_id]
+
+            # Write a copy in another thread, so that the index can be used in the meantime
+            snapshot = VectorIndex(index.dim, index.max_entries)
+            snapshot.vectors = index.vectors[: index.count].copy()
+            snapshot.contexts = index.contexts[: index.count].copy()
+            snapshot.responses = index.responses.copy()
+            snapshot.count, snapshot.cursor = index.count, index.cursor
+            await asyncio.to_thread(
+                snapshot.save, self.directory / str(guild_id), self.meta
+            )
+
+    def flush(self) -> None:
+        """Remove everything from the cache and reset the statistics."""
+
+        self.indexes.clear()
+        self.dirty.clear()
+        self.hits = self.misses = self.follow_up_hits = 0
+        for file in self.directory.glob("*.*"):
+            file.unlink()
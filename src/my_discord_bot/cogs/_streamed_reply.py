@@ -0,0 +1,73 @@
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a Discord message
+MESSAGE_LIMIT = 2000
+# Discord allows roughly 5 edits per 5 seconds on a channel; Stay well below that
+EDIT_INTERVAL = 1.2
+
+
+class StreamedReply:
+    """Write a reply into the followup messages of an interaction as it is being generated.
+
+    Edits are throttled to one per EDIT_INTERVAL seconds.
+    When a message reaches MESSAGE_LIMIT characters, the reply rolls over into a new message.
+    """
+
+    def __init__(self, ia: discord.Interaction) -> None:
+        self.ia = ia
+        # The message currently being written, and its content
+        self.message: discord.WebhookMessage | None = None
+        self.content = ""
+        # Content last pushed to Discord
+        self.shown = ""
+        self.last_push = 0.0
+        self.sent_any = False
+
+    async def write(self, text: str) -> None:
+        """Append text to the reply. Discord is only updated if the throttle allows it."""
+
+        self.content += text
+
+        while len(self.content) > MESSAGE_LIMIT:
+            head = self.content[:MESSAGE_LIMIT]
+            self.content = self.content[MESSAGE_LIMIT:]
+            await self._push(head)
+            self.message = None
+            self.shown = ""
+
+        if time.monotonic() - self.last_push >= EDIT_INTERVAL:
+            await self._push(self.content)
+
+    async def notice(self, text: str) -> None:
+        """Show a status text, which is replaced once the reply starts."""
+
+        await self._push(text)
+        self.sent_any = False
+        self.last_push = 0
+
+    async def close(self) -> None:
+        """Flush the remaining content to Discord."""
+
+        await self._push(self.content)
+
+        if not self.sent_any:
+            await self._push("The AI did not say anything.")
+
+    async def _push(self, content: str) -> None:
+        # Discord rejects empty messages
+        if not content.strip() or content == self.shown:
+            return
+
+        if self.message is None:
+            self.message = await self.ia.followup.send(content, wait=True)
+        else:
+            self.message = await self.message.edit(content=content)
+
+        self.shown = content
+        self.last_push = time.monotonic()
+        self.sent_any = True
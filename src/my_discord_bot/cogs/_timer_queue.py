@@ -0,0 +1,79 @@
+import asyncio
+import heapq
+import logging
+import time
+import typing as ty
+
+logger = logging.getLogger(__name__)
+
+
+class TimerQueue:
+    """Timers fired by a single task, which sleeps until the earliest one is due.
+
+    Timers are (due time, key) entries in a heap. Rescheduling or cancelling a timer leaves its old entry
+    in the heap, to be skipped; The heap is rebuilt when most of its entries are stale.
+    Due keys are passed to `callback` together. Times are in seconds since the epoch.
+    """
+
+    def __init__(
+        self, callback: ty.Callable[[ty.List[int]], ty.Awaitable[None]]
+    ) -> None:
+        self.callback = callback
+        self.heap: ty.List[ty.Tuple[float, int]] = []
+        # Due time of each pending timer; Heap entries not matching it are stale
+        self.due: ty.Dict[int, float] = {}
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task[None] | None = None
+
+    def __len__(self) -> int:
+        return len(self.due)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    def schedule(self, key: int, due: float) -> None:
+        """Add a timer, or move it to another time."""
+
+        self.due[key] = due
+        heapq.heappush(self.heap, (due, key))
+        if len(self.heap) > 2 * len(self.due) + 64:
+            self.heap = [(due, key) for key, due in self.due.items()]
+            heapq.heapify(self.heap)
+
+        if self.heap[0] == (due, key):
+            # The task is sleeping until a later timer
+            self.wakeup.set()
+
+    def cancel(self, key: int) -> None:
+        self.due.pop(key, None)
+
+    async def run(self) -> None:
+        while True:
+            while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+                heapq.heappop(self.heap)
+
+            self.wakeup.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except TimeoutError:
+                    pass
+                continue
+
+            keys = []
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                due, key = heapq.heappop(self.heap)
+                if self.due.get(key) == due:
+                    del self.due[key]
+                    keys.append(key)
+
+            try:
+                await self.callback(keys)
+            except Exception as e:
+                logger.error(f"Failed to fire {len(keys)} timers: {e!r}")
@@ -0,0 +1,185 @@
+import asyncio
+import datetime as dt
+import hmac
+import logging
+import typing as ty
+import urllib.parse
+import xml.etree.ElementTree as ET
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+HUB_URL = "https://pubsubhubbub.appspot.com/subscribe"
+TOPIC_URL = "https://www.youtube.com/xml/feeds/videos.xml?channel_id={channel_id}"
+# Requested lease (in seconds); The hub may grant a shorter one
+LEASE_SECONDS = 5 * 24 * 3600
+# Leases are renewed this long before they expire
+RENEW_MARGIN = dt.timedelta(days=1)
+# Digests the hub may sign notifications with (YouTube uses sha1)
+SIGNATURE_METHODS = {"sha1", "sha256", "sha384", "sha512"}
+NAMESPACES = {
+    "atom": "http://www.w3.org/2005/Atom",
+    "yt": "http://www.youtube.com/xml/schemas/2015",
+}
+
+
+class FeedEntry(ty.NamedTuple):
+    video_id: str
+    channel_id: str
+    published: dt.datetime
+
+
+def parse_feed(body: bytes) -> ty.List[FeedEntry]:
+    """Return the videos of an Atom feed pushed by the hub (deleted videos have no entry)."""
+
+    entries = []
+    for entry in ET.fromstring(body).iterfind("atom:entry", NAMESPACES):
+        video_id = entry.findtext("yt:videoId", None, NAMESPACES)
+        channel_id = entry.findtext("yt:channelId", None, NAMESPACES)
+        published = entry.findtext("atom:published", None, NAMESPACES)
+        if video_id and channel_id and published:
+            entries.append(
+                FeedEntry(video_id, channel_id, dt.datetime.fromisoformat(published))
+            )
+    return entries
+
+
+class WebSubReceiver:
+    """Receiver of YouTube upload notifications pushed by a WebSub (PubSubHubbub) hub.
+
+    Serves `callback_url`: the hub verifies subscriptions with GET requests,
+    and pushes Atom feeds (signed with `secret`) with POST requests.
+    Feed entries are passed to `on_entries` in a background task.
+    """
+
+    def __init__(
+        self,
+        callback_url: str,
+        on_entries: ty.Callable[[ty.List[FeedEntry]], ty.Awaitable[None]],
+        secret: str,
+        hub_url: str = HUB_URL,
+        timeout: float = 10,
+    ) -> None:
+        self.callback_url = callback_url
+        self.on_entries = on_entries
+        self.secret = secret.encode()
+        self.hub_url = hub_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.session: aiohttp.ClientSession | None = None
+        self.runner: web.AppRunner | None = None
+        # Subscribed channels, and when their leases expire (None until the hub verifies the subscription)
+        self.leases: ty.Dict[str, dt.datetime | None] = {}
+        self.tasks: ty.Set[asyncio.Task[None]] = set()
+
+    async def start(self, host: str, port: int) -> None:
+        path = urllib.parse.urlsplit(self.callback_url).path or "/"
+        app = web.Application()
+        app.router.add_get(path, self.verify)
+        app.router.add_post(path, self.receive)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+        if self.session is not None:
+            await self.session.close()
+
+    async def subscribe(self, channel_id: str) -> None:
+        """Ask the hub to push the uploads of the channel (or to renew the lease).
+
+        Raise aiohttp.ClientError/TimeoutError if the hub cannot be reached or rejects the request.
+        """
+
+        self.leases.setdefault(channel_id, None)
+        await self._request("subscribe", channel_id)
+
+    async def unsubscribe(self, channel_id: str) -> None:
+        self.leases.pop(channel_id, None)
+        await self._request("unsubscribe", channel_id)
+
+    def needs_renewal(self, channel_id: str) -> bool:
+        """Return True if the channel is not subscribed yet, or its lease expires soon."""
+
+        expiry = self.leases.get(channel_id)
+        return expiry is None or expiry - dt.datetime.now(dt.UTC) < RENEW_MARGIN
+
+    async def _request(self, mode: str, channel_id: str) -> None:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+
+        async with self.session.post(
+            self.hub_url,
+            data={
+                "hub.callback": self.callback_url,
+                "hub.mode": mode,
+                "hub.topic": TOPIC_URL.format(channel_id=channel_id),
+                "hub.verify": "async",
+                "hub.secret": self.secret.decode(),
+                "hub.lease_seconds": str(LEASE_SECONDS),
+            },
+        ) as response:
+            response.raise_for_status()
+
+    async def verify(self, request: web.Request) -> web.Response:
+        """Confirm the (un)subscription intents of this bot by echoing the challenge."""
+
+        mode = request.query.get("hub.mode")
+        challenge = request.query.get("hub.challenge")
+        channel_id = (
+            urllib.parse.parse_qs(
+                urllib.parse.urlsplit(request.query.get("hub.topic", "")).query
+            ).get("channel_id")
+            or [None]
+        )[0]
+
+        if mode == "denied":
+            logger.warning(
+                f"WebSub hub denied subscription of YouTube channel {channel_id}: {request.query.get('hub.reason')}"
+            )
+            return web.Response()
+
+        if challenge is None or channel_id is None:
+            return web.Response(status=404)
+
+        if mode == "subscribe" and channel_id in self.leases:
+            lease = request.query.get("hub.lease_seconds", "")
+            self.leases[channel_id] = dt.datetime.now(dt.UTC) + dt.timedelta(
+                seconds=int(lease) if lease.isdigit() else LEASE_SECONDS
+            )
+        elif not (mode == "unsubscribe" and channel_id not in self.leases):
+            return web.Response(status=404)
+
+        logger.debug(f"Verified WebSub {mode} of YouTube channel {channel_id}")
+        return web.Response(text=challenge)
+
+    async def receive(self, request: web.Request) -> web.Response:
+        """Handle a feed pushed by the hub."""
+
+        body = await request.read()
+
+        # Acknowledge invalid notifications anyway, as the hub would retry them otherwise
+        method, _, signature = request.headers.get("X-Hub-Signature", "").partition("=")
+        if method not in SIGNATURE_METHODS or not hmac.compare_digest(
+            hmac.new(self.secret, body, method).hexdigest(), signature
+        ):
+            logger.warning("Ignored WebSub notification with an invalid signature")
+            return web.Response(status=204)
+
+        try:
+            entries = parse_feed(body)
+        except (ET.ParseError, ValueError) as e:
+            logger.warning(f"Ignored malformed WebSub notification: {e!r}")
+            return web.Response(status=204)
+
+        if entries:
+            # Reply to the hub right away, the announcements may take a while
+            task = asyncio.create_task(self.on_entries(entries))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        return web.Response(status=204)
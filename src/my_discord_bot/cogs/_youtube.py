@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import random
+import typing as ty
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://www.googleapis.com/youtube/v3"
+# Responses worth retrying: rate limited or server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Backoff (in seconds) before the first retry, doubled for each retry after
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+# Maximum number of IDs in a list request
+MAX_IDS = 50
+
+
+class YouTubeError(Exception):
+    """Raised when the YouTube Data API rejects a request."""
+
+    def __init__(self, status: int, reason: str, message: str) -> None:
+        super().__init__(f"{status} {reason}: {message}")
+        self.status = status
+        self.reason = reason
+
+
+class YouTubeClient:
+    """Async client of the YouTube Data API v3.
+
+    Requests share a pool of keep-alive connections, at most `max_concurrency` at a time.
+    Connection failures, timeouts, rate limits and server errors are retried with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = API_URL,
+        max_concurrency: int = 10,
+        timeout: float = 10,
+        max_retries: int = 3,
+    ) -> None:
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session: aiohttp.ClientSession | None = None
+        # Number of requests sent (including retries); Each of them costs 1 quota unit
+        self.requests = 0
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+    async def request(self, resource: str, **params: str | int) -> ty.Dict[str, ty.Any]:
+        """Call a list method of the API, e.g. request("videos", part="snippet", id="...").
+
+        Raise YouTubeError if the request is rejected,
+        or aiohttp.ClientError/TimeoutError if it still fails after all retries.
+        """
+
+        return await self._request(resource, params, {})
+
+    async def request_if_modified(
+        self, resource: str, etag: str | None, **params: str | int
+    ) -> ty.Dict[str, ty.Any] | None:
+        """Like request(), but return None if the response still has the given ETag (see the `etag` of responses)."""
+
+        return await self._request(
+            resource, params, {"If-None-Match": etag} if etag else {}
+        )
+
+    async def _request(
+        self,
+        resource: str,
+        params: ty.Dict[str, str | int],
+        headers: ty.Dict[str, str],
+    ) -> ty.Any:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=self.timeout,
+            )
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    self.requests += 1
+                    async with self.session.get(
+                        f"{self.base_url}/{resource}",
+                        params={**params, "key": self.api_key},
+                        headers=headers,
+                    ) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status == 304:
+                            return None
+
+                        error = await self._error(response)
+                        if response.status not in RETRY_STATUSES:
+                            raise error
+                        if (
+                            header := response.headers.get("Retry-After", "")
+                        ).isdigit():
+                            retry_after = int(header)
+            except (aiohttp.ClientError, TimeoutError) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                raise error
+
+            delay = retry_after or min(
+                RETRY_DELAY * 2**attempt, MAX_RETRY_DELAY
+            ) * random.uniform(0.5, 1)
+            logger.warning(
+                f"YouTube API request to {resource} failed ({error!r}), retrying in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def list_all(
+        self, resource: str, max_pages: int = 10, **params: str | int
+    ) -> ty.List[ty.Dict[str, ty.Any]]:
+        """Call a list method of the API, following nextPageToken for up to `max_pages` pages. Return all items."""
+
+        items = []
+        for _ in range(max_pages):
+            response = await self.request(resource, **params)
+            items.extend(response.get("items", []))
+            if "nextPageToken" not in response:
+                break
+            params = {**params, "pageToken": response["nextPageToken"]}
+        return items
+
+    async def videos(
+        self, video_ids: ty.Iterable[str], part: str
+    ) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+        """Look up videos by ID, MAX_IDS per request. Return them by ID (deleted or private videos are missing)."""
+
+        unique_ids = list(dict.fromkeys(video_ids))
+        videos = {}
+        for items in await asyncio.gather(
+            *(
+                self.list_all(
+                    "videos",
+                    part=part,
+                    id=",".join(unique_ids[i : i + MAX_IDS]),
+                    maxResults=MAX_IDS,
+                )
+                for i in range(0, len(unique_ids), MAX_IDS)
+            )
+        ):
+            for video in items:
+                videos[video["id"]] = video
+        return videos
+
+    @staticmethod
+    async def _error(response: aiohttp.ClientResponse) -> YouTubeError:
+        try:
+            error = (await response.json(content_type=None))["error"]
+            reason = error["errors"][0]["reason"]
+            message = error["message"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            reason, message = response.reason or "", ""
+        return YouTubeError(response.status, reason, message)
@@ -1,26 +1,127 @@
+import asyncio
 import logging
-import math
 import os
+import typing as ty
+from pathlib import Path
 
 import discord
-import openai
-from discord.ext import commands
+from discord.ext import commands, tasks
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from ._ai_backend import BackendPool, NoBackendError
+from ._ai_scheduler import FairScheduler, QueueFullError
+from ._channel_summary import ChannelSummarizer
 from ._cog_base import CogBase, check_cooldown_factory
+from ._conversation import Conversation, ConversationStore, Turn, count_tokens
+from ._response_cache import ResponseCache
+from ._semantic_cache import SemanticCache
+from ._streamed_reply import StreamedReply
 
 logger = logging.getLogger(__name__)
 
-# TODO: Handle bad connections
-
 
 class AI(CogBase):
     def __init__(
         self, bot: commands.Bot, sessionmaker: async_sessionmaker[AsyncSession]
     ) -> None:
         super().__init__(bot, sessionmaker)
-        self.client = openai.OpenAI()
+        self.backends = BackendPool.from_env()
         self.model_name = os.getenv("OPENAI_MODEL_NAME", "")
+        self.cache = ResponseCache(
+            sessionmaker,
+            ttl=int(os.getenv("AI_CACHE_TTL", "86400")),
+            memory_bytes=int(os.getenv("AI_CACHE_MEMORY_SIZE", "16")) * 1024 * 1024,
+            db_bytes=int(os.getenv("AI_CACHE_DB_SIZE", "0")) * 1024 * 1024,
+        )
+
+        # Reuse answers of similar prompts, if an embedding model is set
+        self.semantic_cache: SemanticCache | None = None
+        if embedding_model := os.getenv("OPENAI_EMBEDDING_MODEL", ""):
+            self.semantic_cache = SemanticCache(
+                self.backends,
+                self.model_name,
+                embedding_model,
+                threshold=float(os.getenv("AI_SEMANTIC_CACHE_THRESHOLD", "0.95")),
+                max_entries=int(os.getenv("AI_SEMANTIC_CACHE_SIZE", "10000")),
+                directory=Path("./volume/semantic-cache"),
+            )
+            self.save_semantic_cache.start()
+
+        # Conversation history of each channel (or thread)
+        self.conversations = ConversationStore(
+            max_conversations=int(os.getenv("AI_CONVERSATION_LIMIT", "5000")),
+            idle_seconds=int(os.getenv("AI_CONVERSATION_IDLE_TIME", "3600")),
+        )
+        self.max_turns = int(os.getenv("AI_CONVERSATION_TURNS", "20"))
+        self.max_context_tokens = int(os.getenv("AI_CONTEXT_TOKENS", "3000"))
+        self.summarize_conversations = os.getenv(
+            "AI_CONVERSATION_SUMMARY", "false"
+        ).lower() in ("true", "1")
+        # Bound the number of concurrent requests to the AI server
+        self.scheduler = FairScheduler(
+            max_concurrency=int(os.getenv("AI_MAX_CONCURRENCY", "4")),
+            max_queue=int(os.getenv("AI_MAX_QUEUE", "50")),
+        )
+
+        # Chunk summaries of channels, reused by later /summarize calls
+        self.summarizer = ChannelSummarizer(
+            lambda messages: self.backends.complete(self.model_name, messages),
+            chunk_tokens=self.max_context_tokens,
+        )
+
+        # Keep references to running background tasks
+        self.background_tasks: ty.Set[asyncio.Task] = set()
+        self.evict_idle_conversations.start()
+
+    async def cog_unload(self) -> None:
+        self.evict_idle_conversations.cancel()
+        if self.semantic_cache is not None:
+            self.save_semantic_cache.cancel()
+            await self.semantic_cache.save()
+
+    @tasks.loop(minutes=5)
+    async def save_semantic_cache(self) -> None:
+        """Discord task: Persist the semantic cache to disk."""
+
+        await self.semantic_cache.save()
+
+    @tasks.loop(minutes=5)
+    async def evict_idle_conversations(self) -> None:
+        """Discord task: Forget idle conversations."""
+
+        if evicted := self.conversations.evict_idle():
+            logger.debug(f"Forgot {evicted} idle conversations.")
+
+    async def compact_conversation(
+        self, guild_id: int, conversation: Conversation, trimmed: ty.List[Turn]
+    ) -> None:
+        """Fold turns trimmed from the conversation into its summary."""
+
+        transcript = "\n".join(f"{turn.role}: {turn.content}" for turn in trimmed)
+        try:
+            async with self.scheduler.slot(guild_id):
+                summary = await self.backends.complete(
+                    self.model_name,
+                    [
+                        {
+                            "role": "system",
+                            "content": "Summarize the conversation below in a few sentences. Keep names, facts and decisions.",
+                        },
+                        {
+                            "role": "user",
+                            "content": f"{conversation.summary}\n{transcript}",
+                        },
+                    ],
+                )
+        except QueueFullError:
+            logger.warning("Conversation summary skipped: Queue is full.")
+            return
+        except Exception as e:
+            logger.error(f"Failed to summarize conversation: {e}")
+            return
+
+        if summary:
+            conversation.set_summary(summary)
 
     @discord.app_commands.command()
     @discord.app_commands.checks.dynamic_cooldown(check_cooldown_factory(1.5))
@@ -34,26 +135,189 @@ class AI(CogBase):
         message: str,
     ) -> None:
         """(RATE LIMITED) Chat with AI."""
-        # TODO: Stream the message instead, edit the Discord response as new chunks arrive
 
         await ia.response.defer()
 
-        message = (
-            self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": message,
-                    },
-                ],
-            )
-            .choices[0]
-            .message.content
+        reply = StreamedReply(ia)
+        conversation = self.conversations.get(ia.channel.id)
+
+        # Answers depend on the earlier conversation, so its digest is part of the cache key
+        context = conversation.digest()
+        messages = [
+            *conversation.messages(),
+            {
+                "role": "user",
+                "content": message,
+            },
+        ]
+
+        embedding = None
+        cached = await self.cache.get(self.model_name, message, context)
+
+        async def on_queued(position: int) -> None:
+            await reply.notice(
+                f"The AI is busy. You are #{position} in the queue, please wait..."
+            )
+
+        chunks: ty.List[str] = []
+        if cached is None:
+            try:
+                async with self.scheduler.slot(ia.guild.id, on_queued):
+                    # Embedding the prompt is a request to the AI server too, so it is done in the slot
+                    if self.semantic_cache is not None:
+                        try:
+                            embedding = await self.semantic_cache.embed(message)
+                        except Exception as e:
+                            logger.warning(f"Failed to embed the prompt: {e}")
+                        else:
+                            cached = await self.semantic_cache.get(
+                                ia.guild.id, embedding, context
+                            )
+
+                    if cached is None:
+                        # Edit the Discord response as new chunks arrive
+                        async for text in self.backends.stream_chat(
+                            self.model_name, messages
+                        ):
+                            chunks.append(text)
+                            await reply.write(text)
+            except QueueFullError:
+                logger.warning("AI request rejected: Queue is full.")
+                await ia.followup.send(
+                    "The AI is too busy right now. Please try again later."
+                )
+                return
+            except NoBackendError:
+                await ia.followup.send(
+                    "The AI is unavailable right now. Please try again later."
+                )
+                return
+
+        if cached is not None:
+            await reply.write(cached)
+        await reply.close()
+
+        response = cached if cached is not None else "".join(chunks).strip()
+        if not response:
+            return
+
+        # Cached answers are remembered too, so that follow-up prompts have their context
+        trimmed = conversation.add(
+            (
+                Turn("user", message, count_tokens(message)),
+                Turn("assistant", response, count_tokens(response)),
+            ),
+            max_turns=self.max_turns,
+            max_tokens=self.max_context_tokens,
         )
+        if trimmed and self.summarize_conversations:
+            task = asyncio.create_task(
+                self.compact_conversation(ia.guild.id, conversation, trimmed)
+            )
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+
+        if cached is None:
+            await self.cache.put(self.model_name, message, response, context)
+            if self.semantic_cache is not None and embedding is not None:
+                self.semantic_cache.put(ia.guild.id, embedding, response, context)
+
+    @discord.app_commands.command()
+    @discord.app_commands.checks.dynamic_cooldown(check_cooldown_factory(30))
+    @discord.app_commands.guild_only()
+    @discord.app_commands.describe(
+        message_count="Number of recent messages to summarize; 200 by default.",
+    )
+    async def summarize(
+        self,
+        ia: discord.Interaction,
+        message_count: discord.app_commands.Range[int, 1, 2000] = 200,
+    ) -> None:
+        """(RATE LIMITED) Summarize the recent messages in this channel with AI."""
+
+        await ia.response.defer()
+
+        reply = StreamedReply(ia)
+
+        async def on_queued(position: int) -> None:
+            await reply.notice(
+                f"The AI is busy. You are #{position} in the queue, please wait..."
+            )
+
+        try:
+            # The whole map-reduce counts as one request to the scheduler
+            async with self.scheduler.slot(ia.guild.id, on_queued):
+                summary = await self.summarizer.summarize(ia.channel, message_count)
+        except QueueFullError:
+            logger.warning("AI request rejected: Queue is full.")
+            await ia.followup.send(
+                "The AI is too busy right now. Please try again later."
+            )
+            return
+        except NoBackendError:
+            await ia.followup.send(
+                "The AI is unavailable right now. Please try again later."
+            )
+            return
+
+        if not summary.strip():
+            await ia.followup.send("Nothing to summarize.")
+            return
+
+        await reply.write(summary)
+        await reply.close()
+
+    @discord.app_commands.command()
+    @discord.app_commands.guild_only()
+    async def forget(self, ia: discord.Interaction) -> None:
+        """Make the AI forget the conversation in this channel."""
+
+        self.conversations.reset(ia.channel.id)
+        await ia.response.send_message("Conversation forgotten.")
+
+    @discord.app_commands.command()
+    @discord.app_commands.describe(
+        flush="Empty the response cache.",
+    )
+    async def ai_stats(self, ia: discord.Interaction, flush: bool = False) -> None:
+        """(OWNER ONLY) Show statistics of the AI cache and request queue. Optionally flush the cache."""
+
+        if not await self.bot.is_owner(ia.user):
+            await ia.response.send_message(
+                "Only the bot owner may use this command!", ephemeral=True
+            )
+            return
+
+        cache = self.cache
+        resp = """Response cache hit rate: {hit_rate:.1%} ({memory_hits} memory hits, {db_hits} SQLite hits, {misses} misses; {follow_up_hits} hits on follow-up prompts)
+Memory tier: {memory_count} entries, {memory_used:.2f}/{memory_bytes:.2f} MiB""".format(
+            hit_rate=cache.hit_rate,
+            memory_hits=cache.memory_hits,
+            db_hits=cache.db_hits,
+            misses=cache.misses,
+            follow_up_hits=cache.follow_up_hits,
+            memory_count=len(cache.memory),
+            memory_used=cache.memory_used / 1024 / 1024,
+            memory_bytes=cache.memory_bytes / 1024 / 1024,
+        )
+
+        resp += "\n" + self.scheduler.summary()
+        resp += "\n" + self.backends.summary()
+
+        if (semantic_cache := self.semantic_cache) is not None:
+            resp += "\nSemantic cache hit rate: {hit_rate:.1%} ({hits} hits, {misses} misses, {count} prompts; {follow_up_hits} hits on follow-up prompts)".format(
+                hit_rate=semantic_cache.hits
+                / ((semantic_cache.hits + semantic_cache.misses) or 1),
+                hits=semantic_cache.hits,
+                misses=semantic_cache.misses,
+                follow_up_hits=semantic_cache.follow_up_hits,
+                count=sum(index.count for index in semantic_cache.indexes.values()),
+            )
 
-        await ia.followup.send(message[:2000])
+        if flush:
+            await cache.flush()
+            if semantic_cache is not None:
+                semantic_cache.flush()
+            resp += "\nCache flushed."
 
-        if len(message) > 2000:
-            for split in range(1, math.ceil(len(message) / 2000)):
-                await ia.followup.send(message[2000 * split : 2000 * (split + 1)])
+        await ia.response.send_message(resp, ephemeral=True)
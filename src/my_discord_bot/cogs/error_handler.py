@@ -1,6 +1,5 @@
 import logging
 import typing as ty
-from pathlib import Path
 
 import discord
 from discord.ext import commands
@@ -44,9 +43,15 @@ class ErrorHandler(CogBase):
             )
         else:
             error["content"] = "Oh no! Something unexpected happened!"
-            error["file"] = discord.File(Path("./assets/images/error.jpg"))
+            url, files = self.assets.attach("error.jpg")
+            error["embed"] = discord.Embed().set_image(url=url)
+            error["files"] = files
 
         try:
             await ia.response.send_message(**error)
+            if error.get("files"):
+                self.assets.remember(await ia.original_response())
         except discord.errors.InteractionResponded:
-            await ia.followup.send(**error)
+            message = await ia.followup.send(**error, wait=True)
+            if error.get("files"):
+                self.assets.remember(message)
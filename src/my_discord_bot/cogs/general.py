@@ -1,24 +1,92 @@
+import asyncio
+import collections
+import contextlib
 import logging
+import os
 import re
-import sys
 import typing as ty
 from pathlib import Path
 
+import aiohttp
 import discord
 from discord.ext import commands
-from gallery_dl import config, job
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from ..models import Guild
 from ._cog_base import CogBase, check_cooldown_factory
+from ._gallery_dl import (
+    ConvertOptions,
+    DownloadPool,
+    DownloadResult,
+    DownloadTimeoutError,
+)
+from ._pixiv_cache import CachedFile, PixivCache
+from ._pixiv_meta import Artwork, ArtworkNotFoundError, PixivMetadata
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of attachments (and embeds) in a message
+MAX_ATTACHMENTS = 10
+# Maximum number of images posted by a /pixiv command
+MAX_ALBUM_IMAGES = 50
+
+PIXIV_ARTWORK_PATTERN = re.compile(r"(www\.pixiv\.net\/(?:en\/)?artworks\/(\d+))")
+# Messages without this are skipped before matching the pattern
+PIXIV_ARTWORK_PREFILTER = "pixiv.net/"
+# Maximum number of links expanded per message
+MAX_EXPANDED_LINKS = 5
+
 
 class General(CogBase):
     def __init__(
         self, bot: commands.Bot, sessionmaker: async_sessionmaker[AsyncSession]
     ) -> None:
         super().__init__(bot, sessionmaker)
+        self.downloads = DownloadPool(
+            Path("./volume/gallery-dl/jobs"),
+            max_workers=int(os.getenv("PIXIV_WORKERS", "2")),
+            timeout=int(os.getenv("PIXIV_TIMEOUT", "300")),
+        )
+        self.worker_memory = int(os.getenv("PIXIV_WORKER_MEMORY", "1024")) * 1024 * 1024
+        self.pixiv_cache = PixivCache(
+            Path("./volume/pixiv-cache"),
+            max_bytes=int(os.getenv("PIXIV_CACHE_SIZE", "500")) * 1024 * 1024,
+        )
+        # Embed artworks through an image proxy instead of uploading them, if PIXIV_IMAGE_PROXY is set
+        self.pixiv_meta = None
+        if proxy_url := os.getenv("PIXIV_IMAGE_PROXY", ""):
+            self.pixiv_meta = PixivMetadata(
+                os.getenv("PIXIV_METADATA_URL") or "https://www.pixiv.net",
+                proxy_url,
+                timeout=10,
+            )
+        # Pixiv downloads in progress, resolved with the error message if they failed
+        self.pixiv_flights: ty.Dict[str, asyncio.Future[str | None]] = {}
+        # Uploads of cached Pixiv files in progress, resolved once their attachment URLs are known
+        self.pixiv_uploads: ty.Dict[CachedFile, asyncio.Future[None]] = {}
+
+        # Guilds with link expansion enabled, loaded from the database
+        self.expand_guilds: ty.Set[int] = set()
+        self.expand_cooldown = commands.CooldownMapping.from_cooldown(
+            5, 60, commands.BucketType.channel
+        )
+
+    async def cog_load(self) -> None:
+        if self.pixiv_meta is None:
+            return
+        async with self.sessionmaker() as session:
+            self.expand_guilds = set(
+                (
+                    await session.execute(
+                        select(Guild.guild_id).where(Guild.expand_links)
+                    )
+                ).scalars()
+            )
+
+    async def cog_unload(self) -> None:
+        if self.pixiv_meta is not None:
+            await self.pixiv_meta.close()
 
     @discord.app_commands.command()
     async def hello(
@@ -27,9 +95,12 @@ class General(CogBase):
     ) -> None:
         """Hello!"""
 
+        url, files = self.assets.attach("hello.jpg")
         await ia.response.send_message(
-            file=discord.File(Path("./assets/images/hello.jpg"))
+            embed=discord.Embed().set_image(url=url), files=files
         )
+        if files:
+            self.assets.remember(await ia.original_response())
 
     @discord.app_commands.command()
     @discord.app_commands.checks.dynamic_cooldown(check_cooldown_factory(3))
@@ -38,6 +109,8 @@ class General(CogBase):
         pixiv_link="Pixiv image link",
         image_number="Image number (for albums with multiple images); 1 by default",
         animation_format="Format for animations. GIF can loop, but might fail due to large size",
+        upload="Upload the file instead of embedding a link to it (slower)",
+        image_count="Number of images to post, starting from image_number; 1 by default",
     )
     async def pixiv(
         self,
@@ -45,15 +118,12 @@ class General(CogBase):
         pixiv_link: str,
         image_number: int = 1,
         animation_format: ty.Literal["webm", "gif"] = "webm",
+        upload: bool = False,
+        image_count: discord.app_commands.Range[int, 1, MAX_ALBUM_IMAGES] = 1,
     ) -> None:
-        """(RATE LIMITED) Upload an image from Pixiv. You may change the image number and/or animation format."""
-
-        # TODO: Rewrite based on Phixiv
-        # https://github.com/thelaao/phixiv
+        """(RATE LIMITED) Post images from Pixiv. You may change the image number(s) and/or animation format."""
 
-        match = re.compile(r"(www\.pixiv\.net\/(?:en\/)?artworks\/\d+)").search(
-            pixiv_link
-        )
+        match = PIXIV_ARTWORK_PATTERN.search(pixiv_link)
         if not match:
             await ia.response.send_message("You link is invalid!")
             return
@@ -61,84 +131,413 @@ class General(CogBase):
         # Delay response, maximum 15 mins
         await ia.response.defer()
 
-        # TODO: Add encoder config
-        config.set(
-            ("downloader",),
-            "filesize-max",
-            f"{self.get_max_file_size(ia.guild)}M",
-        )
-        config.set(
-            ("extractor",),
-            "image-range",
-            str(image_number),
+        artwork_id = int(match.group(2))
+        if self.pixiv_meta is not None:
+            try:
+                artwork = await self.pixiv_meta.fetch(artwork_id)
+            except ArtworkNotFoundError:
+                await ia.followup.send("You link is invalid!")
+                return
+            except (aiohttp.ClientError, TimeoutError) as e:
+                logger.warning(
+                    f"Cannot fetch the metadata of Pixiv artwork {artwork_id}: {e!r}"
+                )
+            else:
+                if not 1 <= image_number <= artwork.page_count:
+                    await ia.followup.send(
+                        f"Your image_number is out of range! (This artwork has {artwork.page_count} image(s))"
+                    )
+                    return
+                image_count = min(image_count, artwork.page_count - image_number + 1)
+
+                # Animations are always downloaded, as they have to be encoded from their frames
+                if not upload and await self.embed_pixiv_artwork(
+                    ia, artwork, image_number, image_count
+                ):
+                    return
+
+        max_size = self.get_max_file_size(ia.guild)
+        embed = discord.Embed().add_field(name="Source", value=pixiv_link, inline=False)
+
+        if image_count > 1:
+            await self.send_pixiv_album(
+                ia,
+                match.group(1),
+                artwork_id,
+                range(image_number, image_number + image_count),
+                animation_format,
+                max_size,
+                embed,
+            )
+            return
+
+        result = await self.fetch_pixiv_file(
+            match.group(1), artwork_id, image_number, animation_format, max_size
         )
-        config.set(
-            ("extractor", "pixiv"),
-            "image-range",
-            str(image_number),
+        if isinstance(result, str):
+            await ia.followup.send(result)
+            return
+        await self.send_pixiv_file(ia, *result, embed)
+
+    async def embed_pixiv_artwork(
+        self,
+        ia: discord.Interaction,
+        artwork: Artwork,
+        image_number: int,
+        image_count: int,
+    ) -> bool:
+        """Post embeds of the artwork, with their images linked through the proxy.
+
+        Return False if the artwork has to be downloaded instead
+        (animations or images hidden without login).
+        """
+
+        if artwork.is_ugoira or artwork.image_url is None:
+            return False
+
+        embeds = [
+            self.artwork_embed(artwork, number)
+            for number in range(image_number, image_number + image_count)
+        ]
+        for i in range(0, len(embeds), MAX_ATTACHMENTS):
+            await ia.followup.send(embeds=embeds[i : i + MAX_ATTACHMENTS])
+        return True
+
+    def artwork_embed(self, artwork: Artwork, image_number: int) -> discord.Embed:
+        embed = (
+            discord.Embed(
+                title=artwork.title,
+                url=f"https://www.pixiv.net/artworks/{artwork.id}",
+            )
+            .set_author(
+                name=artwork.author,
+                url=f"https://www.pixiv.net/users/{artwork.author_id}",
+            )
+            .set_image(url=self.pixiv_meta.image_url(artwork, image_number))
         )
-        config.set(
-            ("extractor",),
-            "postprocessors",
-            [
-                {
-                    "name": "ugoira",
-                    "whitelist": ["pixiv"],
-                    "extension": animation_format,
-                    "ffmpeg-demuxer": "image2" if sys.platform == "linux" else "auto",
-                }
-            ],
+        if artwork.page_count > 1:
+            embed.set_footer(text=f"{image_number}/{artwork.page_count}")
+        return embed
+
+    async def fetch_pixiv_file(
+        self,
+        url: str,
+        artwork_id: int,
+        image_number: int,
+        animation_format: str,
+        max_size: int,
+    ) -> ty.Tuple[CachedFile, discord.File] | str:
+        """Download an image of an artwork, unless it is cached. Return an error message if it failed.
+
+        The file is opened right away, so that it can still be uploaded after being evicted from the cache.
+        """
+
+        key = self.pixiv_cache.make_key(
+            artwork_id, image_number, animation_format, max_size
         )
 
-        download = job.DownloadJob(match.group(1))
-        download.run()
+        while (cached := self.pixiv_cache.get(key)) is None:
+            if (flight := self.pixiv_flights.get(key)) is None:
+                break
+            # An identical request is in progress, wait for it instead of downloading again.
+            # If it failed unexpectedly, try again (possibly as the one downloading).
+            if (error := await asyncio.shield(flight)) is not None:
+                return error
+
+        if cached is not None:
+            return cached, discord.File(cached.path)
+
+        flight = asyncio.get_running_loop().create_future()
+        self.pixiv_flights[key] = flight
+        error = None
+        try:
+            options = [
+                # Oversized files are downscaled by the worker; Pixiv itself limits uploads to 32MB
+                (("downloader",), "filesize-max", "64M"),
+                (("extractor",), "image-range", str(image_number)),
+                (("extractor", "pixiv"), "image-range", str(image_number)),
+                (
+                    ("extractor",),
+                    "postprocessors",
+                    [
+                        {
+                            # Keep the frames and their delays, to be encoded by the worker to fit the size limit
+                            "name": "ugoira",
+                            "whitelist": ["pixiv"],
+                            "mode": "archive",
+                            "extension": "zip",
+                        }
+                    ],
+                ),
+            ]
+
+            try:
+                async with self.downloads.download(
+                    url,
+                    options,
+                    ConvertOptions(
+                        animation_format=animation_format,
+                        max_bytes=max_size * 1024 * 1024,
+                        memory_bytes=self.worker_memory,
+                    ),
+                ) as download:
+                    result = self.cache_download(download, key, image_number, max_size)
+                    if isinstance(result, str):
+                        error = result
+                        return error
+                    return result, discord.File(result.path)
+            except DownloadTimeoutError:
+                error = "Download took too long. Please try again later."
+                return error
+        finally:
+            # Requests waiting for this one can now use the cache (or report the same error)
+            del self.pixiv_flights[key]
+            flight.set_result(error)
+
+    def cache_download(
+        self,
+        download: DownloadResult,
+        key: str,
+        image_number: int,
+        max_size: int,
+    ) -> CachedFile | str:
+        """Cache the result of a Pixiv download job. Return an error message if it failed."""
 
         if download.status == 0:
-            link = Path(download.pathfmt.path)
-
-            if not link.is_file():
-                await ia.followup.send(
-                    "Something went wrong."
-                    + (
-                        " Maybe your image_number is out of range?"
-                        if image_number > 1
-                        else ""
+            if not download.files:
+                return "Something went wrong." + (
+                    " Maybe your image_number is out of range?"
+                    if image_number > 1
+                    else ""
+                )
+
+            return self.pixiv_cache.put(key, download.files[-1])
+
+        match download.status:
+            case 4:
+                # HttpError: Most probably because the image is too big
+                return "Download failed. Most probably because your image is too big. (Maximum size: {size}MiB)".format(
+                    size=max_size
+                )
+            case 8:
+                # NotFoundError: Invalid link
+                return "You link is invalid!"
+            case 16:
+                # AuthenticationError: No token provided
+                return "Cannot login to Pixiv. Please notify the bot owner! \nTo the bot owner: Please find instructions in https://github.com/regunakyle/my-discord-bot#important-you-must-have-ffmepg-installed-and-setup-an-oauth-token-to-use-this-command"
+            case _:
+                logger.error(f"Gallery-DL failed. Status code: {download.status}")
+                return "Something went wrong. Please notify the bot owner if the error persists."
+
+    @contextlib.contextmanager
+    def uploading_pixiv_files(
+        self, files: ty.Iterable[CachedFile]
+    ) -> ty.Iterator[None]:
+        """Mark the cached files as being uploaded, until the context exits."""
+
+        uploads = {}
+        for cached in files:
+            if cached not in self.pixiv_uploads:
+                uploads[cached] = self.pixiv_uploads[cached] = (
+                    asyncio.get_running_loop().create_future()
+                )
+        try:
+            yield
+        finally:
+            for cached, upload in uploads.items():
+                del self.pixiv_uploads[cached]
+                upload.set_result(None)
+
+    async def send_pixiv_file(
+        self,
+        ia: discord.Interaction,
+        cached: CachedFile,
+        file: discord.File,
+        embed: discord.Embed,
+    ) -> None:
+        """Send a cached Pixiv file, by its attachment URL if it has been uploaded before.
+
+        Identical requests coalesced by fetch_pixiv_file get the file before the first of them
+        (which continues without yielding to them) starts uploading it; They wait for its attachment URL.
+        """
+
+        while (upload := self.pixiv_uploads.get(cached)) is not None:
+            await asyncio.shield(upload)
+
+        if (url := self.pixiv_cache.reusable_url(cached)) is not None:
+            file.close()
+            await ia.followup.send(url, embed=embed)
+            return
+
+        # If this upload fails, the next request waiting for it uploads the file instead
+        with self.uploading_pixiv_files([cached]):
+            message = await ia.followup.send(embed=embed, file=file, wait=True)
+            if message.attachments:
+                self.pixiv_cache.set_url(cached, message.attachments[0].url)
+
+    async def send_pixiv_album(
+        self,
+        ia: discord.Interaction,
+        url: str,
+        artwork_id: int,
+        image_numbers: range,
+        animation_format: str,
+        max_size: int,
+        embed: discord.Embed,
+    ) -> None:
+        """Download images of an artwork concurrently, and upload them in order.
+
+        Images are packed into messages of up to 10 attachments, within the upload size limit.
+        Only the images of the next message are downloaded ahead, to bound the number of open files.
+        """
+
+        numbers = iter(image_numbers)
+        pending: ty.Deque[ty.Tuple[int, asyncio.Task]] = collections.deque()
+
+        def download_next() -> None:
+            if (number := next(numbers, None)) is not None:
+                task = asyncio.create_task(
+                    self.fetch_pixiv_file(
+                        url, artwork_id, number, animation_format, max_size
                     )
                 )
-                return
+                pending.append((number, task))
+
+        for _ in range(MAX_ATTACHMENTS):
+            download_next()
+
+        batch: ty.List[ty.Tuple[CachedFile, discord.File]] = []
+        errors = []
+        try:
+            while pending:
+                number, task = pending.popleft()
+                result = await task
+                download_next()
+
+                if isinstance(result, str):
+                    errors.append(f"Image {number}: {result}")
+                    continue
+
+                if batch and (
+                    len(batch) == MAX_ATTACHMENTS
+                    or sum(cached.size for cached, _ in batch) + result[0].size
+                    > max_size * 1024 * 1024
+                ):
+                    await self.upload_pixiv_files(ia, batch, embed)
+                    # The source is only shown once
+                    embed = None
+                    batch = []
+                batch.append(result)
+
+            if batch:
+                await self.upload_pixiv_files(ia, batch, embed)
+                batch = []
+        finally:
+            for _, task in pending:
+                task.cancel()
+            for result in await asyncio.gather(
+                *(task for _, task in pending), return_exceptions=True
+            ):
+                if isinstance(result, tuple):
+                    batch.append(result)
+            for _, file in batch:
+                file.close()
 
-            embed = discord.Embed().add_field(
-                name="Source", value=pixiv_link, inline=False
+        if errors:
+            await ia.followup.send("\n".join(errors))
+
+    async def upload_pixiv_files(
+        self,
+        ia: discord.Interaction,
+        files: ty.List[ty.Tuple[CachedFile, discord.File]],
+        embed: discord.Embed | None,
+    ) -> None:
+        with self.uploading_pixiv_files(cached for cached, _ in files):
+            message = await ia.followup.send(
+                embed=embed if embed is not None else discord.utils.MISSING,
+                files=[file for _, file in files],
+                wait=True,
             )
-            await ia.followup.send(
-                embed=embed,
-                file=discord.File(link),
+            for (cached, _), attachment in zip(files, message.attachments):
+                self.pixiv_cache.set_url(cached, attachment.url)
+
+    @discord.app_commands.command()
+    @discord.app_commands.guild_only()
+    @discord.app_commands.checks.has_permissions(manage_channels=True)
+    async def toggle_link_expansion(self, ia: discord.Interaction) -> None:
+        """(ADMIN) Enable (or disable) replying to Pixiv links in this server with their embeds."""
+
+        if self.pixiv_meta is None:
+            await ia.response.send_message(
+                "Link expansion is not available. To the bot owner: Please set PIXIV_IMAGE_PROXY."
             )
-            link.unlink()
+            return
 
-        else:
-            match download.status:
-                case 4:
-                    # HttpError: Most probably because the image is too big
-                    await ia.followup.send(
-                        "Download failed. Most probably because your image is too big. (Maximum size: {size}MiB)".format(
-                            size=self.get_max_file_size(ia.guild)
-                        )
-                    )
-                    return
-                case 8:
-                    # NotFoundError: Invalid link
-                    await ia.followup.send("You link is invalid!")
-                    return
-                case 16:
-                    # AuthenticationError: No token provided
-                    await ia.followup.send(
-                        "Cannot login to Pixiv. Please notify the bot owner! \nTo the bot owner: Please find instructions in https://github.com/regunakyle/my-discord-bot#important-you-must-have-ffmepg-installed-and-setup-an-oauth-token-to-use-this-command"
-                    )
-                    return
-                case _:
-                    logger.error(f"Gallery-DL failed. Status code: {download.status}")
-                    await ia.followup.send(
-                        "Something went wrong. Please notify the bot owner if the error persists."
+        enabled = ia.guild.id not in self.expand_guilds
+        async with self.sessionmaker() as session:
+            if (
+                await session.execute(
+                    update(Guild)
+                    .where(Guild.guild_id == ia.guild.id)
+                    .values(expand_links=enabled)
+                )
+            ).rowcount == 0:
+                session.add(
+                    Guild(
+                        guild_id=ia.guild.id,
+                        guild_name=ia.guild.name,
+                        expand_links=enabled,
                     )
-                    return
+                )
+            await session.commit()
+
+        if enabled:
+            self.expand_guilds.add(ia.guild.id)
+            await ia.response.send_message("Link expansion enabled.")
+        else:
+            self.expand_guilds.discard(ia.guild.id)
+            await ia.response.send_message("Link expansion disabled.")
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        """Reply to Pixiv links with their embeds, in guilds with link expansion enabled."""
+
+        # Every message goes through here, so the cheapest checks go first
+        if (
+            message.guild is None
+            or message.guild.id not in self.expand_guilds
+            or PIXIV_ARTWORK_PREFILTER not in message.content
+            or message.author.bot
+        ):
+            return
+
+        artwork_ids = list(
+            dict.fromkeys(
+                int(match.group(2))
+                for match in PIXIV_ARTWORK_PATTERN.finditer(message.content)
+            )
+        )[:MAX_EXPANDED_LINKS]
+        if not artwork_ids or self.expand_cooldown.update_rate_limit(message):
+            return
+
+        embeds = []
+        for result in await asyncio.gather(
+            *(self.pixiv_meta.fetch(artwork_id) for artwork_id in artwork_ids),
+            return_exceptions=True,
+        ):
+            if isinstance(result, Artwork):
+                # Animations and hidden images cannot be embedded without downloading them
+                if not result.is_ugoira and result.image_url is not None:
+                    embeds.append(self.artwork_embed(result, 1))
+            elif not isinstance(
+                result, (ArtworkNotFoundError, aiohttp.ClientError, TimeoutError)
+            ):
+                raise result
+
+        if embeds:
+            try:
+                await message.reply(embeds=embeds, mention_author=False)
+            except discord.HTTPException as e:
+                logger.warning(
+                    f"Cannot expand links in channel {message.channel.id}: {e!r}"
+                )
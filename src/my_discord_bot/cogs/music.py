@@ -382,6 +382,7 @@ class Music(CogBase):
     async def queue(self, ia: discord.Interaction) -> None:
         """Show all queued songs. A maximum of 20 songs are displayed."""
         player: lavalink.DefaultPlayer = self.lavalink.player_manager.get(ia.guild.id)
+        thumbnail_url, files = self.assets.attach("music.png")
 
         embedDict: ty.Dict[
             str, str | int | ty.Dict[str, str] | ty.List[ty.Dict[str, str | int | bool]]
@@ -389,7 +390,7 @@ class Music(CogBase):
             "title": f"Queue for server {ia.guild.name}",
             "description": "",
             "color": 65535,
-            "thumbnail": {"url": "attachment://music.png"},
+            "thumbnail": {"url": thumbnail_url},
             "fields": [
                 {
                     "name": "Queue size",
@@ -447,9 +448,10 @@ class Music(CogBase):
             )
 
         await ia.response.send_message(
-            embed=discord.Embed.from_dict(embedDict),
-            file=discord.File("./assets/images/music.png", filename="music.png"),
+            embed=discord.Embed.from_dict(embedDict), files=files
         )
+        if files:
+            self.assets.remember(await ia.original_response())
 
     @discord.app_commands.command()
     @discord.app_commands.check(create_player_check)
@@ -1,25 +1,116 @@
+import asyncio
 import datetime as dt
 import logging
 import os
+import secrets
+import time
 import typing as ty
 import zoneinfo
 
+import aiohttp
 import discord
-import googleapiclient.discovery
 from discord.ext import commands, tasks
-from sqlalchemy import delete, select
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 
-from ..models import Guild
+from ..models import Announcement, Guild, StreamReminder, YoutubeChannel
 from ..models import Subscription as Sub
 from ._cog_base import CogBase
-
-if ty.TYPE_CHECKING:
-    from googleapiclient._apis.youtube.v3 import YouTubeResource
+from ._etag_cache import EtagCache
+from ._poll_scheduler import PollScheduler, upload_interval
+from ._timer_queue import TimerQueue
+from ._websub import HUB_URL, FeedEntry, WebSubReceiver
+from ._youtube import API_URL, YouTubeClient, YouTubeError
 
 logger = logging.getLogger(__name__)
 
+ISO_FORMAT = r"%Y-%m-%dT%H:%M:%SZ"
+MESSAGE_TEMPLATE = """{role_tag}
+# {title}
+## Scheduled Start Time
+{scheduled_start_time} 
+## Description
+{description}
+## Link
+https://www.youtube.com/watch?v={video_id}"""
+REMINDER_TEMPLATE = """{role_tag}
+# {title}
+Starting {starting}!
+https://www.youtube.com/watch?v={video_id}"""
+# Reminders later than this (in seconds), e.g. because the bot was offline, are dropped
+MAX_REMINDER_DELAY = 5 * 60
+# Interval (in seconds) between checks of pending reminders for rescheduled streams,
+# no longer than MAX_REMINDER_DELAY so that streams moved earlier are still reminded of
+REMINDER_REFRESH_INTERVAL = MAX_REMINDER_DELAY
+# Maximum number of announcements being sent at the same time
+MAX_CONCURRENT_SENDS = 5
+# Maximum number of queued announcements sent together,
+# and interval (in seconds) between checks for announcements due to be retried
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_POLL_INTERVAL = 60
+# Attempts to send an announcement before giving up, and backoff (in seconds) before the first retry
+MAX_SEND_ATTEMPTS = 5
+SEND_RETRY_DELAY = 30
+# Sent announcements are kept this long (in days), so that videos detected again are not announced twice
+OUTBOX_RETENTION = 30
+# Maximum number of pages (of 50 videos) of new uploads read from a channel
+MAX_PLAYLIST_PAGES = 4
+# Poll intervals (in seconds) of a channel: shortest, longest, and before its upload cadence is known
+MIN_POLL_INTERVAL = 5 * 60
+MAX_POLL_INTERVAL = 12 * 3600
+DEFAULT_POLL_INTERVAL = 15 * 60
+# Shortest poll interval (in seconds) when new uploads are pushed by WebSub,
+# as polls only catch the notifications that were lost
+RECONCILIATION_INTERVAL = 6 * 3600
+
+Targets = ty.List[ty.Tuple[Sub, discord.abc.Messageable]]
+
+
+class NewUploads(ty.NamedTuple):
+    # None if the channel has no video
+    video_ids: ty.List[str] | None
+    # ETag of the first page of the upload playlist
+    etag: str | None
+    # Publish times (POSIX timestamps) of the videos read from the playlist, newest first;
+    # The first ones are those of the new videos
+    upload_times: ty.Sequence[float] = ()
+    # False if the playlist has not changed since its ETag was cached
+    modified: bool = True
+
+
+def role_tag(subscription: Sub) -> str:
+    return (
+        f"<@&{subscription.announcement_target}>"
+        if subscription.announcement_target
+        else "@everyone"
+    )
+
+
+def announcement_message(video: ty.Dict[str, ty.Any], subscription: Sub) -> str:
+    return MESSAGE_TEMPLATE.format(
+        role_tag=role_tag(subscription),
+        title=video["snippet"]["title"],
+        # HKT+8
+        scheduled_start_time=(
+            dt.datetime.fromisoformat(
+                video["liveStreamingDetails"]["scheduledStartTime"].replace(
+                    "Z", "+00:00"
+                )
+            ).replace(tzinfo=zoneinfo.ZoneInfo(key="Asia/Hong_Kong"))
+            + dt.timedelta(hours=8)
+        ).strftime(r"%B %d (%A), %I:%M %p %Z"),
+        description=video["snippet"]["description"],
+        video_id=video["id"],
+    )
+
+
+def timestamp(value: dt.datetime) -> float:
+    """Return the POSIX timestamp of a UTC datetime (naive if read from the database)."""
+
+    return value.replace(tzinfo=dt.UTC).timestamp()
+
 
 class Subscription(CogBase):
     def __init__(
@@ -27,151 +118,892 @@ class Subscription(CogBase):
     ) -> None:
         super().__init__(bot, sessionmaker)
 
-        # TODO: Handle connection failures
-        self.youtube: "YouTubeResource" = googleapiclient.discovery.build(
-            "youtube", "v3", developerKey=os.getenv("GOOGLE_API_KEY", "dummy")
+        self.youtube = YouTubeClient(
+            os.getenv("GOOGLE_API_KEY", "dummy"),
+            base_url=os.getenv("YOUTUBE_API_URL") or API_URL,
+            max_concurrency=int(os.getenv("YOUTUBE_MAX_CONCURRENCY", "10")),
+        )
+        self.etags = EtagCache(
+            sessionmaker, int(os.getenv("YOUTUBE_ETAG_CACHE_SIZE", "10000"))
+        )
+        self.send_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+        # Set when announcements are queued
+        self.outbox_wakeup = asyncio.Event()
+        self.outbox_task: asyncio.Task[None] | None = None
+
+        self.websub: WebSubReceiver | None = None
+        if callback_url := os.getenv("WEBSUB_CALLBACK_URL"):
+            self.websub = WebSubReceiver(
+                callback_url,
+                self.on_feed_entries,
+                secret=os.getenv("WEBSUB_SECRET") or secrets.token_hex(16),
+                hub_url=os.getenv("WEBSUB_HUB_URL") or HUB_URL,
+            )
+
+        min_interval = (
+            MIN_POLL_INTERVAL if self.websub is None else RECONCILIATION_INTERVAL
+        )
+        self.scheduler = PollScheduler(
+            int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000")),
+            min_interval=min_interval,
+            max_interval=MAX_POLL_INTERVAL,
+            default_interval=max(DEFAULT_POLL_INTERVAL, min_interval),
+        )
+        # Requests already counted against the daily quota
+        self.requests_counted = 0
+
+        # Minutes before the start of scheduled streams to send reminders at
+        self.reminder_offsets = sorted(
+            {
+                int(minutes)
+                for minutes in os.getenv("YOUTUBE_REMINDER_OFFSETS", "").split(",")
+                if minutes.strip()
+            },
+            reverse=True,
         )
+        self.reminders = TimerQueue(self.send_reminders)
+
         self.check_subscription.start()
 
-    @tasks.loop(minutes=15)
+    async def cog_load(self) -> None:
+        now = time.time()
+        async with self.sessionmaker() as session:
+            for channel in (await session.execute(select(YoutubeChannel))).scalars():
+                self.schedule_poll(channel, timestamp(channel.last_checked_at), now)
+
+            for reminder in await session.execute(
+                select(
+                    StreamReminder.id,
+                    StreamReminder.scheduled_start_time,
+                    StreamReminder.minutes_before,
+                )
+            ):
+                self.reminders.schedule(
+                    reminder.id,
+                    timestamp(reminder.scheduled_start_time)
+                    - reminder.minutes_before * 60,
+                )
+        self.reminders.start()
+        if self.reminder_offsets and os.getenv("GOOGLE_API_KEY"):
+            self.refresh_reminders.start()
+        self.outbox_task = asyncio.create_task(self.drain_outbox())
+
+        if self.websub is None or not os.getenv("GOOGLE_API_KEY"):
+            return
+        await self.websub.start("0.0.0.0", int(os.getenv("WEBSUB_PORT", "8080")))
+        self.renew_websub.start()
+
+    async def cog_unload(self) -> None:
+        self.check_subscription.cancel()
+        self.renew_websub.cancel()
+        self.reminders.stop()
+        self.refresh_reminders.cancel()
+        if self.outbox_task is not None:
+            self.outbox_task.cancel()
+        if self.websub is not None:
+            await self.websub.close()
+        await self.youtube.close()
+
+    @tasks.loop(minutes=1)
     async def check_subscription(self) -> None:
-        """Check for upcoming live of subscriptions.
+        """Check the channels due to be polled for new videos.
 
-        If found, post an announcement in the designated bot channel."""
+        If found, queue an announcement in the bot channel of every guild subscribed to the channel."""
 
         if not os.getenv("GOOGLE_API_KEY"):
             logger.debug("GOOGLE_API_KEY not set, skipping subscription check.")
             return
 
+        now = time.time()
+        self.scheduler.spend(self.youtube.requests - self.requests_counted, now)
+        self.requests_counted = self.youtube.requests
+        if not (due := self.scheduler.pop_due(now)):
+            return
+
         logger.debug("Checking for new live streams...")
 
-        ISO_FORMAT = r"%Y-%m-%dT%H:%M:%SZ"
-        MESSAGE_TEMPLATE = """{role_tag}
-# {title}
-## Scheduled Start Time
-{scheduled_start_time} 
-## Description
-{description}
-## Link
-https://www.youtube.com/watch?v={video_id}"""
+        loaded: ty.Dict[int, YoutubeChannel] = {}
+        try:
+            await self.poll_channels(due, loaded)
+        finally:
+            for channel_id in due:
+                if (channel := loaded.get(channel_id)) is None:
+                    # Unsubscribed
+                    self.scheduler.remove(channel_id)
+                else:
+                    self.schedule_poll(channel, now, time.time())
+
+    async def poll_channels(
+        self, channel_ids: ty.List[int], loaded: ty.Dict[int, YoutubeChannel]
+    ) -> None:
+        """Check the channels for new uploads, and queue their announcements. Channels are added to `loaded`."""
 
         async with self.sessionmaker() as session:
-            subscriptions = (
-                (await session.execute(select(Sub).options(joinedload(Sub.guild))))
-                .unique()
-                .scalars()
+            # Each channel is checked once, however many guilds are subscribed to it
+            channels: ty.List[ty.Tuple[YoutubeChannel, Targets]] = []
+            for channel in (
+                await session.execute(
+                    select(YoutubeChannel)
+                    .where(YoutubeChannel.id.in_(channel_ids))
+                    .options(
+                        selectinload(YoutubeChannel.subscriptions).joinedload(Sub.guild)
+                    )
+                )
+            ).scalars():
+                loaded[channel.id] = channel
+                if targets := self.announcement_targets(channel):
+                    channels.append((channel, targets))
+
+        # Fetch the playlists of all channels concurrently (bounded by the client)
+        request_count = self.youtube.requests
+        etags = await self.etags.get_many(
+            channel.youtube_upload_playlist for channel, _ in channels
+        )
+        playlists = await asyncio.gather(
+            *(
+                self.fetch_new_video_ids(
+                    channel, etags.get(channel.youtube_upload_playlist)
+                )
+                for channel, _ in channels
+            ),
+            return_exceptions=True,
+        )
+
+        checked_at = dt.datetime.now(dt.UTC)
+        # New state of the checked channels, and their new videos
+        checks: ty.List[ty.Dict[str, ty.Any]] = []
+        new_videos: ty.List[ty.Tuple[ty.List[str], Targets]] = []
+        detections: ty.List[float] = []
+        new_etags: ty.Dict[str, str] = {}
+        checked_etags: ty.Dict[str, str] = {}
+        unchanged = 0
+        for (channel, targets), uploads in zip(channels, playlists):
+            try:
+                if isinstance(uploads, BaseException):
+                    raise uploads
+
+                if not uploads.modified:
+                    # Nothing was uploaded since the last check
+                    unchanged += 1
+                    new_etags[channel.youtube_upload_playlist] = uploads.etag
+                    continue
+
+                video_ids = uploads.video_ids
+                if video_ids is None:
+                    logger.info(
+                        f"No video found for channel id {channel.youtube_channel_id}"
+                    )
+                    video_ids = []
+
+                check = {
+                    "id": channel.id,
+                    "last_checked_at": checked_at,
+                    "last_upload_at": channel.last_upload_at,
+                    "upload_interval": channel.upload_interval,
+                }
+                if uploads.upload_times:
+                    check["last_upload_at"] = dt.datetime.fromtimestamp(
+                        uploads.upload_times[0], dt.UTC
+                    ).replace(tzinfo=None)
+                    check["upload_interval"] = upload_interval(uploads.upload_times)
+                checks.append(check)
+
+                if video_ids:
+                    new_videos.append((video_ids, targets))
+                    # Videos pushed by the WebSub hub are already detected
+                    detections.extend(
+                        uploaded_at
+                        for uploaded_at in uploads.upload_times[: len(video_ids)]
+                        if channel.last_upload_at is None
+                        or uploaded_at > timestamp(channel.last_upload_at)
+                    )
+                if uploads.etag is not None:
+                    checked_etags[channel.youtube_upload_playlist] = uploads.etag
+
+            except Exception as e:
+                logger.error(
+                    f"Failed to check YouTube channel {channel.youtube_channel_id}: {e!r}"
+                )
+
+        if checks:
+            try:
+                # One transaction for the whole cycle;
+                # The announcements are queued if and only if the checks are saved
+                async with self.sessionmaker() as session:
+                    await session.execute(update(YoutubeChannel), checks)
+                    await self.add_to_outbox(session, new_videos)
+                    await session.commit()
+            except Exception as e:
+                # The channels are checked again at their next poll
+                logger.error(f"Failed to save {len(checks)} channel checks: {e!r}")
+            else:
+                for check in checks:
+                    channel = loaded[check["id"]]
+                    channel.last_checked_at = check["last_checked_at"]
+                    channel.last_upload_at = check["last_upload_at"]
+                    channel.upload_interval = check["upload_interval"]
+                new_etags.update(checked_etags)
+                now = time.time()
+                for uploaded_at in detections:
+                    self.scheduler.detected(uploaded_at, now)
+                if new_videos:
+                    self.outbox_wakeup.set()
+
+        self.etags.hits += unchanged
+        self.etags.misses += len(channels) - unchanged
+        try:
+            await self.etags.put_many(new_etags)
+        except Exception as e:
+            logger.error(f"Failed to save playlist ETags: {e!r}")
+
+        request_count = self.youtube.requests - request_count
+        logger.debug(
+            f"Checked {len(channels)} YouTube channels ({unchanged} unchanged) with {request_count} requests ({request_count} quota units)"
+        )
+        logger.debug(
+            f"{self.scheduler.quota_used}/{self.scheduler.daily_quota} YouTube quota units used today"
+        )
+        logger.debug(
+            f"Playlist ETag cache: {self.etags.hits} hits, {self.etags.misses} misses"
+        )
+
+    def schedule_poll(
+        self, channel: YoutubeChannel, last_polled_at: float, now: float
+    ) -> None:
+        """Schedule the next poll of the channel, according to how often it uploads."""
+
+        self.scheduler.schedule(
+            channel.id,
+            self.scheduler.interval(
+                timestamp(channel.last_upload_at)
+                if channel.last_upload_at is not None
+                else None,
+                channel.upload_interval,
+                now,
+            ),
+            last_polled_at,
+            now,
+        )
+
+    @tasks.loop(hours=1)
+    async def renew_websub(self) -> None:
+        """Subscribe to push notifications of new channels, and renew the leases about to expire."""
+
+        assert self.websub is not None
+
+        async with self.sessionmaker() as session:
+            channel_ids = set(
+                (
+                    await session.execute(select(YoutubeChannel.youtube_channel_id))
+                ).scalars()
+            )
+
+        await asyncio.gather(
+            *(
+                self.request_websub(channel_id, subscribe=True)
+                for channel_id in channel_ids
+                if self.websub.needs_renewal(channel_id)
+            ),
+            *(
+                self.request_websub(channel_id, subscribe=False)
+                for channel_id in self.websub.leases.keys() - channel_ids
+            ),
+        )
+
+    async def request_websub(self, channel_id: str, subscribe: bool) -> None:
+        """(Un)subscribe to push notifications of a channel, if WebSub is enabled."""
+
+        if self.websub is None:
+            return
+
+        try:
+            if subscribe:
+                await self.websub.subscribe(channel_id)
+            else:
+                await self.websub.unsubscribe(channel_id)
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.error(
+                f"WebSub request of YouTube channel {channel_id} failed: {e!r}"
             )
 
-            for subscription in subscriptions:
-                video_ids: ty.List[str] = []
+    async def on_feed_entries(self, entries: ty.List[FeedEntry]) -> None:
+        """Queue the announcements of the videos pushed by the WebSub hub."""
+
+        logger.debug(f"Received {len(entries)} videos from the WebSub hub")
 
-                if not (
-                    subscription.guild.bot_channel is not None
-                    and (
-                        bot_channel := self.bot.get_channel(
-                            subscription.guild.bot_channel
+        try:
+            async with self.sessionmaker() as session:
+                channels = {
+                    channel.youtube_channel_id: channel
+                    for channel in (
+                        await session.execute(
+                            select(YoutubeChannel)
+                            .where(
+                                YoutubeChannel.youtube_channel_id.in_(
+                                    {entry.channel_id for entry in entries}
+                                )
+                            )
+                            .options(
+                                selectinload(YoutubeChannel.subscriptions).joinedload(
+                                    Sub.guild
+                                )
+                            )
                         )
+                    ).scalars()
+                }
+
+                new_videos: ty.List[ty.Tuple[ty.List[str], Targets]] = []
+                # Videos are pushed again whenever they are edited; The outbox skips those already queued,
+                # and those published before its retention are assumed to be announced already
+                oldest = dt.datetime.now(dt.UTC).replace(tzinfo=None) - dt.timedelta(
+                    days=OUTBOX_RETENTION
+                )
+                for entry in sorted(entries, key=lambda entry: entry.published):
+                    published = entry.published.astimezone(dt.UTC).replace(tzinfo=None)
+                    if (
+                        channel := channels.get(entry.channel_id)
+                    ) is None or published <= oldest:
+                        continue
+
+                    # The poll cursor (last_checked_at) is left to the reconciliation poll,
+                    # so that it still finds videos whose notifications were lost
+                    if (
+                        channel.last_upload_at is None
+                        or published > channel.last_upload_at
+                    ):
+                        channel.last_upload_at = published
+                        self.scheduler.detected(timestamp(published), time.time())
+                    if targets := self.announcement_targets(channel):
+                        new_videos.append(([entry.video_id], targets))
+
+                await self.add_to_outbox(session, new_videos)
+                await session.commit()
+
+            self.outbox_wakeup.set()
+        except Exception as e:
+            logger.error(f"Failed to handle WebSub notification: {e!r}")
+
+    def announcement_targets(self, channel: YoutubeChannel) -> Targets:
+        """Return the subscriptions of the channel, with the bot channel of their guilds (if set)."""
+
+        targets = []
+        for subscription in channel.subscriptions:
+            if not (
+                subscription.guild.bot_channel is not None
+                and (
+                    bot_channel := self.bot.get_channel(subscription.guild.bot_channel)
+                )
+            ):
+                logger.debug(
+                    f"Bot channel not set for guild {subscription.guild.guild_name}"
+                )
+                continue
+            targets.append((subscription, bot_channel))
+        return targets
+
+    async def add_to_outbox(
+        self,
+        session: AsyncSession,
+        new_videos: ty.List[ty.Tuple[ty.List[str], Targets]],
+    ) -> None:
+        """Queue the announcements of the new videos (newest first) of each channel, in the transaction of the session.
+
+        Videos already queued for a guild are skipped.
+        """
+
+        announcements = [
+            {
+                "video_id": video_id,
+                "guild_id": subscription.guild_id,
+                "channel_id": subscription.channel_id,
+            }
+            for video_ids, targets in new_videos
+            # Oldest first
+            for video_id in reversed(video_ids)
+            for subscription, _ in targets
+        ]
+        if announcements:
+            await session.execute(
+                insert(Announcement).on_conflict_do_nothing(), announcements
+            )
+
+    async def drain_outbox(self) -> None:
+        """Send the queued announcements, as soon as they are queued (or due to be retried)."""
+
+        await self.bot.wait_until_ready()
+
+        while True:
+            self.outbox_wakeup.clear()
+            try:
+                if await self.send_announcements() == OUTBOX_BATCH_SIZE:
+                    # More are waiting
+                    continue
+            except Exception as e:
+                logger.error(f"Failed to send announcements: {e!r}")
+
+            try:
+                await asyncio.wait_for(self.outbox_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except TimeoutError:
+                pass
+
+    async def send_announcements(self) -> int:
+        """Send a batch of queued announcements, if the videos are scheduled streams.
+
+        Return the number of announcements handled.
+        """
+
+        now = dt.datetime.now(dt.UTC)
+        async with self.sessionmaker() as session:
+            rows = (
+                await session.execute(
+                    select(Announcement, Sub)
+                    .outerjoin(
+                        Sub,
+                        (Sub.guild_id == Announcement.guild_id)
+                        & (Sub.channel_id == Announcement.channel_id),
                     )
-                ):
-                    logger.debug(
-                        f"Bot channel not set for guild {subscription.guild.guild_name}"
+                    .where(
+                        Announcement.done_at.is_(None),
+                        Announcement.next_attempt_at <= now,
                     )
-                    continue
+                    .order_by(Announcement.id)
+                    .limit(OUTBOX_BATCH_SIZE)
+                    .options(joinedload(Sub.guild))
+                )
+            ).all()
 
-                try:
-                    playlist_items = (
-                        self.youtube.playlistItems()
-                        .list(
-                            part="contentDetails",
-                            maxResults=50,
-                            playlistId=subscription.youtube_upload_playlist,
-                        )
-                        .execute()
+            if not rows:
+                await session.execute(
+                    delete(Announcement).where(
+                        Announcement.done_at < now - dt.timedelta(days=OUTBOX_RETENTION)
                     )
+                )
+                await session.commit()
+                return 0
+
+        # Look up the videos of the whole batch together
+        videos = await self.youtube.videos(
+            {announcement.video_id for announcement, _ in rows},
+            part="liveStreamingDetails,snippet",
+        )
+
+        done: ty.List[Announcement] = []
+        # Announcements to send in each bot channel, in order
+        sends: ty.Dict[
+            int,
+            ty.Tuple[
+                discord.abc.Messageable,
+                ty.List[ty.Tuple[Announcement, Sub, ty.Dict[str, ty.Any]]],
+            ],
+        ] = {}
+        for announcement, subscription in rows:
+            video = videos.get(announcement.video_id, {})
+            details = video.get("liveStreamingDetails", {})
+            if (
+                subscription is None
+                or "scheduledStartTime" not in details
+                or "actualStartTime" in details
+            ):
+                # Unsubscribed, not a scheduled stream (or deleted), or the stream has already started
+                done.append(announcement)
+                continue
 
-                    if "items" not in playlist_items:
+            if not (
+                subscription.guild.bot_channel is not None
+                and (
+                    bot_channel := self.bot.get_channel(subscription.guild.bot_channel)
+                )
+            ):
+                logger.debug(
+                    f"Bot channel not set for guild {subscription.guild.guild_name}"
+                )
+                done.append(announcement)
+                continue
+
+            sends.setdefault(bot_channel.id, (bot_channel, []))[1].append(
+                (announcement, subscription, video)
+            )
+
+        errors: ty.Dict[int, Exception] = {}
+
+        async def send_all(
+            bot_channel: discord.abc.Messageable,
+            items: ty.List[ty.Tuple[Announcement, Sub, ty.Dict[str, ty.Any]]],
+        ) -> None:
+            for i, (announcement, subscription, video) in enumerate(items):
+                try:
+                    async with self.send_semaphore:
                         logger.info(
-                            f"No video found for channel id {subscription.youtube_channel_id}"
+                            f"Sending notification of video title: `{video['snippet']['title']}` to {bot_channel.id}"
                         )
-                        break
-
-                    for item in playlist_items["items"]:
-                        if (
-                            "contentDetails" in item
-                            and "videoPublishedAt" in item["contentDetails"]
-                            and "videoId" in item["contentDetails"]
-                        ):
-                            # Assume that the playlist is sorted by publish date in descending order
-                            if (
-                                dt.datetime.strptime(
-                                    item["contentDetails"]["videoPublishedAt"],
-                                    ISO_FORMAT,
-                                )
-                                > subscription.last_checked_at
-                            ):
-                                video_ids.append(item["contentDetails"]["videoId"])
-                            else:
-                                break
+                        # If the bot stopped before this announcement was marked as sent,
+                        # Discord drops it as a message with the nonce of another one sent in the last few minutes
+                        await bot_channel.send(
+                            announcement_message(video, subscription),
+                            nonce=announcement.id,
+                        )
+                except Exception as e:
+                    logger.error(
+                        f"Failed to send notification to {bot_channel.id}: {e!r}"
+                    )
+                    # Keep the order of the announcements in the channel
+                    for announcement, _, _ in items[i:]:
+                        errors[announcement.id] = e
+                    return
 
-                    subscription.last_checked_at = dt.datetime.now(dt.UTC)
-                    await session.commit()
+        await asyncio.gather(
+            *(send_all(*channel_sends) for channel_sends in sends.values())
+        )
+
+        retries = []
+        streams: ty.Dict[str, ty.Tuple[ty.Dict[str, ty.Any], int]] = {}
+        for _, items in sends.values():
+            for announcement, _, video in items:
+                if (error := errors.get(announcement.id)) is None:
+                    done.append(announcement)
+                    streams[video["id"]] = (video, announcement.channel_id)
+                elif (
+                    isinstance(error, (discord.Forbidden, discord.NotFound))
+                    or announcement.attempts + 1 >= MAX_SEND_ATTEMPTS
+                ):
+                    # No permission to send, the bot channel is deleted, or it keeps failing
+                    done.append(announcement)
+                else:
+                    retries.append(
+                        {
+                            "id": announcement.id,
+                            "attempts": announcement.attempts + 1,
+                            "next_attempt_at": now
+                            + dt.timedelta(
+                                seconds=error.retry_after
+                                if isinstance(error, discord.RateLimited)
+                                else SEND_RETRY_DELAY * 2**announcement.attempts
+                            ),
+                        }
+                    )
+
+        async with self.sessionmaker() as session:
+            # A single UPDATE statement (executed for each row) per outcome
+            if done:
+                await session.execute(
+                    update(Announcement),
+                    [{"id": announcement.id, "done_at": now} for announcement in done],
+                )
+            if retries:
+                await session.execute(update(Announcement), retries)
+            await session.commit()
+
+        try:
+            await self.add_reminders(list(streams.values()))
+        except Exception as e:
+            logger.error(f"Failed to add stream reminders: {e!r}")
+
+        return len(rows)
+
+    async def add_reminders(
+        self, streams: ty.List[ty.Tuple[ty.Dict[str, ty.Any], int]]
+    ) -> None:
+        """Save and schedule the reminders of newly announced streams (with the ID of their channel)."""
+
+        if not self.reminder_offsets:
+            return
+
+        now = time.time()
+        values = []
+        for video, channel_id in streams:
+            start = dt.datetime.strptime(
+                video["liveStreamingDetails"]["scheduledStartTime"], ISO_FORMAT
+            )
+            values.extend(
+                {
+                    "channel_id": channel_id,
+                    "video_id": video["id"],
+                    "title": video["snippet"]["title"][:100],
+                    "scheduled_start_time": start,
+                    "minutes_before": minutes,
+                }
+                for minutes in self.reminder_offsets
+                if timestamp(start) - minutes * 60 > now
+            )
+        if not values:
+            return
+
+        async with self.sessionmaker() as session:
+            # A stream announced again keeps its reminders, at its current start time
+            statement = insert(StreamReminder).values(values)
+            reminders = (
+                await session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=[
+                            StreamReminder.video_id,
+                            StreamReminder.minutes_before,
+                        ],
+                        set_={
+                            "scheduled_start_time": statement.excluded.scheduled_start_time
+                        },
+                    ).returning(
+                        StreamReminder.id,
+                        StreamReminder.scheduled_start_time,
+                        StreamReminder.minutes_before,
+                    )
+                )
+            ).all()
+            await session.commit()
+
+        for reminder in reminders:
+            self.reminders.schedule(
+                reminder.id,
+                timestamp(reminder.scheduled_start_time) - reminder.minutes_before * 60,
+            )
+
+    @tasks.loop(seconds=REMINDER_REFRESH_INTERVAL)
+    async def refresh_reminders(self) -> None:
+        """Move the pending reminders of streams rescheduled to another time, before they are due."""
+
+        async with self.sessionmaker() as session:
+            reminders = (
+                await session.execute(
+                    select(
+                        StreamReminder.id,
+                        StreamReminder.video_id,
+                        StreamReminder.scheduled_start_time,
+                        StreamReminder.minutes_before,
+                    )
+                )
+            ).all()
+        if not reminders:
+            return
+
+        try:
+            videos = await self.youtube.videos(
+                {reminder.video_id for reminder in reminders},
+                part="liveStreamingDetails",
+            )
+        except Exception as e:
+            logger.error(f"Cannot look up the streams of reminders: {e!r}")
+            return
+
+        moved = []
+        for reminder in reminders:
+            details = videos.get(reminder.video_id, {}).get("liveStreamingDetails", {})
+            # Reminders of deleted or unscheduled streams are dropped when they are due
+            if (
+                "scheduledStartTime" in details
+                and (
+                    start := dt.datetime.strptime(
+                        details["scheduledStartTime"], ISO_FORMAT
+                    )
+                )
+                != reminder.scheduled_start_time
+            ):
+                moved.append(
+                    {
+                        "id": reminder.id,
+                        "scheduled_start_time": start,
+                        "minutes_before": reminder.minutes_before,
+                    }
+                )
+        if not moved:
+            return
+
+        async with self.sessionmaker() as session:
+            await session.execute(
+                update(StreamReminder),
+                [
+                    {
+                        "id": reminder["id"],
+                        "scheduled_start_time": reminder["scheduled_start_time"],
+                    }
+                    for reminder in moved
+                ],
+            )
+            await session.commit()
+
+        # Reminders moved into the past are sent right away (unless too late)
+        for reminder in moved:
+            self.reminders.schedule(
+                reminder["id"],
+                timestamp(reminder["scheduled_start_time"])
+                - reminder["minutes_before"] * 60,
+            )
+        logger.debug(f"Moved {len(moved)} reminders of rescheduled streams")
 
-                    # Is there a limit to the number of IDs provided?
-                    # TODO: Handle pageToken
-                    videos = (
-                        self.youtube.videos()
-                        .list(
-                            part="liveStreamingDetails,snippet",
-                            id=",".join(video_ids),
+    async def send_reminders(self, reminder_ids: ty.List[int]) -> None:
+        """Send the due reminders, unless their streams were rescheduled, started early or deleted."""
+
+        await self.bot.wait_until_ready()
+
+        async with self.sessionmaker() as session:
+            reminders = (
+                (
+                    await session.execute(
+                        select(StreamReminder)
+                        .where(StreamReminder.id.in_(reminder_ids))
+                        .options(
+                            joinedload(StreamReminder.channel)
+                            .selectinload(YoutubeChannel.subscriptions)
+                            .joinedload(Sub.guild)
                         )
-                        .execute()
                     )
+                )
+                .scalars()
+                .all()
+            )
+            if not reminders:
+                return
 
-                    if "items" in videos:
-                        for video in reversed(videos["items"]):
-                            if "liveStreamingDetails" not in video:
-                                # Not a live stream
-                                continue
-
-                            if (
-                                "scheduledStartTime"
-                                not in video["liveStreamingDetails"]
-                                or "actualStartTime" in video["liveStreamingDetails"]
-                            ):
-                                # Not a scheduled stream or stream has already started
-                                continue
-
-                            logger.info(
-                                f"Sending notification of video title: `{video['snippet']['title']}` to {bot_channel.id}"
-                            )
-                            await bot_channel.send(
-                                MESSAGE_TEMPLATE.format(
-                                    role_tag=f"<@&{subscription.announcement_target}>"
-                                    if subscription.announcement_target
-                                    else "@everyone",
-                                    title=video["snippet"]["title"],
-                                    # HKT+8
-                                    scheduled_start_time=(
-                                        dt.datetime.fromisoformat(
-                                            video["liveStreamingDetails"][
-                                                "scheduledStartTime"
-                                            ].replace("Z", "+00:00")
-                                        ).replace(
-                                            tzinfo=zoneinfo.ZoneInfo(
-                                                key="Asia/Hong_Kong"
-                                            )
-                                        )
-                                        + dt.timedelta(hours=8)
-                                    ).strftime(r"%B %d (%A), %I:%M %p %Z"),
-                                    description=video["snippet"]["description"],
-                                    video_id=video["id"],
-                                )
-                            )
+            try:
+                videos = await self.youtube.videos(
+                    {reminder.video_id for reminder in reminders},
+                    part="liveStreamingDetails",
+                )
+            except Exception as e:
+                # Remind at the last known time
+                logger.error(f"Cannot look up the streams of reminders: {e!r}")
+                videos = None
 
-                except Exception as e:
-                    logger.error(e)
+            now = time.time()
+            due: ty.List[StreamReminder] = []
+            for reminder in reminders:
+                if videos is not None:
+                    details = videos.get(reminder.video_id, {}).get(
+                        "liveStreamingDetails", {}
+                    )
+                    if (
+                        "scheduledStartTime" not in details
+                        or "actualEndTime" in details
+                        or ("actualStartTime" in details and reminder.minutes_before)
+                    ):
+                        # Deleted, no longer scheduled, or already started
+                        await session.delete(reminder)
+                        continue
+
+                    start = dt.datetime.strptime(
+                        details["scheduledStartTime"], ISO_FORMAT
+                    )
+                    if start != reminder.scheduled_start_time:
+                        reminder.scheduled_start_time = start
+                        remind_at = timestamp(start) - reminder.minutes_before * 60
+                        if remind_at > now:
+                            self.reminders.schedule(reminder.id, remind_at)
+                            continue
+
+                await session.delete(reminder)
+                if (
+                    now
+                    - timestamp(reminder.scheduled_start_time)
+                    + reminder.minutes_before * 60
+                    < MAX_REMINDER_DELAY
+                ):
+                    due.append(reminder)
+
+            # Reminders are deleted before they are sent, so that none is sent twice
+            await session.commit()
+
+        for reminder in due:
+            await self.notify(
+                self.announcement_targets(reminder.channel),
+                lambda subscription, reminder=reminder: REMINDER_TEMPLATE.format(
+                    role_tag=role_tag(subscription),
+                    title=reminder.title,
+                    starting=f"<t:{timestamp(reminder.scheduled_start_time):.0f}:R>"
+                    if reminder.minutes_before
+                    else "now",
+                    video_id=reminder.video_id,
+                ),
+                f"reminder of video title: `{reminder.title}`",
+            )
+
+    async def fetch_new_video_ids(
+        self, channel: YoutubeChannel, etag: str | None = None
+    ) -> NewUploads:
+        """Return the IDs of the videos uploaded to the channel since it was last checked, newest first.
+
+        If the upload playlist still has the given ETag, return without reading it.
+        """
+
+        video_ids: ty.List[str] = []
+        upload_times: ty.List[float] = []
+        first_etag = None
+        params: ty.Dict[str, str | int] = {
+            "part": "contentDetails",
+            "maxResults": 50,
+            "playlistId": channel.youtube_upload_playlist,
+        }
+
+        for page in range(MAX_PLAYLIST_PAGES):
+            if page == 0:
+                playlist_items = await self.youtube.request_if_modified(
+                    "playlistItems", etag, **params
+                )
+                if playlist_items is None:
+                    return NewUploads([], etag, modified=False)
+                first_etag = playlist_items.get("etag")
+            else:
+                playlist_items = await self.youtube.request("playlistItems", **params)
+
+            if "items" not in playlist_items:
+                return NewUploads(
+                    None if page == 0 else video_ids, first_etag, upload_times
+                )
+
+            done = False
+            for item in playlist_items["items"]:
+                if (
+                    "contentDetails" in item
+                    and "videoPublishedAt" in item["contentDetails"]
+                    and "videoId" in item["contentDetails"]
+                ):
+                    published = dt.datetime.strptime(
+                        item["contentDetails"]["videoPublishedAt"], ISO_FORMAT
+                    )
+                    # Publish times of the whole page tell how often the channel uploads
+                    upload_times.append(timestamp(published))
+
+                    # Assume that the playlist is sorted by publish date in descending order
+                    if published > channel.last_checked_at and not done:
+                        video_ids.append(item["contentDetails"]["videoId"])
+                    else:
+                        done = True
+
+            if done:
+                break
+
+            # Every video of the page is new, continue on the next page
+            if "nextPageToken" not in playlist_items:
+                break
+            params["pageToken"] = playlist_items["nextPageToken"]
+
+        return NewUploads(video_ids, first_etag, upload_times)
+
+    async def notify(
+        self,
+        targets: Targets,
+        render: ty.Callable[[Sub], str],
+        description: str,
+    ) -> None:
+        """Send a message (rendered for each subscription) to the bot channel of each subscribed guild."""
+
+        async def send(subscription: Sub, bot_channel: discord.abc.Messageable) -> None:
+            async with self.send_semaphore:
+                logger.info(f"Sending {description} to {bot_channel.id}")
+                await bot_channel.send(render(subscription))
+
+        # A guild failing to receive the message does not stop the others
+        for (_, bot_channel), result in zip(
+            targets,
+            await asyncio.gather(
+                *(send(*target) for target in targets), return_exceptions=True
+            ),
+        ):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Failed to send {description} to {bot_channel.id}: {result}"
+                )
 
     @check_subscription.before_loop
+    @renew_websub.before_loop
+    @refresh_reminders.before_loop
     async def check_subscription_wait(self) -> None:
         await self.bot.wait_until_ready()
 
@@ -203,70 +1035,90 @@ https://www.youtube.com/watch?v={video_id}"""
 
         async with self.sessionmaker() as session:
             guild = (
-                (
-                    await session.execute(
-                        select(Guild)
-                        .where(Guild.guild_id == ia.guild.id)
-                        .options(
-                            joinedload(
-                                Guild.subscriptions.and_(
-                                    Sub.youtube_channel_id == channel_id
-                                )
-                            )
-                        )
-                    )
+                await session.execute(
+                    select(Guild).where(Guild.guild_id == ia.guild.id)
                 )
-                .unique()
-                .scalar_one()
-            )
+            ).scalar_one()
 
             if not guild.bot_channel:
                 await ia.followup.send("Bot channel not set. Use `/set_bot_channel`.")
                 return
 
-            if guild.subscriptions:
+            channel = (
                 await session.execute(
-                    delete(Sub).where(Sub.youtube_channel_id == channel_id)
+                    select(YoutubeChannel)
+                    .where(YoutubeChannel.youtube_channel_id == channel_id)
+                    .options(selectinload(YoutubeChannel.subscriptions))
                 )
-                await session.commit()
-                await ia.followup.send(
-                    f"Unsubscribed from `{guild.subscriptions[0].youtube_channel_name}."
-                )
-                return
+            ).scalar_one_or_none()
 
-            channel = (
-                self.youtube.channels()
-                .list(part="contentDetails,snippet", id=channel_id)
-                .execute()
-            )
+            if channel is not None:
+                for subscription in channel.subscriptions:
+                    if subscription.guild_id == guild.id:
+                        if len(channel.subscriptions) == 1:
+                            # Nobody else is subscribed, stop checking the channel
+                            await session.delete(channel)
+                            await session.commit()
+                            self.scheduler.remove(channel.id)
+                            await self.request_websub(channel_id, subscribe=False)
+                        else:
+                            await session.delete(subscription)
+                            await session.commit()
+                        await ia.followup.send(
+                            f"Unsubscribed from `{channel.youtube_channel_name}`."
+                        )
+                        return
 
-            if "items" not in channel:
-                await ia.followup.send("Invalid YouTube channel ID")
-                return
+            else:
+                # Look up the channel, unless another guild has already subscribed to it
+                try:
+                    response = await self.youtube.request(
+                        "channels", part="contentDetails,snippet", id=channel_id
+                    )
+                except (YouTubeError, aiohttp.ClientError, TimeoutError) as e:
+                    logger.error(f"Cannot look up YouTube channel {channel_id}: {e!r}")
+                    await ia.followup.send(
+                        "Cannot reach YouTube. Please try again later."
+                    )
+                    return
 
-            if (
-                "contentDetails" not in channel["items"][0]
-                or "snippet" not in channel["items"][0]
-            ):
-                await ia.followup.send(
-                    "Failed: Cannot find enough information for this Youtube channel."
+                if "items" not in response:
+                    await ia.followup.send("Invalid YouTube channel ID")
+                    return
+
+                if (
+                    "contentDetails" not in response["items"][0]
+                    or "snippet" not in response["items"][0]
+                ):
+                    await ia.followup.send(
+                        "Failed: Cannot find enough information for this Youtube channel."
+                    )
+                    return
+
+                channel = YoutubeChannel(
+                    youtube_channel_id=channel_id,
+                    youtube_channel_name=response["items"][0]["snippet"]["title"],
+                    youtube_upload_playlist=response["items"][0]["contentDetails"][
+                        "relatedPlaylists"
+                    ]["uploads"],
                 )
-                return
+                session.add(channel)
 
             session.add(
                 Sub(
                     guild_id=guild.id,
-                    youtube_channel_id=channel_id,
-                    youtube_channel_name=channel["items"][0]["snippet"]["title"],
-                    youtube_upload_playlist=channel["items"][0]["contentDetails"][
-                        "relatedPlaylists"
-                    ]["uploads"],
+                    channel=channel,
                     announcement_target=target_role_id,
                 )
             )
 
             await session.commit()
 
+        if channel.id not in self.scheduler.intervals:
+            self.schedule_poll(channel, time.time(), time.time())
+        if self.websub is not None and self.websub.needs_renewal(channel_id):
+            await self.request_websub(channel_id, subscribe=True)
+
         await ia.followup.send(
-            f"Successfully subscribed to `{channel['items'][0]['snippet']['title']}`."
+            f"Successfully subscribed to `{channel.youtube_channel_name}`."
         )
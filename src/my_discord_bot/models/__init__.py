@@ -1,9 +1,19 @@
 from ._model_base import ModelBase
+from .announcement import Announcement
+from .chat_cache import ChatCache
 from .guild import Guild
+from .playlist_etag import PlaylistEtag
+from .stream_reminder import StreamReminder
 from .subscription import Subscription
+from .youtube_channel import YoutubeChannel
 
 __all__ = (
     "ModelBase",
+    "Announcement",
+    "ChatCache",
     "Guild",
+    "PlaylistEtag",
+    "StreamReminder",
     "Subscription",
+    "YoutubeChannel",
 )
@@ -0,0 +1,42 @@
+import datetime as dt
+
+from sqlalchemy import ForeignKey, Identity, String, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._model_base import ModelBase
+
+
+class Announcement(ModelBase):
+    """Announcement of a new video in a guild, in the outbox until it is sent.
+
+    Sent announcements are kept for a while, so that a video detected again is not announced twice.
+    """
+
+    __tablename__ = "announcement"
+    __table_args__ = (UniqueConstraint("video_id", "guild_id"),)
+
+    id: Mapped[int] = mapped_column(
+        Identity(always=True, start=1, increment=1), primary_key=True
+    )
+    video_id: Mapped[str] = mapped_column(String(20))
+    guild_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "guild.id",
+            ondelete="CASCADE",
+        )
+    )
+    channel_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "youtube_channel.id",
+            ondelete="CASCADE",
+        )
+    )
+    created_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC)
+    )
+    attempts: Mapped[int] = mapped_column(default=0)
+    next_attempt_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC), index=True
+    )
+    # When the announcement was sent, or found not to be needed (e.g. the video is not a scheduled stream)
+    done_at: Mapped[dt.datetime | None] = mapped_column(index=True)
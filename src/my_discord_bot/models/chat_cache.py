@@ -0,0 +1,25 @@
+import datetime as dt
+
+from sqlalchemy import Identity, String, UnicodeText
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._model_base import ModelBase
+
+
+class ChatCache(ModelBase):
+    __tablename__ = "chat_cache"
+
+    id: Mapped[int] = mapped_column(
+        Identity(always=True, start=1, increment=1), primary_key=True
+    )
+    # SHA-256 of the model name and the normalized prompt
+    cache_key: Mapped[str] = mapped_column(String(64), unique=True)
+    response: Mapped[str] = mapped_column(UnicodeText)
+    # Size of the response in bytes (UTF-8)
+    size: Mapped[int]
+    created_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC)
+    )
+    last_used_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC), index=True
+    )
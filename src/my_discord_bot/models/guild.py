@@ -1,6 +1,6 @@
 import typing as ty
 
-from sqlalchemy import Identity, Unicode
+from sqlalchemy import Identity, Unicode, false
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from ._model_base import ModelBase
@@ -19,6 +19,8 @@ class Guild(ModelBase):
     guild_name: Mapped[str] = mapped_column(Unicode(100))
     bot_channel: Mapped[None | int] = mapped_column(default=None)
     welcome_message: Mapped[None | str] = mapped_column(Unicode(2000), default=None)
+    # Reply to Pixiv links in messages with their embeds
+    expand_links: Mapped[bool] = mapped_column(default=False, server_default=false())
 
     subscriptions: Mapped[ty.List["Subscription"]] = relationship(
         back_populates="guild",
@@ -0,0 +1,22 @@
+import datetime as dt
+
+from sqlalchemy import Identity, String
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ._model_base import ModelBase
+
+
+class PlaylistEtag(ModelBase):
+    """ETag of a YouTube upload playlist, to skip it while it is unchanged."""
+
+    __tablename__ = "playlist_etag"
+
+    id: Mapped[int] = mapped_column(
+        Identity(always=True, start=1, increment=1), primary_key=True
+    )
+    playlist_id: Mapped[str] = mapped_column(String(50), unique=True)
+    # ETag of the first page of the playlist, when it was last processed
+    etag: Mapped[str] = mapped_column(String(100))
+    last_used_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC), index=True
+    )
@@ -0,0 +1,33 @@
+import datetime as dt
+import typing as ty
+
+from sqlalchemy import ForeignKey, Identity, String, Unicode, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from ._model_base import ModelBase
+
+if ty.TYPE_CHECKING:
+    from .youtube_channel import YoutubeChannel
+
+
+class StreamReminder(ModelBase):
+    """A pending reminder of a scheduled live stream, sent `minutes_before` it starts."""
+
+    __tablename__ = "stream_reminder"
+    __table_args__ = (UniqueConstraint("video_id", "minutes_before"),)
+
+    id: Mapped[int] = mapped_column(
+        Identity(always=True, start=1, increment=1), primary_key=True
+    )
+    channel_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "youtube_channel.id",
+            ondelete="CASCADE",
+        )
+    )
+    video_id: Mapped[str] = mapped_column(String(20))
+    title: Mapped[str] = mapped_column(Unicode(100))
+    scheduled_start_time: Mapped[dt.datetime]
+    minutes_before: Mapped[int]
+
+    channel: Mapped["YoutubeChannel"] = relationship(lazy="raise")
@@ -1,17 +1,18 @@
-import datetime as dt
 import typing as ty
 
-from sqlalchemy import ForeignKey, Identity, String, Unicode
+from sqlalchemy import ForeignKey, Identity, String, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from ._model_base import ModelBase
 
 if ty.TYPE_CHECKING:
     from .guild import Guild
+    from .youtube_channel import YoutubeChannel
 
 
 class Subscription(ModelBase):
     __tablename__ = "subscription"
+    __table_args__ = (UniqueConstraint("guild_id", "channel_id"),)
 
     id: Mapped[int] = mapped_column(
         Identity(always=True, start=1, increment=1), primary_key=True
@@ -22,15 +23,19 @@ class Subscription(ModelBase):
             ondelete="CASCADE",
         )
     )
-    youtube_channel_name: Mapped[str] = mapped_column(Unicode(50))
-    youtube_channel_id: Mapped[int] = mapped_column(unique=True)
-    youtube_upload_playlist: Mapped[str] = mapped_column(String(50))
-    announcement_target: Mapped[None | str] = mapped_column(String(50), default=None)
-    last_checked_at: Mapped[dt.datetime] = mapped_column(
-        default=lambda: dt.datetime.now(dt.UTC)
+    channel_id: Mapped[int] = mapped_column(
+        ForeignKey(
+            "youtube_channel.id",
+            ondelete="CASCADE",
+        )
     )
+    announcement_target: Mapped[None | str] = mapped_column(String(50), default=None)
 
     guild: Mapped["Guild"] = relationship(
         back_populates="subscriptions",
         lazy="raise",
     )
+    channel: Mapped["YoutubeChannel"] = relationship(
+        back_populates="subscriptions",
+        lazy="raise",
+    )
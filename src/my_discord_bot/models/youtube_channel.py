@@ -0,0 +1,36 @@
+import datetime as dt
+import typing as ty
+
+from sqlalchemy import Identity, String, Unicode
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+
+from ._model_base import ModelBase
+
+if ty.TYPE_CHECKING:
+    from .subscription import Subscription
+
+
+class YoutubeChannel(ModelBase):
+    """A YouTube channel subscribed to by one or more guilds, polled once for all of them."""
+
+    __tablename__ = "youtube_channel"
+
+    id: Mapped[int] = mapped_column(
+        Identity(always=True, start=1, increment=1), primary_key=True
+    )
+    youtube_channel_id: Mapped[str] = mapped_column(String(50), unique=True)
+    youtube_channel_name: Mapped[str] = mapped_column(Unicode(50))
+    youtube_upload_playlist: Mapped[str] = mapped_column(String(50))
+    last_checked_at: Mapped[dt.datetime] = mapped_column(
+        default=lambda: dt.datetime.now(dt.UTC)
+    )
+    # Publish time of the latest upload, and the median time (in seconds) between recent uploads;
+    # Used to decide how often the channel is polled
+    last_upload_at: Mapped[dt.datetime | None]
+    upload_interval: Mapped[int | None]
+
+    subscriptions: Mapped[ty.List["Subscription"]] = relationship(
+        back_populates="channel",
+        lazy="raise",
+        cascade="save-update, merge, delete",
+    )
@@ -0,0 +1,521 @@
+"""Local stand-ins for the OpenAI, Pixiv and YouTube APIs, the WebSub hub, Discord interactions and the database."""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import types
+import typing as ty
+import urllib.parse
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from my_discord_bot.models import ModelBase
+
+
+class FakeOpenAI:
+    """OpenAI-compatible server, streaming `chunks` as server-sent events.
+
+    The first chunk (or a whole completion or embedding) takes `first_delay` seconds,
+    the next chunks `delay` seconds each. If `status` is not 200, requests fail with that status instead.
+    """
+
+    def __init__(
+        self,
+        chunks: ty.Sequence[str] = ("Hello", " world"),
+        first_delay: float = 0.05,
+        delay: float = 0.01,
+    ) -> None:
+        self.chunks = chunks
+        self.first_delay = first_delay
+        self.delay = delay
+        self.status = 200
+        self.requests: ty.Dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        """Return the base URL of the API."""
+
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        # Like a real server, stop working on requests abandoned by the client
+        self.runner = web.AppRunner(app, access_log=None, handler_cancellation=True)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    def _count(self, kind: str) -> None:
+        self.requests[kind] = self.requests.get(kind, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def _error(self) -> web.Response:
+        return web.json_response(
+            {
+                "error": {
+                    "message": f"Fake error {self.status}",
+                    "type": "fake_error",
+                    "code": None,
+                }
+            },
+            status=self.status,
+        )
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self._count("stream" if body.get("stream") else "complete")
+        try:
+            await asyncio.sleep(self.first_delay)
+            if self.status != 200:
+                return self._error()
+            if not body.get("stream"):
+                return web.json_response(
+                    {
+                        "id": "completion",
+                        "object": "chat.completion",
+                        "created": 0,
+                        "model": body["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "finish_reason": "stop",
+                                "message": {
+                                    "role": "assistant",
+                                    "content": "".join(self.chunks),
+                                },
+                            }
+                        ],
+                    }
+                )
+
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for i, chunk in enumerate(self.chunks):
+                if i:
+                    await asyncio.sleep(self.delay)
+                event = {
+                    "id": "completion",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [
+                        {"index": 0, "delta": {"content": chunk}, "finish_reason": None}
+                    ],
+                }
+                await response.write(f"data: {json.dumps(event)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._count("embed")
+        try:
+            await asyncio.sleep(self.first_delay)
+            if self.status != 200:
+                return self._error()
+            digest = hashlib.sha256(body["input"].encode()).digest()
+            return web.json_response(
+                {
+                    "object": "list",
+                    "model": body["model"],
+                    "data": [
+                        {
+                            "object": "embedding",
+                            "index": 0,
+                            "embedding": [byte - 128 for byte in digest[:16]],
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 1, "total_tokens": 1},
+                }
+            )
+        finally:
+            self.in_flight -= 1
+
+
+class FakeFileServer:
+    """HTTP server of static files, which gallery-dl downloads as direct links.
+
+    Files named in `hanging` send their headers and a first chunk, then never finish.
+    """
+
+    def __init__(
+        self, files: ty.Dict[str, bytes], hanging: ty.Collection[str] = ()
+    ) -> None:
+        self.files = files
+        self.hanging = hanging
+        self.runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    async def start(self) -> str:
+        """Return the base URL of the files."""
+
+        app = web.Application()
+        app.router.add_get("/files/{name}", self.get)
+        self.runner = web.AppRunner(app, access_log=None, handler_cancellation=True)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        self.base_url = f"http://{host}:{port}/files"
+        return self.base_url
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def get(self, request: web.Request) -> web.StreamResponse:
+        name = request.match_info["name"]
+        if (data := self.files.get(name)) is None:
+            raise web.HTTPNotFound()
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        response.content_length = len(data)
+        await response.prepare(request)
+        if name in self.hanging:
+            await response.write(data[: len(data) // 2])
+            await asyncio.Event().wait()
+        await response.write(data)
+        await response.write_eof()
+        return response
+
+
+class FakePixiv:
+    """Pixiv AJAX API serving the metadata of `artworks`, in the format of /ajax/illust/<id>."""
+
+    def __init__(self, artworks: ty.Dict[int, ty.Dict[str, ty.Any]]) -> None:
+        self.artworks = artworks
+        self.requests: ty.List[web.Request] = []
+        self.runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        """Return the base URL of the API."""
+
+        app = web.Application()
+        app.router.add_get("/ajax/illust/{id}", self.illust)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def illust(self, request: web.Request) -> web.Response:
+        self.requests.append(request)
+        if (body := self.artworks.get(int(request.match_info["id"]))) is None:
+            # Pixiv answers deleted artworks with an error in a successful response
+            return web.json_response(
+                {"error": True, "message": "Deleted or private", "body": []}
+            )
+        return web.json_response({"error": False, "message": "", "body": body})
+
+
+class FakeYouTube:
+    """YouTube Data API serving the upload `playlists` (lists of video IDs and publish times, newest first),
+    and the `videos` resources by ID.
+
+    Playlist pages have ETags, and requests with the current one get 304 Not Modified.
+    The next playlist requests fail with the statuses in `errors`, one each, before the others are served.
+    """
+
+    def __init__(
+        self,
+        playlists: ty.Dict[str, ty.List[ty.Tuple[str, str]]],
+        videos: ty.Dict[str, ty.Dict[str, ty.Any]] | None = None,
+    ) -> None:
+        self.playlists = playlists
+        self.videos = videos or {}
+        self.errors: ty.List[int] = []
+        # Query parameters and If-None-Match header of every playlist request
+        self.requests: ty.List[ty.Tuple[ty.Dict[str, str], str | None]] = []
+        self.runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        """Return the base URL of the API."""
+
+        app = web.Application()
+        app.router.add_get("/youtube/v3/playlistItems", self.playlist_items)
+        app.router.add_get("/youtube/v3/videos", self.list_videos)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/youtube/v3"
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def playlist_items(self, request: web.Request) -> web.Response:
+        self.requests.append(
+            (dict(request.query), request.headers.get("If-None-Match"))
+        )
+        if self.errors:
+            status = self.errors.pop(0)
+            return web.json_response(
+                {
+                    "error": {
+                        "code": status,
+                        "message": "Try again later",
+                        "errors": [{"reason": "backendError"}],
+                    }
+                },
+                status=status,
+                headers={"Retry-After": "0"},
+            )
+
+        if (videos := self.playlists.get(request.query["playlistId"])) is None:
+            return web.json_response(
+                {
+                    "error": {
+                        "code": 404,
+                        "message": "The playlist cannot be found",
+                        "errors": [{"reason": "playlistNotFound"}],
+                    }
+                },
+                status=404,
+            )
+
+        start = int(request.query.get("pageToken", "0"))
+        end = start + int(request.query.get("maxResults", "5"))
+        page = videos[start:end]
+        etag = hashlib.sha256(
+            json.dumps([request.query.get("pageToken"), page]).encode()
+        ).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304)
+
+        body: ty.Dict[str, ty.Any] = {
+            "etag": etag,
+            "items": [
+                {
+                    "contentDetails": {
+                        "videoId": video_id,
+                        "videoPublishedAt": published_at,
+                    }
+                }
+                for video_id, published_at in page
+            ],
+        }
+        if end < len(videos):
+            body["nextPageToken"] = str(end)
+        return web.json_response(body)
+
+    async def list_videos(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "items": [
+                    self.videos[video_id]
+                    for video_id in request.query["id"].split(",")
+                    if video_id in self.videos
+                ]
+            }
+        )
+
+
+class FakeHub:
+    """WebSub hub, verifying the intents of subscribers before it accepts them (like hub.verify=sync).
+
+    Verified subscriptions are granted leases of `lease_seconds`, and can be pushed feeds with publish().
+    """
+
+    def __init__(self, lease_seconds: int) -> None:
+        self.lease_seconds = lease_seconds
+        # Form of every subscription request, and the response of its verification as (status, text)
+        self.requests: ty.List[ty.Dict[str, str]] = []
+        self.verifications: ty.List[ty.Tuple[int, str]] = []
+        # Callback URL and secret of the subscribers, by topic
+        self.subscribers: ty.Dict[str, ty.Tuple[str, str]] = {}
+        self.runner: web.AppRunner | None = None
+
+    async def start(self) -> str:
+        """Return the URL of the hub."""
+
+        app = web.Application()
+        app.router.add_post("/subscribe", self.subscribe)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = site._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/subscribe"
+
+    async def close(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    async def subscribe(self, request: web.Request) -> web.Response:
+        form = {key: str(value) for key, value in (await request.post()).items()}
+        self.requests.append(form)
+
+        challenge = hashlib.sha256(json.dumps(form).encode()).hexdigest()
+        status, text = await self.get(
+            form["hub.callback"],
+            {
+                "hub.mode": form["hub.mode"],
+                "hub.topic": form["hub.topic"],
+                "hub.challenge": challenge,
+                "hub.lease_seconds": str(self.lease_seconds),
+            },
+        )
+        self.verifications.append((status, text))
+        if status != 200 or text != challenge:
+            return web.Response(status=409, text="Verification failed")
+
+        if form["hub.mode"] == "subscribe":
+            self.subscribers[form["hub.topic"]] = (
+                form["hub.callback"],
+                form.get("hub.secret", ""),
+            )
+        else:
+            self.subscribers.pop(form["hub.topic"], None)
+        return web.Response(status=204)
+
+    async def publish(self, topic: str, feed: bytes, secret: str | None = None) -> int:
+        """Push the feed to the subscriber of the topic, signed with its secret (or `secret` instead).
+
+        Return the status of the response.
+        """
+
+        callback_url, subscriber_secret = self.subscribers[topic]
+        signature = hmac.new(
+            (subscriber_secret if secret is None else secret).encode(), feed, "sha1"
+        ).hexdigest()
+        async with aiohttp.ClientSession() as session:
+            async with session.post(
+                callback_url,
+                data=feed,
+                headers={
+                    "Content-Type": "application/atom+xml",
+                    "X-Hub-Signature": f"sha1={signature}",
+                },
+            ) as response:
+                return response.status
+
+    async def get(self, url: str, params: ty.Dict[str, str]) -> ty.Tuple[int, str]:
+        """Send a verification request to a callback URL, and return the status and text of the response."""
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(
+                f"{url}?{urllib.parse.urlencode(params)}"
+            ) as response:
+                return response.status, await response.text()
+
+
+async def temp_database(
+    directory: Path,
+) -> ty.Tuple[AsyncEngine, async_sessionmaker[AsyncSession]]:
+    """Create the tables of the bot in a new SQLite database in the directory."""
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{directory / 'db.sqlite3'}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragma(dbapi_connection: ty.Any, connection_record: ty.Any) -> None:
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+    async with engine.begin() as connection:
+        await connection.run_sync(ModelBase.metadata.create_all)
+    return engine, async_sessionmaker(engine, expire_on_commit=False)
+
+
+class FakeMessage:
+    def __init__(self, followup: "FakeFollowup", content: str | None) -> None:
+        self.followup = followup
+        self.content = content
+
+    async def edit(self, content: str) -> "FakeMessage":
+        self.followup.check_failure()
+        self.content = content
+        self.followup.events.append((time.monotonic(), content))
+        return self
+
+
+class FakeFollowup:
+    def __init__(self) -> None:
+        self.messages: ty.List[FakeMessage] = []
+        # Every message sent or edited, as (time, content)
+        self.events: ty.List[ty.Tuple[float, str | None]] = []
+        # Number of the next sends or edits which fail
+        self.failures = 0
+
+    def check_failure(self) -> None:
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("Discord is unavailable")
+
+    async def send(
+        self, content: str | None = None, wait: bool = False, **kwargs: ty.Any
+    ) -> FakeMessage:
+        self.check_failure()
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        self.events.append((time.monotonic(), content))
+        return message
+
+
+class FakeInteraction:
+    def __init__(self, guild_id: int = 1, channel_id: int = 1) -> None:
+        self.guild = types.SimpleNamespace(id=guild_id)
+        self.channel = types.SimpleNamespace(id=channel_id)
+        self.response = types.SimpleNamespace(defer=self._defer)
+        self.followup = FakeFollowup()
+
+    async def _defer(self) -> None:
+        pass
+
+
+class LoopLagProbe:
+    """Measure how late the event loop wakes up a task sleeping `interval` seconds at a time."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.max_lag = 0.0
+        self.task: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> "LoopLagProbe":
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, *exc_info: ty.Any) -> None:
+        assert self.task is not None
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, time.monotonic() - start - self.interval)
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import time
+import unittest
+from unittest import mock
+
+import openai
+from fakes import FakeOpenAI
+
+from my_discord_bot.cogs._ai_backend import (
+    COMPLETE,
+    EJECT_SECONDS,
+    FAILURE_THRESHOLD,
+    BackendPool,
+)
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+
+
+class BackendPoolTest(unittest.IsolatedAsyncioTestCase):
+    """Failover and hedging between local fake OpenAI-compatible servers."""
+
+    async def asyncSetUp(self) -> None:
+        self.servers = [FakeOpenAI(first_delay=0.01) for _ in range(3)]
+        self.backends = [
+            {"name": name, "base_url": await server.start(), "api_key": "test"}
+            for name, server in zip("abc", self.servers)
+        ]
+
+    async def asyncTearDown(self) -> None:
+        for server in self.servers:
+            await server.close()
+
+    def make_pool(self, count: int, hedge: bool = False) -> BackendPool:
+        with mock.patch.dict(
+            os.environ,
+            {
+                "OPENAI_BACKENDS": json.dumps(self.backends[:count]),
+                "AI_HEDGE_REQUESTS": str(hedge).lower(),
+            },
+        ):
+            return BackendPool.from_env()
+
+    async def test_server_error_ejects(self) -> None:
+        pool = self.make_pool(2)
+        a, b = pool.backends
+        self.servers[0].status = 500
+
+        # Every request fails over to b, until a is ejected and not tried anymore
+        for _ in range(FAILURE_THRESHOLD + 2):
+            self.assertEqual(await pool.complete("model", MESSAGES), "Hello world")
+        self.assertEqual(self.servers[0].requests, {"complete": FAILURE_THRESHOLD})
+        self.assertEqual(self.servers[1].requests, {"complete": FAILURE_THRESHOLD + 2})
+        self.assertIsNotNone(a.ejected_at)
+
+        # Still ejected just before EJECT_SECONDS
+        a.ejected_at -= EJECT_SECONDS - 1
+        await pool.complete("model", MESSAGES)
+        self.assertEqual(self.servers[0].requests, {"complete": FAILURE_THRESHOLD})
+
+        # Then probed with a single request, which fails and ejects it again
+        a.ejected_at -= 1
+        await pool.complete("model", MESSAGES)
+        self.assertEqual(self.servers[0].requests, {"complete": FAILURE_THRESHOLD + 1})
+        self.assertGreater(a.ejected_at, time.monotonic() - 1)
+
+        # Once it works again, the probe closes the circuit breaker
+        self.servers[0].status = 200
+        a.ejected_at -= EJECT_SECONDS
+        await pool.complete("model", MESSAGES)
+        self.assertEqual(self.servers[0].requests, {"complete": FAILURE_THRESHOLD + 2})
+        self.assertEqual((a.ejected_at, a.failures), (None, 0))
+        self.assertIn("Backend a: up", pool.summary())
+
+    async def test_client_error_does_not_fail_over(self) -> None:
+        pool = self.make_pool(3)
+        self.servers[0].status = 400
+
+        # A bad request would fail on any backend
+        for _ in range(FAILURE_THRESHOLD + 1):
+            with self.assertRaises(openai.BadRequestError):
+                await pool.complete("model", MESSAGES)
+        self.assertEqual(self.servers[0].requests, {"complete": FAILURE_THRESHOLD + 1})
+        self.assertEqual(self.servers[1].requests, {})
+        self.assertEqual(self.servers[2].requests, {})
+        self.assertEqual(
+            (pool.backends[0].ejected_at, pool.backends[0].failures), (None, 0)
+        )
+
+    async def test_rate_limit_fails_over(self) -> None:
+        pool = self.make_pool(2)
+        self.servers[0].status = 429
+
+        self.assertEqual(
+            await pool.embed("model", "Hello"), await pool.embed("model", "Hello")
+        )
+        self.assertEqual(self.servers[1].requests, {"embed": 2})
+        self.assertEqual(pool.backends[0].failures, 2)
+
+    async def test_hedging(self) -> None:
+        pool = self.make_pool(2, hedge=True)
+        a, b = pool.backends
+        slow = self.servers[0]
+
+        # Measured latency of a: 19 fast requests, then one slow
+        for _ in range(19):
+            await pool.complete("model", MESSAGES)
+        slow.first_delay = 0.2
+        start = time.monotonic()
+        await pool.complete("model", MESSAGES)
+        # Not hedged with fewer than 20 samples
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(self.servers[1].requests, {})
+        self.assertEqual(len(a.latencies[COMPLETE].samples), 20)
+
+        # With 20 samples, a request slower than p95 (the 0.2s one) is sent to b too
+        slow.first_delay = 2
+        start = time.monotonic()
+        self.assertEqual(await pool.complete("model", MESSAGES), "Hello world")
+        duration = time.monotonic() - start
+        print(f"\nHedged request took {duration * 1000:.0f}ms")
+        self.assertLess(duration, 1)
+        self.assertEqual(self.servers[1].requests, {"complete": 1})
+        self.assertEqual(len(b.latencies[COMPLETE].samples), 1)
+
+        # The slower attempt was cancelled
+        await asyncio.sleep(0.1)
+        self.assertEqual((a.in_flight, b.in_flight, slow.in_flight), (0, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
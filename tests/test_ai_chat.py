@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeInteraction, FakeOpenAI, LoopLagProbe
+
+from my_discord_bot.cogs._semantic_cache import SemanticCache
+from my_discord_bot.cogs._streamed_reply import EDIT_INTERVAL, MESSAGE_LIMIT
+from my_discord_bot.cogs.ai import AI
+
+FIRST_DELAY = 0.3
+# 100 chunks of 25 characters, generated over 2 seconds
+CHUNKS = [f"word{i:03} ".ljust(25, ".") for i in range(100)]
+
+
+class StreamedChatTest(unittest.IsolatedAsyncioTestCase):
+    """/chat against a local fake OpenAI-compatible server."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeOpenAI(CHUNKS, first_delay=FIRST_DELAY, delay=0.02)
+        environ = mock.patch.dict(
+            os.environ,
+            {
+                "OPENAI_BASE_URL": await self.server.start(),
+                "OPENAI_API_KEY": "test",
+                "OPENAI_MODEL_NAME": "test-model",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.cog = AI(mock.Mock(), None)
+
+    async def asyncTearDown(self) -> None:
+        await self.cog.cog_unload()
+        await self.server.close()
+
+    async def test_long_generation(self) -> None:
+        ia = FakeInteraction()
+
+        async with LoopLagProbe() as probe:
+            start = time.monotonic()
+            await AI.chat.callback(self.cog, ia, "Tell me a long story")
+            duration = time.monotonic() - start
+
+        first_visible = next(
+            at - start for at, content in ia.followup.events if content
+        )
+        print(
+            f"\nTime to first visible token: {first_visible * 1000:.0f}ms, "
+            f"max event loop lag: {probe.max_lag * 1000:.1f}ms during a {duration:.1f}s generation"
+        )
+
+        # The first chunk is shown as soon as it arrives, not after the whole generation
+        self.assertLess(first_visible, FIRST_DELAY + 0.5)
+        # The event loop keeps running (heartbeats, other commands) during the generation
+        self.assertLess(probe.max_lag, 0.1)
+
+        # The reply rolls over into a new message at the length limit
+        self.assertEqual(
+            [message.content for message in ia.followup.messages],
+            [
+                "".join(CHUNKS)[:MESSAGE_LIMIT],
+                "".join(CHUNKS)[MESSAGE_LIMIT:],
+            ],
+        )
+        # Edits are throttled
+        self.assertLessEqual(len(ia.followup.events), duration / EDIT_INTERVAL + 3)
+
+    async def test_cached_follow_up(self) -> None:
+        self.server.first_delay = self.server.delay = 0
+        for channel in (1, 2):
+            for message in ("What is Python?", "Give me an example"):
+                await AI.chat.callback(self.cog, FakeInteraction(1, channel), message)
+
+        # The second channel has the same conversation, so both of its answers are cached
+        self.assertEqual(self.server.requests, {"stream": 2})
+        self.assertEqual(self.cog.cache.follow_up_hits, 1)
+        self.assertEqual(
+            self.cog.conversations.get(1).digest(),
+            self.cog.conversations.get(2).digest(),
+        )
+
+        # The same follow-up after another conversation is not
+        await AI.chat.callback(self.cog, FakeInteraction(1, 3), "What is Rust?")
+        await AI.chat.callback(self.cog, FakeInteraction(1, 3), "Give me an example")
+        self.assertEqual(self.server.requests, {"stream": 4})
+
+    async def test_semantic_follow_up(self) -> None:
+        self.server.first_delay = self.server.delay = 0
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cog.semantic_cache = SemanticCache(
+            self.cog.backends,
+            "test-model",
+            "test-embedding-model",
+            threshold=0.95,
+            max_entries=100,
+            directory=Path(directory.name),
+        )
+        # Only the semantic cache can answer
+        self.cog.cache.memory_bytes = 0
+
+        # Conversation digests before the follow-up prompts
+        contexts = {}
+        for channel, question in ((1, "What is Python?"), (2, "What is Python?")):
+            await AI.chat.callback(self.cog, FakeInteraction(1, channel), question)
+            contexts[channel] = self.cog.conversations.get(channel).digest()
+            await AI.chat.callback(
+                self.cog, FakeInteraction(1, channel), "Give me an example"
+            )
+        self.assertEqual(self.server.requests, {"embed": 4, "stream": 2})
+        self.assertEqual(
+            (self.cog.semantic_cache.hits, self.cog.semantic_cache.follow_up_hits),
+            (2, 1),
+        )
+
+        await AI.chat.callback(self.cog, FakeInteraction(1, 3), "What is Rust?")
+        contexts[3] = self.cog.conversations.get(3).digest()
+        await AI.chat.callback(self.cog, FakeInteraction(1, 3), "Give me an example")
+        self.assertEqual(self.server.requests, {"embed": 6, "stream": 4})
+
+        # Contexts are kept when the index is saved and loaded
+        await self.cog.semantic_cache.save()
+        loaded = SemanticCache(
+            self.cog.backends,
+            "test-model",
+            "test-embedding-model",
+            threshold=0.95,
+            max_entries=100,
+            directory=Path(directory.name),
+        )
+        vector = await loaded.embed("Give me an example")
+        for channel in (1, 3):
+            self.assertIsNotNone(await loaded.get(1, vector, contexts[channel]))
+        self.assertIsNone(await loaded.get(1, vector))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import tempfile
+import time
+import typing as ty
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeInteraction, FakeOpenAI
+
+from my_discord_bot.cogs._semantic_cache import SemanticCache
+from my_discord_bot.cogs.ai import AI
+
+FIRST_DELAY = 0.1
+CHUNKS = [f"word{i} " for i in range(10)]
+
+
+class SchedulerLoadTest(unittest.IsolatedAsyncioTestCase):
+    """Many /chat requests against a local fake OpenAI-compatible server."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeOpenAI(CHUNKS, first_delay=FIRST_DELAY, delay=0.01)
+        self.base_url = await self.server.start()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    async def asyncTearDown(self) -> None:
+        await self.cog.cog_unload()
+        await self.server.close()
+
+    def make_cog(self, max_concurrency: int, max_queue: int) -> AI:
+        environ = mock.patch.dict(
+            os.environ,
+            {
+                "OPENAI_BASE_URL": self.base_url,
+                "OPENAI_API_KEY": "test",
+                "OPENAI_MODEL_NAME": "test-model",
+                "AI_MAX_CONCURRENCY": str(max_concurrency),
+                "AI_MAX_QUEUE": str(max_queue),
+                # Every answer trims the conversation, so every /chat is followed by a compaction
+                "AI_CONVERSATION_SUMMARY": "true",
+                "AI_CONVERSATION_TURNS": "1",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        self.cog = AI(mock.Mock(), None)
+        self.cog.semantic_cache = SemanticCache(
+            self.cog.backends,
+            "test-model",
+            "test-embedding-model",
+            threshold=0.95,
+            max_entries=100,
+            directory=self.directory,
+        )
+        return self.cog
+
+    async def chat(
+        self, cog: AI, ia: FakeInteraction, message: str, finished: ty.List[float]
+    ) -> None:
+        await AI.chat.callback(cog, ia, message)
+        finished.append(time.monotonic())
+
+    async def test_busy_guild(self) -> None:
+        cog = self.make_cog(max_concurrency=2, max_queue=50)
+
+        # One guild floods the bot, then two other guilds send one request each
+        flood: ty.List[float] = []
+        others: ty.List[float] = []
+        start = time.monotonic()
+        tasks = [
+            asyncio.create_task(
+                self.chat(
+                    cog, FakeInteraction(1, channel), f"Question {channel}", flood
+                )
+            )
+            for channel in range(12)
+        ]
+        await asyncio.sleep(0.05)
+        tasks += [
+            asyncio.create_task(
+                self.chat(cog, FakeInteraction(guild, 100 + guild), "Hello", others)
+            )
+            for guild in (2, 3)
+        ]
+        await asyncio.gather(*tasks)
+        # Wait for the conversation summaries
+        while cog.background_tasks:
+            await asyncio.gather(*cog.background_tasks)
+
+        print(
+            f"\nServer requests: {self.server.requests}, max in flight: {self.server.max_in_flight}\n"
+            f"Other guilds finished after {', '.join(f'{at - start:.2f}s' for at in others)}, "
+            f"the flood after {flood[len(flood) // 2] - start:.2f}s (median) and {flood[-1] - start:.2f}s (last)\n"
+            + cog.scheduler.summary()
+        )
+
+        # Streams, embeddings and compactions all go through the scheduler
+        self.assertEqual(
+            self.server.requests, {"embed": 14, "stream": 14, "complete": 14}
+        )
+        self.assertLessEqual(self.server.max_in_flight, 2)
+        self.assertEqual(cog.scheduler.served, 28)
+        self.assertEqual(len(cog.scheduler.wait_times), 28)
+        self.assertEqual(len(cog.scheduler.service_times), 28)
+        self.assertEqual((cog.scheduler.active, cog.scheduler.queued), (0, 0))
+
+        # The other guilds do not wait for the whole flood to be served
+        self.assertLess(max(others), flood[len(flood) // 2])
+
+    async def test_full_queue(self) -> None:
+        cog = self.make_cog(max_concurrency=1, max_queue=2)
+
+        interactions = [FakeInteraction(1, channel) for channel in range(6)]
+        finished: ty.List[float] = []
+        start = time.monotonic()
+        await asyncio.gather(
+            *(
+                self.chat(cog, ia, f"Question {i}", finished)
+                for i, ia in enumerate(interactions)
+            )
+        )
+        while cog.background_tasks:
+            await asyncio.gather(*cog.background_tasks)
+
+        # One request is served at once, two wait in the queue, the rest are rejected right away
+        rejected = [
+            ia
+            for ia in interactions
+            if ia.followup.messages
+            and ia.followup.messages[-1].content
+            == "The AI is too busy right now. Please try again later."
+        ]
+        self.assertEqual(len(rejected), 3)
+        self.assertEqual(cog.scheduler.rejected, 3)
+        self.assertLess(finished[2] - start, FIRST_DELAY)
+
+    async def test_failed_queue_notice(self) -> None:
+        cog = self.make_cog(max_concurrency=1, max_queue=2)
+
+        first, second = FakeInteraction(1, 1), FakeInteraction(1, 2)
+        # The queue position of the second request cannot be shown
+        second.followup.failures = 1
+        finished: ty.List[float] = []
+        with self.assertLogs("my_discord_bot.cogs._ai_scheduler", "WARNING"):
+            await asyncio.gather(
+                self.chat(cog, first, "Question 1", finished),
+                self.chat(cog, second, "Question 2", finished),
+            )
+        while cog.background_tasks:
+            await asyncio.gather(*cog.background_tasks)
+
+        # It is served anyway
+        self.assertEqual(second.followup.messages[-1].content, "".join(CHUNKS))
+        self.assertEqual(cog.scheduler.served, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeFileServer, LoopLagProbe
+
+from my_discord_bot.cogs._gallery_dl import DownloadPool, DownloadTimeoutError
+
+FILES = {f"{i}.jpg": os.urandom(2 * 1024 * 1024) for i in range(5)}
+
+
+class DownloadPoolTest(unittest.IsolatedAsyncioTestCase):
+    """gallery-dl worker processes downloading from a local file server."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeFileServer({**FILES, "hung.jpg": b"0" * 1024}, {"hung.jpg"})
+        self.base_url = await self.server.start()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.jobs = Path(directory.name) / "jobs"
+
+    async def asyncTearDown(self) -> None:
+        await self.server.close()
+
+    async def download(self, pool: DownloadPool, name: str) -> bytes:
+        async with pool.download(f"{self.base_url}/{name}", []) as result:
+            self.assertEqual(result.status, 0)
+            self.assertEqual(len(result.files), 1)
+            return result.files[0].read_bytes()
+
+    async def test_concurrent_downloads(self) -> None:
+        # The debug mode of the test loop records a traceback for every callback, which makes
+        # starting the workers stall it far longer than in production
+        asyncio.get_running_loop().set_debug(False)
+        pool = DownloadPool(self.jobs, max_workers=5, timeout=60)
+
+        async with LoopLagProbe() as probe:
+            start = time.monotonic()
+            downloads = await asyncio.gather(
+                *(self.download(pool, name) for name in FILES)
+            )
+            duration = time.monotonic() - start
+
+        print(
+            f"\n{len(FILES)} concurrent downloads took {duration:.2f}s, "
+            f"max event loop lag: {probe.max_lag * 1000:.1f}ms"
+        )
+        self.assertEqual(downloads, list(FILES.values()))
+        # The workers do the downloading, not the event loop
+        self.assertLess(probe.max_lag, 0.1)
+        # Downloaded files are deleted after use
+        self.assertEqual(list(self.jobs.iterdir()), [])
+
+    async def test_hung_worker(self) -> None:
+        pool = DownloadPool(self.jobs, max_workers=5, timeout=5)
+
+        killed = []
+        kill = DownloadPool._kill
+
+        def record_kill(process: asyncio.subprocess.Process) -> None:
+            killed.append(process.pid)
+            kill(process)
+
+        with mock.patch.object(DownloadPool, "_kill", staticmethod(record_kill)):
+            start = time.monotonic()
+            with self.assertRaises(DownloadTimeoutError):
+                await self.download(pool, "hung.jpg")
+            self.assertLess(time.monotonic() - start, 6)
+
+        # The whole process group of the worker is gone, and so is its job directory
+        self.assertEqual(len(killed), 1)
+        with self.assertRaises(ProcessLookupError):
+            os.killpg(killed[0], 0)
+        self.assertEqual(list(self.jobs.iterdir()), [])
+
+        # Other jobs are not affected
+        self.assertEqual(await self.download(pool, "0.jpg"), FILES["0.jpg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
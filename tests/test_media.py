@@ -0,0 +1,61 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from my_discord_bot.cogs import _media
+
+MAX_BYTES = 1024 * 1024
+# No memory limit besides the machine's
+MEMORY_BYTES = 2**62
+
+
+def noisy_image(width: int, height: int, channels: int) -> Image.Image:
+    """A gradient with noise, which compresses about as badly as a detailed illustration."""
+
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    pixels = gradient + rng.normal(0, 24, (height, width, channels))
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+class FitImageTest(unittest.TestCase):
+    def setUp(self) -> None:
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def test_jpeg(self) -> None:
+        path = self.directory / "image.jpg"
+        noisy_image(4000, 3000, 3).save(path, "JPEG", quality=95)
+        self.assertGreater(path.stat().st_size, 4 * MAX_BYTES)
+
+        output = _media.fit_image(path, MAX_BYTES, MEMORY_BYTES)
+
+        self.assertEqual(output, path)
+        self.assertLessEqual(output.stat().st_size, MAX_BYTES)
+        # Not shrunk much more than needed
+        self.assertGreater(output.stat().st_size, MAX_BYTES * _media.SIZE_MARGIN / 2)
+        with Image.open(output) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertAlmostEqual(image.size[0] / image.size[1], 4000 / 3000, 2)
+
+    def test_transparent_png(self) -> None:
+        path = self.directory / "image.png"
+        noisy_image(1500, 1000, 4).save(path, "PNG")
+        self.assertGreater(path.stat().st_size, 2 * MAX_BYTES)
+
+        output = _media.fit_image(path, MAX_BYTES, MEMORY_BYTES)
+
+        # Transparency is kept
+        self.assertEqual(output, path)
+        self.assertLessEqual(output.stat().st_size, MAX_BYTES)
+        with Image.open(output) as image:
+            self.assertEqual((image.format, image.mode), ("PNG", "RGBA"))
+            self.assertLess(image.size, (1500, 1000))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import types
+import unittest
+
+from fakes import FakePixiv
+
+from my_discord_bot.cogs._pixiv_meta import (
+    HEADERS,
+    Artwork,
+    ArtworkNotFoundError,
+    PixivMetadata,
+)
+from my_discord_bot.cogs.general import General
+
+ALBUM = {
+    "illustId": "12345",
+    "illustTitle": "Album",
+    "userName": "Author",
+    "userId": "678",
+    "pageCount": 3,
+    "illustType": 0,
+    "urls": {
+        "mini": "https://i.pximg.net/c/48x48/img-master/img/2024/01/02/03/04/05/12345_p0_square1200.jpg",
+        "regular": "https://i.pximg.net/img-master/img/2024/01/02/03/04/05/12345_p0_master1200.jpg",
+        "original": "https://i.pximg.net/img-original/img/2024/01/02/03/04/05/12345_p0.png",
+    },
+}
+# Without login, the URLs of R-18 artworks are hidden
+HIDDEN = {
+    **ALBUM,
+    "illustId": "23456",
+    "pageCount": 1,
+    "urls": {"mini": None, "regular": None, "original": None},
+}
+UGOIRA = {**ALBUM, "illustId": "34567", "pageCount": 1, "illustType": 2}
+
+
+class PixivMetadataTest(unittest.IsolatedAsyncioTestCase):
+    """Pixiv embeds against a local stand-in of the AJAX API."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakePixiv(
+            {int(body["illustId"]): body for body in (ALBUM, HIDDEN, UGOIRA)}
+        )
+        self.meta = PixivMetadata(
+            await self.server.start() + "/", "https://proxy.example/i/", timeout=5
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.meta.close()
+        await self.server.close()
+
+    async def test_fetch(self) -> None:
+        artwork = await self.meta.fetch(12345)
+
+        self.assertEqual(
+            artwork,
+            Artwork(
+                id=12345,
+                title="Album",
+                author="Author",
+                author_id=678,
+                page_count=3,
+                is_ugoira=False,
+                image_url=ALBUM["urls"]["regular"],
+            ),
+        )
+        self.assertEqual(self.server.requests[0].headers["Referer"], HEADERS["Referer"])
+        self.assertTrue((await self.meta.fetch(34567)).is_ugoira)
+
+    async def test_not_found(self) -> None:
+        with self.assertRaises(ArtworkNotFoundError):
+            await self.meta.fetch(99999)
+
+    async def test_image_urls(self) -> None:
+        artwork = await self.meta.fetch(12345)
+
+        # Pages are rewritten from the first one, and point to the proxy instead of i.pximg.net
+        self.assertEqual(
+            [self.meta.image_url(artwork, number) for number in (1, 2, 3)],
+            [
+                f"https://proxy.example/i/img-master/img/2024/01/02/03/04/05/12345_p{page}_master1200.jpg"
+                for page in (0, 1, 2)
+            ],
+        )
+        self.assertIsNone(self.meta.image_url(await self.meta.fetch(23456), 1))
+
+    async def test_embed(self) -> None:
+        artwork = await self.meta.fetch(12345)
+        cog = types.SimpleNamespace(pixiv_meta=self.meta)
+
+        embed = General.artwork_embed(cog, artwork, 2)
+
+        self.assertEqual(
+            embed.image.url,
+            "https://proxy.example/i/img-master/img/2024/01/02/03/04/05/12345_p1_master1200.jpg",
+        )
+        self.assertEqual(embed.url, "https://www.pixiv.net/artworks/12345")
+        self.assertEqual(embed.author.url, "https://www.pixiv.net/users/678")
+        self.assertEqual(embed.footer.text, "2/3")
+
+
+if __name__ == "__main__":
+    unittest.main()
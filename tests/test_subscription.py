@@ -0,0 +1,184 @@
+import asyncio
+import datetime as dt
+import tempfile
+import typing as ty
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeYouTube, temp_database
+from sqlalchemy import func, select
+
+from my_discord_bot.cogs import _youtube
+from my_discord_bot.cogs._youtube import YouTubeError
+from my_discord_bot.cogs.subscription import MAX_PLAYLIST_PAGES, Subscription
+from my_discord_bot.models import Announcement, Guild, YoutubeChannel
+from my_discord_bot.models import Subscription as Sub
+
+LAST_CHECKED_AT = dt.datetime(2024, 1, 1)
+
+
+def uploads(count: int) -> ty.List[ty.Tuple[str, str]]:
+    """Videos published one hour apart after LAST_CHECKED_AT, newest first."""
+
+    return [
+        (
+            f"video{i}",
+            (LAST_CHECKED_AT + dt.timedelta(hours=i + 1)).strftime(
+                "%Y-%m-%dT%H:%M:%SZ"
+            ),
+        )
+        for i in reversed(range(count))
+    ]
+
+
+class PollTest(unittest.IsolatedAsyncioTestCase):
+    """Polls of upload playlists against a local stand-in of the YouTube Data API."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeYouTube(
+            {
+                # More new videos than are read in a poll
+                "UUbusy": uploads(250),
+                "UUquiet": uploads(3),
+            }
+        )
+        environ = mock.patch.dict(
+            "os.environ",
+            {"GOOGLE_API_KEY": "test", "YOUTUBE_API_URL": await self.server.start()},
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+        # No need to wait seconds between retries
+        retry_delay = mock.patch.object(_youtube, "RETRY_DELAY", 0.01)
+        retry_delay.start()
+        self.addCleanup(retry_delay.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine, sessionmaker = await temp_database(Path(directory.name))
+
+        async with sessionmaker() as session:
+            guild = Guild(guild_id=1, guild_name="Guild", bot_channel=100)
+            self.channels = [
+                YoutubeChannel(
+                    youtube_channel_id=f"UC{name}",
+                    youtube_channel_name=name,
+                    youtube_upload_playlist=f"UU{name}",
+                    last_checked_at=LAST_CHECKED_AT,
+                )
+                for name in ("busy", "quiet")
+            ]
+            session.add_all(
+                [Sub(guild=guild, channel=channel) for channel in self.channels]
+            )
+            await session.commit()
+
+        bot = mock.Mock()
+        # The background tasks of the cog wait forever
+        bot.wait_until_ready = asyncio.Event().wait
+        self.cog = Subscription(bot, sessionmaker)
+
+    async def asyncTearDown(self) -> None:
+        await self.cog.cog_unload()
+        await self.server.close()
+        await self.engine.dispose()
+
+    async def poll(self) -> ty.Dict[int, YoutubeChannel]:
+        loaded: ty.Dict[int, YoutubeChannel] = {}
+        await self.cog.poll_channels([channel.id for channel in self.channels], loaded)
+        return loaded
+
+    async def announcements(self) -> int:
+        async with self.cog.sessionmaker() as session:
+            return await session.scalar(select(func.count()).select_from(Announcement))
+
+    async def test_pagination(self) -> None:
+        busy, quiet = self.channels
+
+        new_uploads = await self.cog.fetch_new_video_ids(busy)
+
+        # Up to MAX_PLAYLIST_PAGES pages of 50 videos are read, newest first
+        self.assertEqual(len(self.server.requests), MAX_PLAYLIST_PAGES)
+        self.assertEqual(
+            [params.get("pageToken") for params, _ in self.server.requests],
+            [None, "50", "100", "150"],
+        )
+        self.assertEqual(
+            new_uploads.video_ids, [f"video{i}" for i in range(249, 49, -1)]
+        )
+        self.assertEqual(len(new_uploads.upload_times), 200)
+
+        # Reading stops at the first video published before the last check
+        self.server.requests.clear()
+        quiet.last_checked_at = LAST_CHECKED_AT + dt.timedelta(hours=1, minutes=30)
+        new_uploads = await self.cog.fetch_new_video_ids(quiet)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(new_uploads.video_ids, ["video2", "video1"])
+
+    async def test_retries(self) -> None:
+        busy, _ = self.channels
+
+        # Rate limits and server errors are retried
+        self.server.errors = [500, 429, 503]
+        with self.assertLogs("my_discord_bot.cogs._youtube", "WARNING") as logs:
+            new_uploads = await self.cog.fetch_new_video_ids(busy)
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(len(new_uploads.video_ids or []), 200)
+        self.assertEqual(self.cog.youtube.requests, MAX_PLAYLIST_PAGES + 3)
+
+        # Until the retries run out
+        self.server.errors = [500] * 4
+        with self.assertLogs("my_discord_bot.cogs._youtube", "WARNING"):
+            with self.assertRaises(YouTubeError) as error:
+                await self.cog.fetch_new_video_ids(busy)
+        self.assertEqual(error.exception.status, 500)
+
+        # Other errors are not retried; A channel failing to be checked does not stop the others,
+        # and is checked again from the same point next time
+        del self.server.playlists["UUquiet"]
+        self.server.requests.clear()
+        with self.assertLogs("my_discord_bot.cogs.subscription", "ERROR"):
+            loaded = await self.poll()
+        self.assertEqual(len(self.server.requests), MAX_PLAYLIST_PAGES + 1)
+        self.assertEqual(
+            [
+                channel.youtube_channel_id
+                for channel in loaded.values()
+                if channel.last_checked_at != LAST_CHECKED_AT
+            ],
+            ["UCbusy"],
+        )
+        self.assertEqual(await self.announcements(), 200)
+
+    async def test_unchanged_playlist(self) -> None:
+        # The first poll reads the playlists and queues the new videos
+        loaded = await self.poll()
+        self.assertEqual(await self.announcements(), 203)
+        self.assertEqual(len(self.server.requests), MAX_PLAYLIST_PAGES + 1)
+        self.assertEqual((self.cog.etags.hits, self.cog.etags.misses), (0, 2))
+        for channel in self.channels:
+            self.assertNotEqual(loaded[channel.id].last_checked_at, LAST_CHECKED_AT)
+
+        # Nothing was uploaded: One request per channel with the cached ETag, answered 304
+        self.server.requests.clear()
+        await self.poll()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(all(etag for _, etag in self.server.requests))
+        self.assertEqual((self.cog.etags.hits, self.cog.etags.misses), (2, 2))
+        self.assertEqual(await self.announcements(), 203)
+
+        # A new upload changes the ETag of the first page
+        published_at = (dt.datetime.now(dt.UTC) + dt.timedelta(minutes=1)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+        self.server.playlists["UUquiet"].insert(0, ("new", published_at))
+        self.server.requests.clear()
+        await self.poll()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual((self.cog.etags.hits, self.cog.etags.misses), (3, 3))
+        self.assertEqual(await self.announcements(), 204)
+
+
+if __name__ == "__main__":
+    unittest.main()
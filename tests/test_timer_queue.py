@@ -0,0 +1,214 @@
+import asyncio
+import datetime as dt
+import random
+import tempfile
+import time
+import tracemalloc
+import typing as ty
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeYouTube, temp_database
+from sqlalchemy import select
+
+from my_discord_bot.cogs._timer_queue import TimerQueue
+from my_discord_bot.cogs.subscription import ISO_FORMAT, Subscription, timestamp
+from my_discord_bot.models import Guild, StreamReminder, YoutubeChannel
+from my_discord_bot.models import Subscription as Sub
+
+
+class TimerQueueTest(unittest.IsolatedAsyncioTestCase):
+    """Timers of stream reminders."""
+
+    async def asyncSetUp(self) -> None:
+        # Keys fired by each callback
+        self.fired: ty.List[ty.List[int]] = []
+        self.all_fired = asyncio.Event()
+        self.expected = 0
+        self.queue = TimerQueue(self.callback)
+
+    async def asyncTearDown(self) -> None:
+        self.queue.stop()
+
+    async def callback(self, keys: ty.List[int]) -> None:
+        self.fired.append(keys)
+        if sum(map(len, self.fired)) >= self.expected:
+            self.all_fired.set()
+
+    async def test_firing_order(self) -> None:
+        now = time.time()
+        dues = {key: now + 0.02 * (key % 10) for key in range(100)}
+        keys = list(dues)
+        random.Random(0).shuffle(keys)
+        for key in keys:
+            self.queue.schedule(key, dues[key])
+
+        self.expected = 100
+        self.queue.start()
+        await asyncio.wait_for(self.all_fired.wait(), 5)
+
+        # Every timer fires once, in order of due time; Timers due together fire together
+        fired = [key for keys in self.fired for key in keys]
+        self.assertEqual(sorted(fired), list(range(100)))
+        self.assertEqual(
+            [dues[key] for key in fired], sorted(dues[key] for key in fired)
+        )
+        self.assertLessEqual(len(self.fired), 10)
+        self.assertEqual(len(self.queue), 0)
+
+    async def test_cancel_and_reschedule(self) -> None:
+        self.queue.start()
+        now = time.time()
+        self.queue.schedule(1, now + 0.05)
+        self.queue.schedule(2, now + 0.05)
+        self.queue.schedule(3, now + 0.1)
+        # Cancelled, moved later, and moved earlier while the task sleeps until the earliest timer
+        self.queue.cancel(1)
+        self.queue.schedule(2, now + 0.15)
+        self.queue.schedule(4, now + 60)
+        await asyncio.sleep(0)
+        self.queue.schedule(4, now)
+
+        self.expected = 3
+        await asyncio.wait_for(self.all_fired.wait(), 5)
+        self.assertEqual(self.fired, [[4], [3], [2]])
+        self.assertEqual(len(self.queue), 0)
+
+        # The stale entries are skipped, and nothing else fires
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.fired, [[4], [3], [2]])
+        self.assertEqual(self.queue.heap, [])
+
+    async def test_rebuild(self) -> None:
+        now = time.time()
+        for key in range(1000):
+            self.queue.schedule(key, now + 3600 + key)
+        # Every timer moved 10 times: The heap is rebuilt before it exceeds 2x the timers (+64)
+        for _ in range(10):
+            for key in range(1000):
+                self.queue.schedule(key, now + 3600 + random.random() * 1000)
+                self.assertLessEqual(len(self.queue.heap), 2 * len(self.queue) + 64)
+        self.assertEqual(len(self.queue), 1000)
+
+        # Cancelled timers are dropped by the next rebuild
+        for key in range(990):
+            self.queue.cancel(key)
+        self.queue.schedule(1000, now + 3600)
+        self.assertLessEqual(len(self.queue.heap), 2 * 11 + 64)
+        self.assertEqual(
+            sorted(key for _, key in self.queue.heap if self.queue.due.get(key)),
+            list(range(990, 1001)),
+        )
+
+    async def test_memory(self) -> None:
+        count = 100000
+        now = time.time()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for key in range(count):
+                self.queue.schedule(key, now + 3600 + key)
+            size = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+
+        print(f"\n{count} pending timers: {size / count:.0f} bytes each")
+        # A heap entry and a dict entry, with the key and due time
+        self.assertLess(size / count, 300)
+
+
+class RefreshRemindersTest(unittest.IsolatedAsyncioTestCase):
+    """Reminders of streams rescheduled to an earlier time (fixed in 992b6d1)."""
+
+    async def asyncSetUp(self) -> None:
+        self.server = FakeYouTube({})
+        environ = mock.patch.dict(
+            "os.environ",
+            {
+                "GOOGLE_API_KEY": "test",
+                "YOUTUBE_API_URL": await self.server.start(),
+                "YOUTUBE_REMINDER_OFFSETS": "10,0",
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine, sessionmaker = await temp_database(Path(directory.name))
+        async with sessionmaker() as session:
+            self.channel = YoutubeChannel(
+                youtube_channel_id="UCchannel",
+                youtube_channel_name="Channel",
+                youtube_upload_playlist="UUchannel",
+            )
+            session.add(
+                Sub(
+                    guild=Guild(guild_id=1, guild_name="Guild", bot_channel=100),
+                    channel=self.channel,
+                )
+            )
+            await session.commit()
+
+        self.bot_channel = mock.Mock(id=100)
+        self.bot_channel.send = mock.AsyncMock()
+        bot = mock.Mock()
+        bot.wait_until_ready = mock.AsyncMock()
+        bot.get_channel.return_value = self.bot_channel
+        self.cog = Subscription(bot, sessionmaker)
+        # Only the reminders run, without the other background tasks
+        self.cog.check_subscription.cancel()
+        self.cog.reminders.start()
+
+    async def asyncTearDown(self) -> None:
+        await self.cog.cog_unload()
+        await self.server.close()
+        await self.engine.dispose()
+
+    def stream(self, start: dt.datetime) -> ty.Dict[str, ty.Any]:
+        video = {
+            "id": "stream",
+            "snippet": {"title": "Stream"},
+            "liveStreamingDetails": {"scheduledStartTime": start.strftime(ISO_FORMAT)},
+        }
+        self.server.videos["stream"] = video
+        return video
+
+    async def test_moved_earlier(self) -> None:
+        now = dt.datetime.now(dt.UTC).replace(tzinfo=None, microsecond=0)
+        await self.cog.add_reminders(
+            [(self.stream(now + dt.timedelta(hours=2)), self.channel.id)]
+        )
+        self.assertEqual(len(self.cog.reminders), 2)
+
+        # The stream is moved to 8 minutes from now: The 10-minute reminder is due already
+        start = now + dt.timedelta(minutes=8)
+        self.stream(start)
+        await self.cog.refresh_reminders()
+        for _ in range(100):
+            if self.bot_channel.send.await_count:
+                break
+            await asyncio.sleep(0.05)
+
+        self.bot_channel.send.assert_awaited_once()
+        self.assertIn(
+            f"Starting <t:{timestamp(start):.0f}:R>!",
+            self.bot_channel.send.await_args.args[0],
+        )
+
+        # The reminder at the start of the stream follows it
+        async with self.cog.sessionmaker() as session:
+            reminders = (await session.execute(select(StreamReminder))).scalars().all()
+        self.assertEqual(
+            [
+                (reminder.minutes_before, reminder.scheduled_start_time)
+                for reminder in reminders
+            ],
+            [(0, start)],
+        )
+        self.assertEqual(list(self.cog.reminders.due.values()), [timestamp(start)])
+
+
+if __name__ == "__main__":
+    unittest.main()
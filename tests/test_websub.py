@@ -0,0 +1,190 @@
+import asyncio
+import datetime as dt
+import tempfile
+import typing as ty
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fakes import FakeHub, temp_database
+from sqlalchemy import select
+
+from my_discord_bot.cogs._websub import LEASE_SECONDS, TOPIC_URL
+from my_discord_bot.cogs.subscription import Subscription
+from my_discord_bot.models import Announcement, Guild, YoutubeChannel
+from my_discord_bot.models import Subscription as Sub
+
+CHANNEL_ID = "UCchannel"
+TOPIC = TOPIC_URL.format(channel_id=CHANNEL_ID)
+
+
+def feed(*entries: ty.Tuple[str, str]) -> bytes:
+    """Atom feed of the videos (video ID, channel ID), published now."""
+
+    published = dt.datetime.now(dt.UTC).isoformat()
+    return (
+        '<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns="http://www.w3.org/2005/Atom">'
+        + "".join(
+            f"<entry><yt:videoId>{video_id}</yt:videoId><yt:channelId>{channel_id}</yt:channelId>"
+            f"<published>{published}</published></entry>"
+            for video_id, channel_id in entries
+        )
+        + "</feed>"
+    ).encode()
+
+
+class WebSubTest(unittest.IsolatedAsyncioTestCase):
+    """Push notifications of new uploads from a local WebSub hub."""
+
+    async def asyncSetUp(self) -> None:
+        self.hub = FakeHub(LEASE_SECONDS)
+        environ = mock.patch.dict(
+            "os.environ",
+            {
+                "GOOGLE_API_KEY": "test",
+                # The port is only known once the receiver is started
+                "WEBSUB_CALLBACK_URL": "http://127.0.0.1/websub",
+                "WEBSUB_SECRET": "secret",
+                "WEBSUB_HUB_URL": await self.hub.start(),
+            },
+        )
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine, sessionmaker = await temp_database(Path(directory.name))
+        async with sessionmaker() as session:
+            session.add(
+                Sub(
+                    guild=Guild(guild_id=1, guild_name="Guild", bot_channel=100),
+                    channel=YoutubeChannel(
+                        youtube_channel_id=CHANNEL_ID,
+                        youtube_channel_name="Channel",
+                        youtube_upload_playlist="UUchannel",
+                    ),
+                )
+            )
+            await session.commit()
+
+        bot = mock.Mock()
+        # The background tasks of the cog wait forever
+        bot.wait_until_ready = asyncio.Event().wait
+        self.cog = Subscription(bot, sessionmaker)
+        self.websub = self.cog.websub
+        assert self.websub is not None
+        await self.websub.start("127.0.0.1", 0)
+        assert self.websub.runner is not None
+        host, port = self.websub.runner.addresses[0][:2]
+        self.websub.callback_url = f"http://{host}:{port}/websub"
+
+    async def asyncTearDown(self) -> None:
+        await self.cog.cog_unload()
+        await self.hub.close()
+        await self.engine.dispose()
+
+    async def announced(self) -> ty.List[str]:
+        # Wait for the notifications being handled
+        await asyncio.gather(*self.websub.tasks)
+        async with self.cog.sessionmaker() as session:
+            return list(
+                (
+                    await session.execute(
+                        select(Announcement.video_id).order_by(Announcement.id)
+                    )
+                ).scalars()
+            )
+
+    async def test_verification(self) -> None:
+        await self.cog.request_websub(CHANNEL_ID, subscribe=True)
+
+        # The hub verified the intent, and accepted it as the challenge was echoed
+        self.assertEqual(len(self.hub.requests), 1)
+        self.assertEqual(self.hub.requests[0]["hub.mode"], "subscribe")
+        self.assertEqual(self.hub.requests[0]["hub.topic"], TOPIC)
+        self.assertEqual(self.hub.verifications[0][0], 200)
+        self.assertIn(TOPIC, self.hub.subscribers)
+        self.assertFalse(self.websub.needs_renewal(CHANNEL_ID))
+
+        # Subscriptions this bot did not ask for are not confirmed
+        self.assertEqual(
+            await self.hub.get(
+                self.websub.callback_url,
+                {
+                    "hub.mode": "subscribe",
+                    "hub.topic": TOPIC_URL.format(channel_id="UCother"),
+                    "hub.challenge": "challenge",
+                },
+            ),
+            (404, ""),
+        )
+        self.assertNotIn("UCother", self.websub.leases)
+
+        await self.cog.request_websub(CHANNEL_ID, subscribe=False)
+        self.assertEqual(self.hub.verifications[-1][0], 200)
+        self.assertNotIn(TOPIC, self.hub.subscribers)
+        self.assertNotIn(CHANNEL_ID, self.websub.leases)
+
+    async def test_notification(self) -> None:
+        await self.cog.request_websub(CHANNEL_ID, subscribe=True)
+
+        # Videos of channels nobody subscribed to are skipped
+        body = feed(("video1", CHANNEL_ID), ("video2", "UCother"))
+        self.assertEqual(await self.hub.publish(TOPIC, body), 204)
+        self.assertEqual(await self.announced(), ["video1"])
+
+        # Feeds with a bad signature are acknowledged, but ignored
+        with self.assertLogs("my_discord_bot.cogs._websub", "WARNING"):
+            self.assertEqual(
+                await self.hub.publish(
+                    TOPIC, feed(("video3", CHANNEL_ID)), secret="wrong"
+                ),
+                204,
+            )
+        self.assertEqual(await self.announced(), ["video1"])
+
+        # Videos pushed again (e.g. edited) are announced once
+        self.assertEqual(await self.hub.publish(TOPIC, body), 204)
+        self.assertEqual(await self.announced(), ["video1"])
+
+        async with self.cog.sessionmaker() as session:
+            channel = await session.scalar(select(YoutubeChannel))
+        assert channel is not None
+        self.assertIsNotNone(channel.last_upload_at)
+
+    async def test_renewal(self) -> None:
+        await self.cog.request_websub(CHANNEL_ID, subscribe=True)
+        # A channel unsubscribed from while the bot was offline
+        await self.cog.request_websub("UCgone", subscribe=True)
+        self.hub.requests.clear()
+
+        # Nothing to renew yet; Channels no longer subscribed to are dropped
+        await self.cog.renew_websub()
+        self.assertEqual(
+            [(form["hub.mode"], form["hub.topic"]) for form in self.hub.requests],
+            [("unsubscribe", TOPIC_URL.format(channel_id="UCgone"))],
+        )
+        self.assertEqual(list(self.websub.leases), [CHANNEL_ID])
+
+        # Four days later, the lease expires within a day
+        expiry = self.websub.leases[CHANNEL_ID]
+        assert expiry is not None
+        self.websub.leases[CHANNEL_ID] = expiry - dt.timedelta(days=4, hours=1)
+        self.assertTrue(self.websub.needs_renewal(CHANNEL_ID))
+
+        self.hub.requests.clear()
+        await self.cog.renew_websub()
+        self.assertEqual(
+            [(form["hub.mode"], form["hub.topic"]) for form in self.hub.requests],
+            [("subscribe", TOPIC)],
+        )
+        self.assertFalse(self.websub.needs_renewal(CHANNEL_ID))
+
+        # The hub may grant shorter leases than requested
+        self.hub.lease_seconds = 3600
+        await self.cog.request_websub(CHANNEL_ID, subscribe=True)
+        self.assertTrue(self.websub.needs_renewal(CHANNEL_ID))
+
+
+if __name__ == "__main__":
+    unittest.main()